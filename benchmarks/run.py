@@ -0,0 +1,208 @@
+"""Time dictionary parsing, schema mapping, code emission and loading.
+
+    python -m benchmarks.run run --output results.json
+    python -m benchmarks.run run --output new.json --baseline results.json
+    python -m benchmarks.run compare results.json new.json
+
+Without --dictionary, a synthetic dictionary and entries are generated
+in a temporary directory, so the suite runs offline.
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import statistics
+
+import click
+from sqlalchemy import create_engine
+
+from mmcif_db_tool import __version__
+from mmcif_db_tool.cache import DictCache
+from mmcif_db_tool.loader import EntryLoader
+from mmcif_db_tool.mmcif_dict import DictReader
+from mmcif_db_tool.schema_map import SchemaMap, SqlAlchemyCorePrinter, SqlAlchemyOrmPrinter
+from benchmarks import synthetic
+
+RESULTS_FORMAT = 1
+
+
+def measure(fn, setup=None, repeat=5):
+    """Run `fn` `repeat` times on a fresh value of `setup()` each time
+    and return the wall times of the runs, in seconds. Only `fn` is
+    timed."""
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summary(times):
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "max": max(times),
+        "runs": times,
+    }
+
+
+def print_models(printer, categories):
+    sm = SchemaMap(printer=printer(fp=io.StringIO(), include_imports=True))
+    sm.add_categories(categories)
+    sm.print_models()
+
+
+def load_entries(tables, entries):
+    loader = EntryLoader(create_engine("sqlite://"), tables)
+    loader.create_tables()
+    loader.load_files(entries)
+    if loader.failed:
+        raise RuntimeError(f"Failed to load {loader.failed}")
+
+
+def run_benchmarks(dictionary, entries, repeat):
+    reader = DictReader(dictionary)
+    names = reader.get_category_names()
+    categories = reader.get_categories(names)
+    sm = SchemaMap(entry_column="entry_id")
+    sm.add_categories(categories)
+    tables = sm.get_tables()
+
+    benchmarks = {
+        "dict_reader_init": (lambda _: DictReader(dictionary), None),
+        "get_categories_1": (lambda r: r.get_categories(names[:1]), lambda: DictReader(dictionary)),
+        "get_categories_50": (lambda r: r.get_categories(names[:50]), lambda: DictReader(dictionary)),
+        "get_categories_all": (lambda r: r.get_categories(names), lambda: DictReader(dictionary)),
+        "get_categories_all_indexed": (lambda _: reader.get_categories(names), None),
+        "schema_map_get_tables": (lambda s: s.get_tables(), lambda: _schema_map(categories)),
+        "print_models_orm": (lambda _: print_models(SqlAlchemyOrmPrinter, categories), None),
+        "print_models_core": (lambda _: print_models(SqlAlchemyCorePrinter, categories), None),
+    }
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = DictCache(cache_dir)
+        DictReader(dictionary, cache=cache)
+        benchmarks["dict_reader_init_cached"] = (lambda _: DictReader(dictionary, cache=cache), None)
+        if entries:
+            benchmarks["load_entries"] = (lambda _: load_entries(tables, entries), None)
+
+        results = {}
+        for name, (fn, setup) in benchmarks.items():
+            results[name] = summary(measure(fn, setup, repeat))
+            click.echo(f"{name:30} {results[name]['median'] * 1000:10.2f} ms", err=True)
+
+    return {"categories": len(names), "items": sum(len(c.items) for c in categories)}, results
+
+
+def _schema_map(categories):
+    sm = SchemaMap()
+    sm.add_categories(categories)
+    return sm
+
+
+def compare(baseline, current, threshold):
+    """Return the benchmarks whose median is more than `threshold`
+    (a fraction) slower than in `baseline`, as (name, ratio) pairs."""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or not base["median"]:
+            continue
+
+        ratio = result["median"] / base["median"]
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def report(baseline, current, threshold):
+    regressions = dict(compare(baseline, current, threshold))
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            click.echo(f"{name:30} {'new':>10}")
+            continue
+
+        ratio = result["median"] / base["median"] if base["median"] else float("nan")
+        flag = "  REGRESSION" if name in regressions else ""
+        click.echo(f"{name:30} {base['median'] * 1000:10.2f} -> {result['median'] * 1000:10.2f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        data = json.load(f)
+
+    if data.get("format") != RESULTS_FORMAT:
+        raise click.ClickException(f"Unsupported results format in {path}: {data.get('format')}")
+    return data
+
+
+@click.group()
+def cli():
+    """Benchmarks of mmcif_db_tool."""
+
+
+@cli.command("run")
+@click.option("--output", required=True, type=click.Path(dir_okay=False), help="Path to the results file (JSON)")
+@click.option("--dictionary", type=click.Path(exists=True, dir_okay=False), help="Benchmark this dictionary instead of a synthetic one")
+@click.option("--categories", type=click.IntRange(min=1), default=500, show_default=True, help="Categories of the synthetic dictionary")
+@click.option("--items", type=click.IntRange(min=3), default=15, show_default=True, help="Items per category of the synthetic dictionary")
+@click.option("--entries", type=click.IntRange(min=0), default=5, show_default=True, help="Synthetic entries loaded into SQLite, 0 to skip loading")
+@click.option("--rows", type=click.IntRange(min=1), default=20, show_default=True, help="Rows per category of the synthetic entries")
+@click.option("--repeat", type=click.IntRange(min=1), default=5, show_default=True, help="Runs of each benchmark")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="Results to compare with. Exits with status 1 on regressions")
+@click.option("--threshold", type=float, default=0.2, show_default=True, help="Slowdown of the median, as a fraction, flagged as a regression")
+def run(output, dictionary, categories, items, entries, rows, repeat, baseline, threshold):
+    """Run the benchmarks and write their wall times to OUTPUT."""
+    with tempfile.TemporaryDirectory() as tmp:
+        params = {"repeat": repeat}
+        if dictionary is None:
+            dictionary = os.path.join(tmp, "synthetic.dic")
+            synthetic.write_dictionary(dictionary, categories, items)
+            params["synthetic"] = {"categories": categories, "items": items, "entries": entries, "rows": rows}
+
+        entry_files = []
+        if "synthetic" in params and entries:
+            reader = DictReader(dictionary)
+            cat_objs = reader.get_categories(reader.get_category_names())
+            for i in range(entries):
+                path = os.path.join(tmp, f"syn{i}.cif")
+                synthetic.write_entry(path, cat_objs, rows, entry_id=f"SYN{i}", seed=i)
+                entry_files.append(path)
+
+        sizes, results = run_benchmarks(dictionary, entry_files, repeat)
+
+    data = {
+        "format": RESULTS_FORMAT,
+        "version": __version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "params": {**params, **sizes},
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(data, f, indent=1)
+
+    if baseline and report(load_results(baseline), data, threshold):
+        sys.exit(1)
+
+
+@cli.command("compare")
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+@click.option("--threshold", type=float, default=0.2, show_default=True, help="Slowdown of the median, as a fraction, flagged as a regression")
+def compare_command(baseline, current, threshold):
+    """Compare the CURRENT results with BASELINE. Exits with status 1
+    on regressions."""
+    if report(load_results(baseline), load_results(current), threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
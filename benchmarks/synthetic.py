@@ -0,0 +1,160 @@
+"""Generate DDL2 dictionaries and matching entries of any size, so the
+benchmarks run offline and scale past the real PDBx/mmCIF dictionary.
+"""
+import random
+
+# item types cycled through by the non-key items of a category
+ITEM_TYPES = ["code", "int", "float", "line", "text", "yyyy-mm-dd", "positive_int", "ucode"]
+
+ENUMERATION = ["alpha", "beta", "gamma", "delta"]
+
+
+# descriptions are multi-line text fields, as in the PDBx/mmCIF dictionary
+DESCRIPTION = (
+    "Data items of this synthetic category or item stand in for the\n"
+    "    descriptions of the real dictionary, which run over several lines."
+)
+
+
+def text_field(tag, text):
+    return f"    {tag}\n;    {text}\n    {DESCRIPTION}\n;\n"
+
+
+def category_name(i):
+    return f"synth_cat_{i:05d}"
+
+
+def parent_index(i):
+    # categories form a binary tree, each one linked to its parent
+    return (i - 1) // 2 if i > 0 else None
+
+
+def write_dictionary(path, categories=100, items=10):
+    """Write a dictionary of `categories` categories with `items` items
+    each, at least 3: a key `id`, an enumerated `kind` and typed
+    items. Every category but the first has a `parent_id` item linked
+    to the key of its parent, defined in the parent key frame as in
+    the PDBx/mmCIF dictionary."""
+    if items < 3:
+        raise ValueError("a synthetic category needs at least 3 items")
+
+    with open(path, "w") as f:
+        f.write("data_synthetic.dic\n\n")
+        f.write("_datablock.id synthetic.dic\n")
+        f.write("_dictionary.title synthetic.dic\n")
+        f.write("_dictionary.version 5.0.0\n\n")
+        for i in range(categories):
+            _write_category(f, i, categories, items)
+
+
+def _write_category(f, i, categories, items):
+    name = category_name(i)
+    parent = parent_index(i)
+    children = [c for c in (2 * i + 1, 2 * i + 2) if c < categories]
+
+    f.write(f"save_{name}\n")
+    f.write(text_field("_category.description", f"Synthetic category {i}."))
+    f.write(f"    _category.id {name}\n")
+    f.write("    _category.mandatory_code no\n")
+    f.write(f'    _category_key.name "_{name}.id"\n')
+    if parent is not None:
+        parent_name = category_name(parent)
+        f.write("    loop_\n")
+        f.write("    _pdbx_item_linked_group_list.child_category_id\n")
+        f.write("    _pdbx_item_linked_group_list.link_group_id\n")
+        f.write("    _pdbx_item_linked_group_list.child_name\n")
+        f.write("    _pdbx_item_linked_group_list.parent_name\n")
+        f.write("    _pdbx_item_linked_group_list.parent_category_id\n")
+        f.write(f'    {name} 1 "_{name}.parent_id" "_{parent_name}.id" {parent_name}\n')
+    f.write("save_\n\n")
+
+    # the key frame also defines the items of the children linked to it
+    f.write(f"save__{name}.id\n")
+    f.write(text_field("_item_description.description", f"Key of {name}."))
+    f.write("    loop_\n")
+    f.write("    _item.name\n")
+    f.write("    _item.category_id\n")
+    f.write("    _item.mandatory_code\n")
+    f.write(f'    "_{name}.id" {name} yes\n')
+    for child in children:
+        f.write(f'    "_{category_name(child)}.parent_id" {category_name(child)} yes\n')
+    f.write("    _item_type.code code\n")
+    if children:
+        f.write("    loop_\n")
+        f.write("    _item_linked.child_name\n")
+        f.write("    _item_linked.parent_name\n")
+        for child in children:
+            f.write(f'    "_{category_name(child)}.parent_id" "_{name}.id"\n')
+    f.write("save_\n\n")
+
+    if parent is not None:
+        f.write(f"save__{name}.parent_id\n")
+        f.write(text_field("_item_description.description", f"Parent of {name}."))
+        f.write(f'    _item.name "_{name}.parent_id"\n')
+        f.write(f"    _item.category_id {name}\n")
+        f.write("    _item.mandatory_code yes\n")
+        f.write("save_\n\n")
+
+    f.write(f"save__{name}.kind\n")
+    f.write(text_field("_item_description.description", f"Kind of {name}."))
+    f.write(f'    _item.name "_{name}.kind"\n')
+    f.write(f"    _item.category_id {name}\n")
+    f.write("    _item.mandatory_code no\n")
+    f.write("    _item_type.code code\n")
+    f.write(f"    _item_default.value {ENUMERATION[0]}\n")
+    f.write("    loop_\n")
+    f.write("    _item_enumeration.value\n")
+    for value in ENUMERATION:
+        f.write(f"    {value}\n")
+    f.write("save_\n\n")
+
+    typed_items = items - 2 - (parent is not None)
+    for j in range(typed_items):
+        f.write(f"save__{name}.value_{j}\n")
+        f.write(text_field("_item_description.description", f"Value {j} of {name}."))
+        f.write(f'    _item.name "_{name}.value_{j}"\n')
+        f.write(f"    _item.category_id {name}\n")
+        f.write("    _item.mandatory_code no\n")
+        f.write(f"    _item_type.code {ITEM_TYPES[j % len(ITEM_TYPES)]}\n")
+        f.write("save_\n\n")
+
+
+def random_value(item, rng):
+    if item.enumerations:
+        return rng.choice(item.enumerations)
+
+    if rng.random() < 0.1 and not item.mandatory_code:
+        return rng.choice("?.")
+
+    type_code = item.type_code
+    if type_code in ("int", "positive_int"):
+        return str(rng.randint(1, 100000))
+    if type_code == "float":
+        return f"{rng.uniform(-500, 500):.3f}"
+    if type_code.startswith("yyyy-mm-dd"):
+        return f"{rng.randint(1990, 2030)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    return f"v{rng.randint(0, 10 ** 6)}"
+
+
+def write_entry(path, categories, rows=100, entry_id="SYN1", seed=0):
+    """Write an entry with `rows` rows in each of `categories`, as read
+    by `DictReader`. Keys run from 1 to `rows`, so every `parent_id`
+    matches a row of the parent category."""
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        f.write(f"data_{entry_id}\n#\n")
+        for category in categories:
+            f.write("loop_\n")
+            for item in category.items:
+                f.write(f"_{category.id}.{item.name}\n")
+            for row in range(1, rows + 1):
+                values = []
+                for item in category.items:
+                    if item.name == "id":
+                        values.append(str(row))
+                    elif item.name == "parent_id":
+                        values.append(str(rng.randint(1, rows)))
+                    else:
+                        values.append(random_value(item, rng))
+                f.write(" ".join(values) + "\n")
+            f.write("#\n")
@@ -0,0 +1,204 @@
+import io
+import os
+import json
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
+
+from mmcif_db_tool.mmcif_dict import ItemFilter
+from mmcif_db_tool.schema_map import LAZY_STRATEGIES, SchemaMap, SqlAlchemyCorePrinter, SqlAlchemyOrmPrinter
+
+logger = logging.getLogger(__name__)
+
+PRINTERS = {"orm": SqlAlchemyOrmPrinter, "core": SqlAlchemyCorePrinter}
+LINKS = ["none", "indexes", "foreign-keys"]
+ENUMS = ["none", "native", "lookup"]
+PARTITION_BY = ["list", "hash"]
+
+
+def enums_option(enums):
+    """SchemaMap `enums` for the value of --enums."""
+    return None if enums == "none" else enums
+
+
+def links_options(links):
+    """SchemaMap options for the value of --links."""
+    return {"ignore_relationships": links == "none", "foreign_keys": links == "foreign-keys"}
+
+
+@dataclass
+class Target:
+    """One output file of a manifest, with the options of
+    `process_categories`. Paths are relative to the manifest."""
+    output_file: str
+    categories: list[str] = None
+    categories_file: str = None
+    include_items_file: str = None
+    exclude_items_file: str = None
+    model: str = "orm"
+    entry_column: str = None
+    partition_by: str = None
+    links: str = "none"
+    enums: str = "none"
+    lazy: dict = field(default_factory=dict)
+    default_lazy: str = None
+    column_profile: str = None
+
+    def validate(self):
+        if (self.categories is None) == (self.categories_file is None):
+            raise ValueError("give either categories or categories_file")
+        if self.include_items_file and self.exclude_items_file:
+            raise ValueError("include_items_file and exclude_items_file are mutually exclusive")
+        if self.model not in PRINTERS:
+            raise ValueError(f"model must be one of {', '.join(PRINTERS)}, got '{self.model}'")
+        if self.links not in LINKS:
+            raise ValueError(f"links must be one of {', '.join(LINKS)}, got '{self.links}'")
+        if self.enums not in ENUMS:
+            raise ValueError(f"enums must be one of {', '.join(ENUMS)}, got '{self.enums}'")
+        if self.partition_by is not None and self.partition_by not in PARTITION_BY:
+            raise ValueError(f"partition_by must be one of {', '.join(PARTITION_BY)}, got '{self.partition_by}'")
+        if self.partition_by and not self.entry_column:
+            raise ValueError("partition_by requires entry_column")
+        for strategy in [*self.lazy.values(), self.default_lazy]:
+            if strategy is not None and strategy not in LAZY_STRATEGIES:
+                raise ValueError(f"loading strategies must be one of {', '.join(LAZY_STRATEGIES)}, got '{strategy}'")
+
+    def category_names(self):
+        if self.categories is not None:
+            return list(self.categories)
+        with open(self.categories_file) as f:
+            return [line.strip() for line in f]
+
+    def item_filter(self):
+        include_items = _read_lines(self.include_items_file) if self.include_items_file else set()
+        exclude_items = _read_lines(self.exclude_items_file) if self.exclude_items_file else set()
+        return ItemFilter(include_items=include_items, exclude_items=exclude_items)
+
+    def lazy_strategies(self):
+        """`lazy` keys, 'from_category:to_category', as table pairs."""
+        return {tuple(pair.split(":", 1)): strategy for pair, strategy in self.lazy.items()}
+
+
+def _read_lines(path):
+    with open(path) as f:
+        return set(line.strip() for line in f)
+
+
+TARGET_FIELDS = {f.name for f in fields(Target)}
+PATH_FIELDS = ["output_file", "categories_file", "include_items_file", "exclude_items_file", "column_profile"]
+
+
+def read_manifest(path):
+    """Read the targets of a TOML or JSON manifest.
+
+    The manifest has a list of `targets` tables and an optional
+    `defaults` table, whose keys apply to every target that does not
+    set them.
+    """
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib
+
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+
+    defaults = data.get("defaults", {})
+    base_dir = os.path.dirname(os.path.abspath(path))
+    targets = []
+    for i, options in enumerate(data.get("targets", [])):
+        options = {**defaults, **options}
+        unknown = set(options) - TARGET_FIELDS
+        if unknown:
+            raise ValueError(f"Target {i} of {path}: unknown options {', '.join(sorted(unknown))}")
+        if "output_file" not in options:
+            raise ValueError(f"Target {i} of {path}: output_file is required")
+
+        for name in PATH_FIELDS:
+            if options.get(name):
+                options[name] = os.path.join(base_dir, options[name])
+
+        target = Target(**options)
+        try:
+            target.validate()
+        except ValueError as e:
+            raise ValueError(f"Target {i} of {path} ({target.output_file}): {e}") from None
+        targets.append(target)
+
+    if not targets:
+        raise ValueError(f"No targets in {path}")
+    return targets
+
+
+def render_target(target, categories, profile=None):
+    printer = PRINTERS[target.model]
+    output = io.StringIO()
+    if target.model == "orm":
+        mp = printer(fp=output, include_imports=True, lazy=target.lazy_strategies(), default_lazy=target.default_lazy)
+    else:
+        mp = printer(fp=output, include_imports=True)
+
+    sm = schema_map(target, printer=mp, profile=profile)
+    sm.add_categories(categories)
+    sm.print_models()
+    return output.getvalue()
+
+
+def schema_map(target, printer=None, profile=None):
+    """The `SchemaMap` of the options of `target`."""
+    return SchemaMap(
+        printer=printer,
+        entry_column=target.entry_column,
+        partition_by=target.partition_by,
+        profile=profile,
+        enums=enums_option(target.enums),
+        **links_options(target.links),
+    )
+
+
+def write_target(target, categories, profile=None):
+    content = render_target(target, categories, profile)
+    os.makedirs(os.path.dirname(target.output_file) or ".", exist_ok=True)
+    with open(target.output_file, "w") as f:
+        f.write(content)
+    return target.output_file
+
+
+def run_targets(reader, targets, workers=4):
+    """Generate every target from the dictionary read once by `reader`.
+
+    Categories are extracted in this process, all from the same frame
+    index (or cache), then shipped with their targets to a pool of
+    `workers` processes, which render and write the models. Returns the
+    failed targets, by output file.
+    """
+    profiles = {}
+    jobs = []
+    failed = {}
+    for target in targets:
+        try:
+            categories = reader.get_categories(target.category_names(), filter=target.item_filter())
+            if target.column_profile and target.column_profile not in profiles:
+                from mmcif_db_tool.profile import CorpusProfile
+                profiles[target.column_profile] = CorpusProfile.load(target.column_profile)
+        except Exception as e:
+            failed[target.output_file] = f"{type(e).__name__}: {e}"
+            continue
+        jobs.append((target, categories, profiles.get(target.column_profile)))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_target, *job): job[0] for job in jobs}
+        for future, target in futures.items():
+            try:
+                logger.debug(f"Wrote {future.result()}")
+            except Exception as e:
+                failed[target.output_file] = f"{type(e).__name__}: {e}"
+
+    for output_file, error in failed.items():
+        logger.warning(f"Failed {output_file}: {error}")
+    return failed
@@ -0,0 +1,209 @@
+"""BinaryCIF entries, decoded into typed NumPy columns.
+
+A BinaryCIF file is a MessagePack document holding, per category, the
+columns of its values, each encoded by a chain of encodings (byte
+arrays, fixed point, run-length, delta, integer packing and string
+arrays). Here they are decoded with NumPy, one column at a time and
+only when a column is read, and exposed through the parts of gemmi's
+`cif.Block` and `cif.Table` interface the loaders use. Columns also
+give their values already typed (see `BinaryColumn.typed_values`), so
+numbers are not turned back into text to be parsed again.
+"""
+import msgpack
+import numpy as np
+from gemmi import cif
+
+# data types of the ByteArray encoding
+BYTE_ARRAY_TYPES = {
+    1: np.dtype("<i1"),
+    2: np.dtype("<i2"),
+    3: np.dtype("<i4"),
+    4: np.dtype("<u1"),
+    5: np.dtype("<u2"),
+    6: np.dtype("<u4"),
+    32: np.dtype("<f4"),
+    33: np.dtype("<f8"),
+}
+
+# values of the masks: 0 for present values, 1 for '.' and 2 for '?'
+NULL_MARKERS = {1: ".", 2: "?"}
+
+
+def byte_array(data, encoding):
+    return np.frombuffer(data, dtype=BYTE_ARRAY_TYPES[encoding["type"]])
+
+
+def fixed_point(data, encoding):
+    return data / encoding["factor"]
+
+
+def interval_quantization(data, encoding):
+    step = (encoding["max"] - encoding["min"]) / (encoding["numSteps"] - 1)
+    return encoding["min"] + step * data
+
+
+def run_length(data, encoding):
+    return np.repeat(data[0::2], data[1::2])
+
+
+def delta(data, encoding):
+    return np.cumsum(data, dtype=np.int64) + encoding["origin"]
+
+
+def integer_packing(data, encoding):
+    """Sum the runs of values at the limits of the packed type into
+    the values that follow them."""
+    if len(data) == encoding["srcSize"]:
+        return data.astype(np.int32)
+
+    upper = np.iinfo(data.dtype).max
+    continued = data == upper
+    if not encoding["isUnsigned"]:
+        continued |= data == -upper - 1
+    starts = np.concatenate(([0], np.flatnonzero(~continued[:-1]) + 1))
+    return np.add.reduceat(data.astype(np.int32), starts)
+
+
+def string_array(data, encoding):
+    offsets = decode(encoding["offsets"], encoding["offsetEncoding"])
+    indices = decode(data, encoding["dataEncoding"])
+    text = encoding["stringData"]
+    strings = np.array([text[start:stop] for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())] + [""], dtype=object)
+    # a negative index is an absent value, given as the empty string
+    return strings[np.where(indices < 0, len(strings) - 1, indices)]
+
+
+DECODERS = {
+    "ByteArray": byte_array,
+    "FixedPoint": fixed_point,
+    "IntervalQuantization": interval_quantization,
+    "RunLength": run_length,
+    "Delta": delta,
+    "IntegerPacking": integer_packing,
+    "StringArray": string_array,
+}
+
+
+def decode(data, encodings):
+    """Decode `data` by undoing `encodings`, the encodings applied to
+    it in order."""
+    for encoding in reversed(encodings):
+        kind = encoding["kind"]
+        if kind not in DECODERS:
+            raise ValueError(f"Unsupported BinaryCIF encoding '{kind}'")
+        data = DECODERS[kind](data, encoding)
+    return data
+
+
+def token(value):
+    if isinstance(value, str):
+        return cif.quote(value)
+    return str(value)
+
+
+class BinaryColumn:
+    """The decoded values of one column, in a NumPy array, and the
+    mask of the nulls. Items and iteration give the values as raw mmCIF
+    tokens, as the columns of gemmi do."""
+    __slots__ = ("values", "markers")
+
+    def __init__(self, values, markers=None):
+        self.values = values
+        # 0 for present values, or the code of the null marker
+        self.markers = markers
+
+    @classmethod
+    def decode(cls, column):
+        mask = column.get("mask")
+        markers = decode(mask["data"], mask["encoding"]) if mask else None
+        if markers is not None and not markers.any():
+            markers = None
+        return cls(decode(column["data"]["data"], column["data"]["encoding"]), markers)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if self.markers is not None and self.markers[i]:
+            return NULL_MARKERS[int(self.markers[i])]
+        value = self.values[i]
+        return token(value.item() if isinstance(value, np.generic) else value)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def null_mask(self):
+        if self.markers is None:
+            return np.zeros(len(self.values), dtype=bool)
+        return self.markers != 0
+
+    def typed_values(self, start=0, stop=None):
+        """The values from `start` to `stop` as Python strings, ints or
+        floats, with None for nulls."""
+        values = self.values[start:stop].tolist()
+        if self.markers is not None:
+            for i in np.flatnonzero(self.markers[start:stop]).tolist():
+                values[i] = None
+        return values
+
+
+class BinaryCategory:
+    """One category of a BinaryCIF block."""
+
+    # columns give typed values, see BinaryColumn.typed_values
+    typed = True
+
+    def __init__(self, category):
+        self._columns = category["columns"]
+        self._decoded = {}
+        self.name = category["name"]
+        self.tags = [f"{self.name}.{c['name']}" for c in self._columns]
+        self._length = category["rowCount"]
+
+    def __len__(self):
+        return self._length
+
+    def width(self):
+        return len(self._columns)
+
+    def column(self, pos):
+        if pos not in self._decoded:
+            self._decoded[pos] = BinaryColumn.decode(self._columns[pos])
+        return self._decoded[pos]
+
+
+class BinaryBlock:
+    """A BinaryCIF data block, behaving as a `cif.Block` for finding
+    categories and values."""
+
+    def __init__(self, block):
+        self.name = block["header"]
+        self._categories = {c["name"].lower(): c for c in block["categories"]}
+        self._found = {}
+
+    def get_mmcif_category_names(self):
+        return [f"{c['name']}." for c in self._categories.values()]
+
+    def find_mmcif_category(self, prefix):
+        """The category named by `prefix`, e.g. '_atom_site.', or None."""
+        name = prefix.rstrip(".").lower()
+        if name not in self._found:
+            category = self._categories.get(name)
+            self._found[name] = BinaryCategory(category) if category else None
+        return self._found[name]
+
+    def find_value(self, tag):
+        category = self.find_mmcif_category(tag.partition(".")[0])
+        if category is None:
+            return None
+
+        tags = [t.lower() for t in category.tags]
+        if tag.lower() not in tags or not len(category):
+            return None
+        return category.column(tags.index(tag.lower()))[0]
+
+
+def read_blocks(data):
+    """The data blocks of the BinaryCIF document `data`, in bytes."""
+    document = msgpack.unpackb(data, raw=False)
+    return [BinaryBlock(b) for b in document["dataBlocks"]]
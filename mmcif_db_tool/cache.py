@@ -0,0 +1,119 @@
+import os
+import zlib
+import pickle
+import hashlib
+import logging
+
+from functools import partial
+from dataclasses import fields
+
+from mmcif_db_tool import __version__
+from mmcif_db_tool.mmcif_dict import Category, Item, Link
+
+logger = logging.getLogger(__name__)
+
+# bump when the layout of the cached records changes
+CACHE_FORMAT = 3
+
+ITEM_FIELDS = list(Item.field_names)
+# item records hold the position of the description in place of it
+ITEM_RECORD_FIELDS = [f for f in ITEM_FIELDS if f != "description"]
+LINK_FIELDS = [f.name for f in fields(Link)]
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "mmcif_db_tool")
+
+
+class DictCache:
+    """On-disk cache of the categories extracted from a dictionary.
+
+    Entries are keyed by the SHA-256 of the dictionary file content
+    together with the tool version and the record layout, and stored
+    as zlib-compressed pickles of plain tuples, so loading them does
+    not need gemmi at all. Descriptions are compressed on their own
+    and only decompressed when one is read.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or default_cache_dir()
+
+    def key(self, path: str) -> str:
+        h = hashlib.sha256()
+        h.update(f"{__version__}:{CACHE_FORMAT}:{','.join(ITEM_FIELDS)}:{','.join(LINK_FIELDS)}\n".encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def load(self, key: str) -> list[Category]:
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                records, descriptions = pickle.loads(zlib.decompress(f.read()))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+
+        logger.debug(f"Loaded dictionary from cache {path}")
+        get = _Descriptions(descriptions).get
+        categories = []
+        for id, description, key_names, items, links in records:
+            category = Category(id, partial(get, description), key_names)
+            category.items = [Item(i[1], i[2], partial(get, i[0]), *i[3:]) for i in items]
+            category.links = [Link(*l) for l in links]
+            categories.append(category)
+        return categories
+
+    def store(self, key: str, categories: list[Category]):
+        # descriptions are replaced by their position in a separate list
+        records = []
+        descriptions = []
+        for c in categories:
+            items = []
+            for i in c.items:
+                items.append((len(descriptions), *(getattr(i, f) for f in ITEM_RECORD_FIELDS)))
+                descriptions.append(i.description)
+            links = [tuple(getattr(l, f) for f in LINK_FIELDS) for l in c.links]
+            records.append((c.id, len(descriptions), c.key_names, items, links))
+            descriptions.append(c.description)
+        descriptions = zlib.compress(pickle.dumps(descriptions, protocol=pickle.HIGHEST_PROTOCOL))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zlib.compress(pickle.dumps((records, descriptions), protocol=pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp_path, path)
+        logger.debug(f"Stored dictionary in cache {path}")
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".cache"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.cache")
+
+
+class _Descriptions:
+    """Descriptions of a cache entry, decompressed on first use."""
+
+    __slots__ = ("_blob", "_values")
+
+    def __init__(self, blob):
+        self._blob = blob
+        self._values = None
+
+    def get(self, pos):
+        if self._values is None:
+            self._values = pickle.loads(zlib.decompress(self._blob))
+            self._blob = None
+        return self._values[pos]
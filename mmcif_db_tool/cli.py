@@ -1,14 +1,21 @@
 import sys
 import click
 import logging
+import functools
 
+from mmcif_db_tool.batch import ENUMS, LINKS, PARTITION_BY, enums_option, links_options, read_manifest, run_targets
+from mmcif_db_tool.cache import DictCache
+from mmcif_db_tool.instrument import instruments
 from mmcif_db_tool.mmcif_dict import DictReader, ItemFilter
-from mmcif_db_tool.schema_map import SchemaMap, SqlAlchemyOrmPrinter, SqlAlchemyCorePrinter
+from mmcif_db_tool.schema_map import LAZY_STRATEGIES, SchemaMap, SqlAlchemyOrmPrinter, SqlAlchemyCorePrinter
 
+# gemmi and SQLAlchemy are imported by the commands that use them, so
+# that --help and usage errors return without loading them
 
-def get_printer(model, include_imports, fp=None):
+
+def get_printer(model, include_imports, fp=None, lazy=None, default_lazy=None):
     if model == "orm":
-        return SqlAlchemyOrmPrinter(fp=fp, include_imports=include_imports)
+        return SqlAlchemyOrmPrinter(fp=fp, include_imports=include_imports, lazy=lazy, default_lazy=default_lazy)
     elif model == "core":
         return SqlAlchemyCorePrinter(fp=fp, include_imports=include_imports)
 
@@ -23,36 +30,130 @@ def get_filtered_items(path):
         return set([line.strip() for line in f])
 
 
-@click.command()
-@click.argument("mmcif_dictionary", type=click.Path())
-@click.option("--categories", help="A comma-separated list of categories to be processed, e.g. 'chem_comp,chem_comp_atom'")
-@click.option("--categories-file", type=click.Path(exists=True), help="A file containing the list of categories to be processed")
-@click.option("--model", type=str, default="orm", help="Choose between 'orm' and 'core' models")
-@click.option("--include-items-file", type=click.Path(), help="Path to the file containing the list of categories and items to be included. The file have one 'category_name.item_name' per line. Any item not included in the file will be ignored. Cannot be used with --exclude-items-file.")
-@click.option("--exclude-items-file", type=click.Path(), help="Path to the file containing the list of categories and items to be included. The file have one 'category_name.item_name' per line. Any item not included in the file will be processed. Cannot be used with --include-items-file.")
-@click.option("--output-file", type=click.Path(), help="Path to the output file")
-@click.option("--verbose", "-v", is_flag=True, help="Print debug messages")
-def process_categories(mmcif_dictionary, categories, categories_file, model, include_items_file, exclude_items_file, output_file, verbose):
-    """Create SQLAlchemy models for categories based on the
-    input MMCIF_DICTIONARY.
+def dictionary_options(command):
+    """Options shared by the commands that read categories from a dictionary."""
+    options = [
+        click.argument("mmcif_dictionary", type=click.Path()),
+        click.option("--categories", help="A comma-separated list of categories to be processed, e.g. 'chem_comp,chem_comp_atom'"),
+        click.option("--categories-file", type=click.Path(exists=True), help="A file containing the list of categories to be processed"),
+        click.option("--include-items-file", type=click.Path(), help="Path to the file containing the list of categories and items to be included. The file have one 'category_name.item_name' per line. Any item not included in the file will be ignored. Cannot be used with --exclude-items-file."),
+        click.option("--exclude-items-file", type=click.Path(), help="Path to the file containing the list of categories and items to be included. The file have one 'category_name.item_name' per line. Any item not included in the file will be processed. Cannot be used with --include-items-file."),
+        click.option("--cache-dir", type=click.Path(file_okay=False), envvar="MMCIF_DB_TOOL_CACHE_DIR", help="Directory where the parsed dictionary is cached. Defaults to ~/.cache/mmcif_db_tool"),
+        click.option("--no-cache", is_flag=True, help="Always parse the dictionary, without reading or writing the cache"),
+        click.option("--clear-cache", is_flag=True, help="Remove all cached dictionaries before running"),
+        click.option("--verbose", "-v", is_flag=True, help="Print debug messages"),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
 
-    If you want to pass a file with the list of categories through
-    the option `--categories-file`, set CATEGORIES to "-".
-    """
+
+def profile_options(command):
+    """Options timing the phases of a command, and the wrapper that
+    reports them once it has run."""
+    @functools.wraps(command)
+    def wrapper(*args, profile, profile_output, cprofile, **kwargs):
+        if not (profile or profile_output or cprofile):
+            return command(*args, **kwargs)
+
+        import cProfile
+
+        instruments.enable()
+        profiler = cProfile.Profile() if cprofile else None
+        try:
+            if profiler:
+                profiler.enable()
+            return command(*args, **kwargs)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(cprofile)
+            if profile or profile_output:
+                with open(profile_output, "w") if profile_output else sys.stderr as f:
+                    instruments.save(f)
+            instruments.reset()
+
+    options = [
+        click.option("--profile", is_flag=True, help="Print a JSON report of the wall time, calls and items per second of each phase, and the peak memory, to stderr"),
+        click.option("--profile-output", type=click.Path(dir_okay=False), help="Write the --profile report to this file instead"),
+        click.option("--cprofile", type=click.Path(dir_okay=False), help="Dump cProfile statistics of the whole run to this file, for pstats or snakeviz"),
+    ]
+    for option in reversed(options):
+        wrapper = option(wrapper)
+    return wrapper
+
+
+def parse_lazy(ctx, param, values):
+    lazy = {}
+    for value in values:
+        pair, _, strategy = value.partition("=")
+        from_table, _, to_table = pair.partition(":")
+        if not from_table or not to_table or strategy not in LAZY_STRATEGIES:
+            raise click.BadParameter(f"expected 'from_category:to_category=strategy' with a strategy in {', '.join(LAZY_STRATEGIES)}, got '{value}'")
+        lazy[(from_table, to_table)] = strategy
+    return lazy
+
+
+def read_profile(ctx, param, value):
+    if not value:
+        return None
+
+    from mmcif_db_tool.profile import CorpusProfile
+    return CorpusProfile.load(value)
+
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(ctx, param, value):
+    """Bytes of a size such as '512M' or '2G'."""
+    if value is None:
+        return None
+
+    number, unit = value[:-1], value[-1:].upper()
+    if unit not in SIZE_UNITS:
+        number, unit = value, ""
+    try:
+        size = int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise click.BadParameter(f"expected a positive size in bytes, optionally followed by K, M or G, got '{value}'")
+    return size
+
+
+COLUMN_PROFILE_HELP = "Profile written by the profile command. Column types are sized from the values it recorded"
+
+
+ENUMS_HELP = "Store enumerated items as strings (default), as a native Enum type, or as small integer ids into generated lookup tables"
+
+LINKS_HELP = "Emit nothing for the links between categories (default), indexes on the child columns only, or indexes and foreign key constraints"
+
+
+def read_categories(mmcif_dictionary, categories, categories_file, include_items_file, exclude_items_file, cache_dir, no_cache, clear_cache, verbose):
     if verbose:
         logging.basicConfig(level=logging.DEBUG)
         logging.getLogger("mmcif_dict").setLevel(logging.DEBUG)
 
-    cr = DictReader(path=mmcif_dictionary)
-
     if [categories, categories_file].count(None) == 2 or [categories, categories_file].count(None) == 0:
         raise click.UsageError("Either provide a list of categories or a file containing the list of categories")
 
     if include_items_file and exclude_items_file:
         raise click.UsageError("These options are mutually exclusive: --include-items-file, --exclude-items-file")
 
+    cache = DictCache(cache_dir)
+    if clear_cache:
+        cache.clear()
+
+    cr = DictReader(path=mmcif_dictionary, cache=None if no_cache else cache)
+
     if categories_file:
         categories = get_cats_from_file(categories_file)
+    else:
+        categories = categories.split(",")
+
+    included_items = set()
+    excluded_items = set()
 
     if include_items_file:
         included_items = get_filtered_items(include_items_file)
@@ -61,14 +162,411 @@ def process_categories(mmcif_dictionary, categories, categories_file, model, inc
         excluded_items = get_filtered_items(exclude_items_file)
 
     filter = ItemFilter(include_items=included_items, exclude_items=excluded_items)
-    cat_objs = cr.get_categories(categories=categories, filter=filter)
+    return cr.get_categories(categories=categories, filter=filter)
+
+
+@click.group()
+def cli():
+    """Generate SQLAlchemy models from the categories of an mmCIF
+    dictionary and load mmCIF entries into them."""
+
+
+@cli.command("process_categories")
+@dictionary_options
+@profile_options
+@click.option("--model", type=str, default="orm", help="Choose between 'orm' and 'core' models")
+@click.option("--output-file", type=click.Path(), help="Path to the output file")
+@click.option("--entry-column", help="Add a column with this name, e.g. 'entry_id', to every table as the leading part of its primary key")
+@click.option("--partition-by", type=click.Choice(PARTITION_BY), help="Partition the tables on the entry column (PostgreSQL). Requires --entry-column")
+@click.option("--links", type=click.Choice(LINKS), default="none", help=LINKS_HELP)
+@click.option("--lazy", multiple=True, callback=parse_lazy, help="Loading strategy of an ORM relationship, as 'from_category:to_category=strategy', e.g. 'entity:entity_poly=selectin'. Can be given several times")
+@click.option("--default-lazy", type=click.Choice(LAZY_STRATEGIES), help="Loading strategy of the ORM relationships not set with --lazy")
+@click.option("--column-profile", type=click.Path(exists=True, dir_okay=False), callback=read_profile, help=COLUMN_PROFILE_HELP)
+@click.option("--enums", type=click.Choice(ENUMS), default="none", help=ENUMS_HELP)
+def process_categories(model, output_file, entry_column, partition_by, links, lazy, default_lazy, column_profile, enums, **kwargs):
+    """Create SQLAlchemy models for categories based on the
+    input MMCIF_DICTIONARY.
+
+    If you want to pass a file with the list of categories through
+    the option `--categories-file`, set CATEGORIES to "-".
+    """
+    if partition_by and not entry_column:
+        raise click.UsageError("--partition-by requires --entry-column")
+
+    cat_objs = read_categories(**kwargs)
 
     with open(output_file, "w") if output_file else sys.stdout as f:
-        mp = get_printer(model, include_imports=True, fp=f)
-        sm = SchemaMap(printer=mp, ignore_relationships=True)
+        mp = get_printer(model, include_imports=True, fp=f, lazy=lazy, default_lazy=default_lazy)
+        sm = SchemaMap(printer=mp, entry_column=entry_column, partition_by=partition_by, profile=column_profile, enums=enums_option(enums), **links_options(links))
         sm.add_categories(cat_objs)
         sm.print_models()
 
 
+@cli.command("batch")
+@click.argument("mmcif_dictionary", type=click.Path())
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers", type=click.IntRange(min=1), default=4, show_default=True, help="Number of processes rendering and writing the targets")
+@click.option("--cache-dir", type=click.Path(file_okay=False), envvar="MMCIF_DB_TOOL_CACHE_DIR", help="Directory where the parsed dictionary is cached. Defaults to ~/.cache/mmcif_db_tool")
+@click.option("--no-cache", is_flag=True, help="Always parse the dictionary, without reading or writing the cache")
+@click.option("--clear-cache", is_flag=True, help="Remove all cached dictionaries before running")
+@click.option("--verbose", "-v", is_flag=True, help="Print debug messages")
+@profile_options
+def batch(mmcif_dictionary, manifest, workers, cache_dir, no_cache, clear_cache, verbose):
+    """Generate every target of MANIFEST, a TOML or JSON file, from
+    one read of MMCIF_DICTIONARY.
+
+    Each target takes the options of process_categories, e.g.
+    categories, include_items_file, model and output_file.
+    """
+    if verbose:
+        logging.basicConfig(level=logging.DEBUG)
+
+    try:
+        targets = read_manifest(manifest)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    cache = DictCache(cache_dir)
+    if clear_cache:
+        cache.clear()
+
+    reader = DictReader(path=mmcif_dictionary, cache=None if no_cache else cache)
+    failed = run_targets(reader, targets, workers=workers)
+    click.echo(f"Wrote {len(targets) - len(failed)} of {len(targets)} targets", err=True)
+
+    if failed:
+        for output_file, error in failed.items():
+            click.echo(f"Failed {output_file}: {error}", err=True)
+        sys.exit(1)
+
+
+@cli.command("serve")
+@click.argument("mmcif_dictionary", type=click.Path(exists=True, dir_okay=False))
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False), help="Answer one JSON request per line on this Unix socket")
+@click.option("--port", type=click.IntRange(min=0, max=65535), help="Answer HTTP requests on this port of localhost")
+@click.option("--max-responses", type=click.IntRange(min=1), default=1024, show_default=True, help="Number of distinct responses kept in memory")
+@click.option("--cache-dir", type=click.Path(file_okay=False), envvar="MMCIF_DB_TOOL_CACHE_DIR", help="Directory where the parsed dictionary is cached. Defaults to ~/.cache/mmcif_db_tool")
+@click.option("--no-cache", is_flag=True, help="Always parse the dictionary, without reading or writing the cache")
+@click.option("--verbose", "-v", is_flag=True, help="Print debug messages")
+def serve(mmcif_dictionary, socket_path, port, max_responses, cache_dir, no_cache, verbose):
+    """Answer schema requests from MMCIF_DICTIONARY, read once and
+    again whenever the file changes.
+
+    Requests ask for the category names, the items of a category, the
+    tables of a set of categories or their ORM or Core source text.
+    """
+    if (socket_path is None) == (port is None):
+        raise click.UsageError("Give either --socket or --port")
+
+    from mmcif_db_tool.serve import HttpServer, SchemaService, UnixServer
+
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+
+    service = SchemaService(mmcif_dictionary, cache=None if no_cache else DictCache(cache_dir), max_responses=max_responses)
+    # read the dictionary before taking requests
+    service.handle({"request": "categories"})
+    if socket_path:
+        server = UnixServer(service, socket_path)
+        click.echo(f"Serving {mmcif_dictionary} on {socket_path}", err=True)
+    else:
+        server = HttpServer(service, port)
+        click.echo(f"Serving {mmcif_dictionary} on http://127.0.0.1:{server.server_address[1]}/", err=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@cli.command("diff")
+@dictionary_options
+@click.argument("new_dictionary", type=click.Path())
+@click.option("--format", "output_format", type=click.Choice(["sql", "alembic"]), default="sql", show_default=True, help="Write the migration as SQL statements or as an Alembic migration script")
+@click.option("--dialect", type=click.Choice(["postgresql", "mysql", "sqlite"]), default="postgresql", show_default=True, help="SQL dialect of the statements, with --format sql")
+@click.option("--output-file", type=click.Path(), help="Path to the output file")
+@click.option("--entry-column", help="Name of the column holding the entry id, as given to process_categories")
+@click.option("--links", type=click.Choice(LINKS), default="none", help=f"{LINKS_HELP}, as given to process_categories")
+@click.option("--column-profile", type=click.Path(exists=True, dir_okay=False), callback=read_profile, help=f"{COLUMN_PROFILE_HELP}, applied to both versions")
+@click.option("--enums", type=click.Choice(ENUMS), default="none", help=f"{ENUMS_HELP}, as given to process_categories")
+@click.option("--revision", help="Revision id of the Alembic script. Defaults to a random one")
+@click.option("--down-revision", help="Revision id the Alembic script follows")
+def diff(new_dictionary, output_format, dialect, output_file, entry_column, links, column_profile, enums, revision, down_revision, **kwargs):
+    """Write the DDL migrating the tables generated from
+    MMCIF_DICTIONARY to those generated from NEW_DICTIONARY, for the
+    same categories and items.
+
+    Only the differences are emitted: new tables, columns and indexes,
+    widened or changed column types, nullability and enumeration
+    values, then the drops. Changes with no safe DDL, such as a new
+    primary key, are written as comments.
+    """
+    from mmcif_db_tool.migrate import AlembicMigrationPrinter, SchemaDiff, SqlMigrationPrinter
+
+    tables = []
+    for path in (kwargs["mmcif_dictionary"], new_dictionary):
+        cat_objs = read_categories(**{**kwargs, "mmcif_dictionary": path})
+        sm = SchemaMap(entry_column=entry_column, profile=column_profile, enums=enums_option(enums), **links_options(links))
+        sm.add_categories(cat_objs)
+        tables.append(sm.get_tables())
+
+    schema_diff = SchemaDiff(*tables)
+    if not schema_diff:
+        click.echo("The schemas are the same", err=True)
+
+    with open(output_file, "w") if output_file else sys.stdout as f:
+        if output_format == "alembic":
+            message = f"Migrate from {kwargs['mmcif_dictionary']} to {new_dictionary}"
+            printer = AlembicMigrationPrinter(fp=f, message=message, revision=revision, down_revision=down_revision)
+        else:
+            printer = SqlMigrationPrinter(fp=f, dialect=dialect)
+        printer.print(schema_diff)
+
+
+def format_counts(counts):
+    return ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+
+
+def progress_reporter(every):
+    """Progress callback of `EntryLoader`, printing the number of entry
+    files by status after every `every` files."""
+    counts = {}
+
+    def report(path, status):
+        counts[status] = counts.get(status, 0) + 1
+        if sum(counts.values()) % every == 0:
+            click.echo(f"{sum(counts.values())} entry files: {format_counts(counts)}", err=True)
+    return report
+
+
+@cli.command("load")
+@dictionary_options
+@profile_options
+@click.argument("entry_files", nargs=-1, type=click.Path(exists=True))
+@click.option("--db-url", help="SQLAlchemy database URL, e.g. 'sqlite:///pdb.db'. Required unless --plan is given")
+@click.option("--batch-size", type=click.IntRange(min=1), default=1000, show_default=True, help="Number of rows written per INSERT batch")
+@click.option("--create-tables", is_flag=True, help="Create the tables before loading")
+@click.option("--workers", type=click.IntRange(min=1), default=1, show_default=True, help="Number of processes parsing entry files")
+@click.option("--table-workers", type=click.IntRange(min=1), default=1, show_default=True, help="Number of connections writing the tables of a wave at once (see --plan)")
+@click.option("--plan", is_flag=True, help="Print the waves in which the tables are written, parents before children, and exit without loading")
+@click.option("--memory-budget", callback=parse_size, help="Stream the entries, converting each category in chunks of rows sized to fit this many bytes (per process), e.g. '256M'. Each chunk is written before the next is converted, and each entry in one transaction")
+@click.option("--journal", "journal_path", type=click.Path(dir_okay=False), help="SQLite file recording the entry files loaded. Files loaded already from the same content are skipped, and the others loaded, replacing their earlier rows. Requires --entry-column")
+@click.option("--progress-every", type=click.IntRange(min=1), default=1000, show_default=True, help="Report progress after this many entry files")
+@click.option("--pipeline", is_flag=True, help="Read, parse and write the entries in concurrent stages joined by bounded queues, with --workers parsing processes. Needs a SQLite database file and aiosqlite")
+@click.option("--readers", type=click.IntRange(min=1), default=4, show_default=True, help="Number of threads reading entry files, with --pipeline")
+@click.option("--writers", type=click.IntRange(min=1), default=1, show_default=True, help="Number of connections writing entries, with --pipeline")
+@click.option("--queue-size", type=click.IntRange(min=1), help="Number of entries waiting between two stages, with --pipeline  [default: twice --workers]")
+@click.option("--entry-column", help="Name of the column holding the entry id, as given to process_categories")
+@click.option("--links", type=click.Choice(LINKS), default="none", help=f"{LINKS_HELP}, when creating the tables")
+@click.option("--column-profile", type=click.Path(exists=True, dir_okay=False), callback=read_profile, help=f"{COLUMN_PROFILE_HELP}, when creating the tables")
+@click.option("--enums", type=click.Choice(ENUMS), default="none", help=f"{ENUMS_HELP}, as given to process_categories")
+def load(entry_files, db_url, batch_size, create_tables, workers, table_workers, plan, memory_budget, journal_path, progress_every, pipeline, readers, writers, queue_size, entry_column, links, column_profile, enums, **kwargs):
+    """Load the mmCIF ENTRY_FILES into the tables generated for the
+    categories of MMCIF_DICTIONARY. Directories are searched
+    recursively for *.cif files.
+    """
+    if not plan and not entry_files:
+        raise click.UsageError("Missing argument 'ENTRY_FILES...'")
+    if not plan and not db_url:
+        raise click.UsageError("Missing option '--db-url'")
+    if journal_path and not entry_column:
+        raise click.UsageError("--journal requires --entry-column")
+    if pipeline and not plan:
+        db_path = sqlite_database(db_url)
+        if memory_budget or journal_path or table_workers > 1:
+            raise click.UsageError("--pipeline cannot be combined with --memory-budget, --journal or --table-workers")
+
+    cat_objs = read_categories(**kwargs)
+
+    from sqlalchemy import create_engine
+    from mmcif_db_tool.journal import LoadJournal
+    from mmcif_db_tool.loader import EntryLoader, iter_entry_files, load_plan, plan_text
+
+    sm = SchemaMap(entry_column=entry_column, profile=column_profile, enums=enums_option(enums), **links_options(links))
+    sm.add_categories(cat_objs)
+
+    if plan:
+        click.echo(plan_text(load_plan(sm.get_tables())))
+        return
+
+    if pipeline:
+        from mmcif_db_tool.pipeline import PipelineLoader
+
+        loader = PipelineLoader(
+            db_path, sm.get_tables(), readers=readers, parsers=workers, writers=writers, queue_size=queue_size, batch_size=batch_size, progress=progress_reporter(progress_every),
+        )
+        if create_tables:
+            loader.create_tables()
+        loader.load_files(iter_entry_files(entry_files))
+        report_load(loader)
+        return
+
+    journal = None
+    if journal_path:
+        journal = LoadJournal(journal_path)
+        recorded = journal.summary()
+        if recorded:
+            click.echo(f"Journal {journal_path}: {format_counts(recorded)}", err=True)
+
+    loader = EntryLoader(create_engine(db_url), sm.get_tables(), batch_size=batch_size, memory_budget=memory_budget, journal=journal, progress=progress_reporter(progress_every), table_workers=table_workers)
+    if create_tables:
+        loader.create_tables()
+
+    paths = iter_entry_files(entry_files)
+    if workers > 1:
+        loader.load_files_parallel(paths, workers)
+    else:
+        loader.load_files(paths)
+
+    if loader.skipped:
+        click.echo(f"Skipped {loader.skipped} entry files loaded already", err=True)
+    if journal is not None:
+        click.echo(f"Journal {journal_path}: {format_counts(journal.summary())}", err=True)
+        journal.close()
+    report_load(loader)
+
+
+def sqlite_database(db_url):
+    """The path of the SQLite database file of `db_url`."""
+    from sqlalchemy.engine import make_url
+
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise click.UsageError("--pipeline writes to a SQLite database file, e.g. 'sqlite:///pdb.db'")
+    return url.database
+
+
+def report_load(loader):
+    for name, count in loader.row_counts.items():
+        click.echo(f"{name}: {count} rows", err=True)
+    if loader.failed:
+        for path, error in loader.failed.items():
+            click.echo(f"Failed {path}: {error}", err=True)
+        sys.exit(1)
+
+
+@cli.command("export")
+@dictionary_options
+@profile_options
+@click.argument("entry_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--output-dir", required=True, type=click.Path(file_okay=False), help="Directory of the table files and load scripts")
+@click.option("--format", "file_format", type=click.Choice(["csv", "tsv"]), default="csv", show_default=True, help="CSV with a header row, or the tab-separated text format of PostgreSQL COPY")
+@click.option("--entries-per-file", type=click.IntRange(min=1), help="Start new table files after this many entries, each part with its own load scripts, written once it is finished so it can be loaded while the export goes on")
+@click.option("--workers", type=click.IntRange(min=1), default=1, show_default=True, help="Number of processes parsing entry files")
+@click.option("--entry-column", help="Name of the column holding the entry id, as given to process_categories")
+@click.option("--links", type=click.Choice(LINKS), default="none", help=f"{LINKS_HELP}. Orders the tables of the load scripts")
+@click.option("--column-profile", type=click.Path(exists=True, dir_okay=False), callback=read_profile, help=COLUMN_PROFILE_HELP)
+@click.option("--enums", type=click.Choice(ENUMS), default="none", help=f"{ENUMS_HELP}, as given to process_categories")
+def export(entry_files, output_dir, file_format, entries_per_file, workers, entry_column, links, column_profile, enums, **kwargs):
+    """Write the categories of the mmCIF ENTRY_FILES to one delimited
+    file per table generated for MMCIF_DICTIONARY, with the scripts
+    loading them through PostgreSQL COPY and SQLite .import.
+    Directories are searched recursively for *.cif files.
+    """
+    cat_objs = read_categories(**kwargs)
+
+    from mmcif_db_tool.export import DelimitedExporter
+    from mmcif_db_tool.loader import iter_entry_files
+
+    sm = SchemaMap(entry_column=entry_column, profile=column_profile, enums=enums_option(enums), **links_options(links))
+    sm.add_categories(cat_objs)
+
+    exporter = DelimitedExporter(output_dir, sm.get_tables(), format=file_format, entries_per_file=entries_per_file)
+    paths = iter_entry_files(entry_files)
+    if workers > 1:
+        exporter.export_files_parallel(paths, workers)
+    else:
+        exporter.export_files(paths)
+
+    for path in exporter.write_scripts():
+        click.echo(f"Wrote {path}", err=True)
+    for name, count in exporter.row_counts.items():
+        click.echo(f"{name}: {count} rows", err=True)
+
+    if exporter.failed:
+        for path, error in exporter.failed.items():
+            click.echo(f"Failed {path}: {error}", err=True)
+        sys.exit(1)
+
+
+@cli.command("parquet")
+@dictionary_options
+@profile_options
+@click.argument("entry_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--output-dir", required=True, type=click.Path(file_okay=False), help="Directory of the datasets, one subdirectory per table")
+@click.option("--partition-by", type=click.Choice(["chunk", "entry"]), default="chunk", show_default=True, help="Write files of --entries-per-file entries, or one hive-style directory per entry")
+@click.option("--entries-per-file", type=click.IntRange(min=1), default=1000, show_default=True, help="Entries per file, with --partition-by chunk")
+@click.option("--row-group-size", type=click.IntRange(min=1), default=64 * 1024, show_default=True, help="Rows per Parquet row group. Each table buffers at most this many rows")
+@click.option("--compression", type=click.Choice(["zstd", "snappy", "gzip", "none"]), default="zstd", show_default=True, help="Parquet compression codec")
+@click.option("--workers", type=click.IntRange(min=1), default=1, show_default=True, help="Number of processes parsing entry files")
+@click.option("--entry-column", help="Add a column with this name holding the entry id, as given to process_categories")
+@click.option("--column-profile", type=click.Path(exists=True, dir_okay=False), callback=read_profile, help=COLUMN_PROFILE_HELP)
+@click.option("--enums", type=click.Choice(ENUMS), default="none", help=f"{ENUMS_HELP}. Native enumerations become Arrow dictionary columns")
+def parquet(entry_files, output_dir, partition_by, entries_per_file, row_group_size, compression, workers, entry_column, column_profile, enums, **kwargs):
+    """Write the categories of the mmCIF ENTRY_FILES to a Parquet
+    dataset per table generated for MMCIF_DICTIONARY. Directories are
+    searched recursively for *.cif files.
+    """
+    cat_objs = read_categories(**kwargs)
+
+    from mmcif_db_tool.loader import iter_entry_files
+    from mmcif_db_tool.parquet import ParquetExporter
+
+    sm = SchemaMap(entry_column=entry_column, profile=column_profile, enums=enums_option(enums), ignore_relationships=True)
+    sm.add_categories(cat_objs)
+
+    exporter = ParquetExporter(
+        output_dir,
+        sm.get_tables(),
+        partition_by=partition_by,
+        entries_per_file=entries_per_file,
+        row_group_size=row_group_size,
+        compression=None if compression == "none" else compression,
+    )
+    paths = iter_entry_files(entry_files)
+    if workers > 1:
+        exporter.export_files_parallel(paths, workers)
+    else:
+        exporter.export_files(paths)
+
+    for name, count in exporter.row_counts.items():
+        click.echo(f"{name}: {count} rows", err=True)
+
+    if exporter.failed:
+        for path, error in exporter.failed.items():
+            click.echo(f"Failed {path}: {error}", err=True)
+        sys.exit(1)
+
+
+@cli.command("profile")
+@click.argument("entry_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--output-file", required=True, type=click.Path(), help="Path to the profile file (JSON)")
+@click.option("--workers", type=click.IntRange(min=1), default=1, show_default=True, help="Number of processes scanning entry files")
+@click.option("--verbose", "-v", is_flag=True, help="Print debug messages")
+def profile(entry_files, output_file, workers, verbose):
+    """Record the maximum length, numeric range and null ratio of
+    every item in ENTRY_FILES. Directories are searched recursively
+    for *.cif files.
+
+    Pass the profile to the other commands with --column-profile to
+    size the columns from it.
+    """
+    from mmcif_db_tool.loader import iter_entry_files
+    from mmcif_db_tool.profile import profile_files
+
+    if verbose:
+        logging.basicConfig(level=logging.DEBUG)
+
+    corpus_profile, failed = profile_files(iter_entry_files(entry_files), workers=workers)
+    corpus_profile.save(output_file)
+    click.echo(f"Profiled {len(corpus_profile.items)} items in {corpus_profile.files} files", err=True)
+
+    if failed:
+        for path, error in failed.items():
+            click.echo(f"Failed {path}: {error}", err=True)
+        sys.exit(1)
+
+
 if __name__ == "__main__":
-    process_categories()
+    cli()
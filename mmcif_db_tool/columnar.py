@@ -0,0 +1,267 @@
+"""Column-wise conversion of mmCIF loops into typed NumPy arrays.
+
+`loader.category_rows` converts values one cell at a time, which
+dominates the load of large loops such as atom_site. Here the values
+of a loop are fetched from gemmi in one call and each column is
+converted in bulk: null markers are found with one comparison over
+the whole column, numbers are parsed by NumPy, and only the values
+that are quoted or text fields go through `cif.as_string`. Each
+column gives a `ColumnArray`, the values in the NumPy dtype of the
+column subtype plus a mask of the nulls.
+"""
+import numpy as np
+from gemmi import cif
+
+from mmcif_db_tool.loader import block_entry_id, default_value
+
+INTEGER_DTYPES = {
+    "SmallInteger": np.int16,
+    "Integer": np.int32,
+    "BigInteger": np.int64,
+}
+
+TRUE_VALUES = ["y", "yes", "true", "1"]
+
+# first characters of the values that need unquoting
+QUOTES = ("'", '"', ";")
+
+
+class ColumnArray:
+    """Converted values of one column and the mask of its nulls.
+
+    Masked slots of `values` hold a filler (0, NaN, NaT or None) and
+    must not be read. Strings are kept in object arrays.
+    """
+    __slots__ = ("values", "mask")
+
+    def __init__(self, values, mask):
+        self.values = values
+        self.mask = mask
+
+    def __len__(self):
+        return len(self.values)
+
+    def to_list(self):
+        """The values as Python objects, with None for nulls."""
+        values = self.values
+        if values.dtype.kind == "M":
+            # coarser units give datetime objects, nanoseconds give ints
+            values = values.astype("datetime64[us]")
+        values = values.astype(object)
+        values[self.mask] = None
+        return values.tolist()
+
+
+def null_mask(raw):
+    return (raw == "?") | (raw == ".")
+
+
+def has_quotes(raw):
+    # one scan of the joined values rules out quotes in most columns;
+    # only leading quotes count, not the primes of names such as O5'
+    joined = "\0" + "\0".join(raw)
+    return any("\0" + q in joined for q in QUOTES)
+
+
+def unquote(raw):
+    """`raw`, an object array of strings, with quoted strings and text
+    fields unquoted."""
+    if not has_quotes(raw):
+        return raw
+
+    values = raw.copy()
+    for i, value in enumerate(raw):
+        if value.startswith(QUOTES):
+            values[i] = cif.as_string(value)
+    return values
+
+
+def to_integers(values, subtype):
+    dtype = INTEGER_DTYPES.get(subtype, np.int64)
+    try:
+        numbers = np.array(values.tolist(), dtype=np.int64)
+    except OverflowError:
+        raise ValueError(f"values out of the range of {subtype}") from None
+    limits = np.iinfo(dtype)
+    if len(numbers) and (numbers.min() < limits.min or numbers.max() > limits.max):
+        raise ValueError(f"values out of the range of {subtype}")
+    return numbers.astype(dtype)
+
+
+def to_floats(values):
+    try:
+        return np.array(values.tolist(), dtype=np.float64)
+    except ValueError:
+        # drop the standard uncertainties, e.g. "1.234(5)"
+        return np.array([v.split("(")[0] for v in values], dtype=np.float64)
+
+
+def to_datetimes(values):
+    # dates are 'yyyy-mm-dd', optionally followed by ':hh:mm'
+    return np.char.replace(values.astype(str), ":", "T", count=1).astype("datetime64[s]")
+
+
+def to_dates(values):
+    return values.astype("<U10").astype("datetime64[D]")
+
+
+def to_booleans(values):
+    return np.isin(np.char.lower(values.astype(str)), TRUE_VALUES)
+
+
+def to_enumeration(values, column):
+    """Enumerated values as their spelling in the dictionary, or as
+    their id in the lookup table. Only the distinct values are looked
+    up."""
+    if column.lookup:
+        ids = {v.lower(): i for i, v in enumerate(column.enum_values, 1)}
+    else:
+        ids = {v.lower(): v for v in column.enum_values}
+
+    lowered = np.char.lower(values.astype(str))
+    distinct, inverse = np.unique(lowered, return_inverse=True)
+    for value in distinct:
+        if value not in ids:
+            original = values[np.flatnonzero(lowered == value)[0]]
+            raise ValueError(f"'{original}' is not one of the enumerated values")
+
+    mapped = [ids[v] for v in distinct.tolist()]
+    return np.array(mapped, dtype=np.int16 if column.lookup else object)[inverse]
+
+
+def convert_values(column, values):
+    """Convert the non-null, unquoted `values` of `column` to the
+    dtype of its type and subtype."""
+    if column.enum_values:
+        return to_enumeration(values, column)
+    if column.type == "int":
+        return to_integers(values, column.subtype)
+    if column.type == "float":
+        return to_floats(values)
+    if column.type == "datetime.datetime":
+        return to_datetimes(values)
+    if column.type == "datetime.date":
+        return to_dates(values)
+    if column.type == "bool":
+        return to_booleans(values)
+    return values
+
+
+def empty_array(column, n):
+    if column.enum_values and column.lookup:
+        return np.zeros(n, dtype=np.int16)
+    if column.enum_values:
+        return np.full(n, None, dtype=object)
+    if column.type == "int":
+        return np.zeros(n, dtype=INTEGER_DTYPES.get(column.subtype, np.int64))
+    if column.type == "float":
+        return np.full(n, np.nan)
+    if column.type == "datetime.datetime":
+        return np.full(n, np.datetime64("NaT"), dtype="datetime64[s]")
+    if column.type == "datetime.date":
+        return np.full(n, np.datetime64("NaT"), dtype="datetime64[D]")
+    if column.type == "bool":
+        return np.zeros(n, dtype=bool)
+    return np.full(n, None, dtype=object)
+
+
+def convert_column(column, raw, quoted=True):
+    """Convert `raw`, the list of raw strings of a loop column, to a
+    `ColumnArray` of the type of `column`. With `quoted` false, the
+    values are known not to need unquoting."""
+    raw = np.array(raw, dtype=object)
+    return masked_column(column, raw, null_mask(raw), quoted)
+
+
+def masked_column(column, raw, mask, quoted=False):
+    """Convert the strings of the object array `raw` that are not
+    masked to a `ColumnArray` of the type of `column`."""
+    if not mask.any():
+        return ColumnArray(convert_values(column, unquote(raw) if quoted else raw), mask)
+
+    values = empty_array(column, len(raw))
+    present = ~mask
+    if present.any():
+        values[present] = convert_values(column, unquote(raw[present]) if quoted else raw[present])
+    return ColumnArray(values, mask)
+
+
+def typed_column(column, binary_column):
+    """Convert a `bcif.BinaryColumn` to a `ColumnArray` of the type of
+    `column`. Numbers go straight to the dtype of numeric columns, and
+    are only formatted as strings for columns of other types."""
+    values, mask = binary_column.values, binary_column.null_mask()
+    if values.dtype.kind in "iuf" and not column.enum_values:
+        if column.type == "float":
+            return ColumnArray(values.astype(np.float64), mask)
+        if column.type == "int":
+            if values.dtype.kind == "f" and not np.array_equal(values[~mask], np.round(values[~mask])):
+                raise ValueError("values are not integers")
+            return ColumnArray(to_integers(values, column.subtype), mask)
+        values = values.astype(str)
+    return masked_column(column, values.astype(object), mask)
+
+
+def constant_column(column, value, n):
+    """`n` copies of `value`, already of the type of `column`, or
+    nulls if it is None."""
+    values = empty_array(column, n)
+    if value is None:
+        return ColumnArray(values, np.ones(n, dtype=bool))
+    values[:] = value
+    return ColumnArray(values, np.zeros(n, dtype=bool))
+
+
+def raw_columns(category):
+    """The raw strings of `category` as one list per tag, and whether
+    any of them may need unquoting. The values of a loop are fetched
+    from gemmi in one call."""
+    if category.loop is not None:
+        values = category.loop.values
+        width = category.loop.width()
+        return [values[i::width] for i in range(width)], has_quotes(values)
+    return [[category[0][i]] for i in range(category.width())], True
+
+
+def category_arrays(block, table):
+    """Return the columns of the category of `table` in `block` as
+    `ColumnArray`s by column name, or None if the block does not have
+    the category.
+
+    As in `loader.category_rows`, items missing from the block take
+    the default value of the column, and the entry column takes the id
+    of the entry.
+    """
+    category = block.find_mmcif_category(f"_{table.name}.")
+    if not category:
+        return None
+
+    n = len(category)
+    # BinaryCIF categories give typed columns rather than raw strings
+    typed = getattr(category, "typed", False)
+    raw, quoted = (None, False) if typed else raw_columns(category)
+    prefix_length = len(table.name) + 2
+    positions = {tag[prefix_length:].lower(): i for i, tag in enumerate(category.tags)}
+    arrays = {}
+    for column in table.columns:
+        pos = positions.get(column.name.lower())
+        try:
+            if column.name == table.entry_column:
+                arrays[column.name] = constant_column(column, block_entry_id(block), n)
+            elif pos is None:
+                arrays[column.name] = constant_column(column, default_value(column), n)
+            elif typed:
+                arrays[column.name] = typed_column(column, category.column(pos))
+            else:
+                arrays[column.name] = convert_column(column, raw[pos], quoted)
+        except ValueError as e:
+            raise ValueError(f"Invalid value for _{table.name}.{column.name}: {e}") from e
+    return arrays
+
+
+def array_rows(arrays):
+    """The rows of `category_arrays`, as dicts keyed by column name."""
+    if not arrays:
+        return []
+    names = list(arrays)
+    return [dict(zip(names, values)) for values in zip(*(a.to_list() for a in arrays.values()))]
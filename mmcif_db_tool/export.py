@@ -0,0 +1,222 @@
+import os
+import csv
+import logging
+import datetime
+
+from concurrent.futures import ProcessPoolExecutor
+
+from mmcif_db_tool.instrument import count, timer
+from mmcif_db_tool.loader import _init_worker, _parse_entry, bounded_map, entry_rows
+from mmcif_db_tool.metadata import build_metadata, dump_tables
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["csv", "tsv"]
+
+POSTGRESQL_SCRIPT = "load_postgresql{}.sql"
+SQLITE_SCRIPT = "load_sqlite{}.sql"
+
+# escapes of the PostgreSQL COPY text format
+TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def csv_value(value):
+    # booleans as 1 and 0, which both PostgreSQL and SQLite read back
+    if isinstance(value, bool):
+        return int(value)
+    # datetimes as SQLAlchemy stores them in SQLite
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(" ", "microseconds")
+    return value
+
+
+def tsv_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, str):
+        return value.translate(TSV_ESCAPES)
+    return str(value)
+
+
+class _CsvFile:
+    """CSV with a header row. Nulls are empty unquoted fields, as read
+    by COPY ... (FORMAT csv), so empty strings read back as nulls."""
+
+    def __init__(self, path, columns):
+        self._f = open(path, "w", newline="")
+        self._writer = csv.writer(self._f)
+        self._writer.writerow(columns)
+        self._columns = columns
+
+    def write(self, rows):
+        self._writer.writerows([csv_value(row[c]) for c in self._columns] for row in rows)
+
+    def close(self):
+        self._f.close()
+
+
+class _TsvFile:
+    """PostgreSQL COPY text format: tab-separated, backslash escapes
+    and \\N for nulls, without a header."""
+
+    def __init__(self, path, columns):
+        self._f = open(path, "w", newline="\n")
+        self._columns = columns
+
+    def write(self, rows):
+        self._f.writelines("\t".join(tsv_value(row[c]) for c in self._columns) + "\n" for row in rows)
+
+    def close(self):
+        self._f.close()
+
+
+FILE_TYPES = {"csv": _CsvFile, "tsv": _TsvFile}
+
+
+class DelimitedExporter:
+    """Write mmCIF entries to one delimited file per table built by a
+    `SchemaMap`, for the bulk load path of the database.
+
+    Columns are in table order and values converted as for
+    `EntryLoader`. With `entries_per_file`, a new file is started for
+    every table after that many entries, and the scripts loading the
+    files of a part (`load_postgresql-00000.sql`, ...) are written as
+    soon as it is finished, so it can be loaded while the export goes
+    on. `write_scripts()` writes the PostgreSQL and SQLite scripts
+    loading all the files.
+    """
+
+    def __init__(self, output_dir, tables, format="csv", entries_per_file=None):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}, got '{format}'")
+
+        self._output_dir = output_dir
+        self._format = format
+        self._entries_per_file = entries_per_file
+        # lookup tables are filled when created, not from the entries
+        self._tables = [t for t in tables if not t.lookup_values]
+        self._columns = {t.name: [c.name for c in t.columns] for t in self._tables}
+        # parents before children, the order of the load scripts
+        by_name = {t.name: t for t in self._tables}
+        self._ordered = [by_name[t.name] for t in build_metadata(tables).sorted_tables if t.name in by_name]
+        self._open = {}
+        self._entries_in_file = 0
+        self._part = 0
+        self.files = {t.name: [] for t in self._tables}
+        self.row_counts = {t.name: 0 for t in self._tables}
+        self.failed = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def export_files(self, paths):
+        for path in paths:
+            logger.debug(f"Exporting {path}")
+            try:
+                rows = entry_rows(path, self._tables)
+            except Exception as e:
+                self._add_failure(path, f"{type(e).__name__}: {e}")
+                continue
+            self.add_rows(rows)
+        self.close()
+
+    def export_files_parallel(self, paths, workers, max_pending=None):
+        """Parse and convert entries in a pool of `workers` processes,
+        as `EntryLoader.load_files_parallel` does, and write the rows
+        from this process."""
+        max_pending = max_pending or 2 * workers
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dump_tables(self._tables),)) as executor:
+            for path, rows, error in bounded_map(executor, _parse_entry, paths, max_pending):
+                if error is not None:
+                    self._add_failure(path, error)
+                    continue
+
+                logger.debug(f"Exporting {path}")
+                self.add_rows(rows)
+        self.close()
+
+    def add_rows(self, rows):
+        """Write the rows of one entry, by table name."""
+        if self._entries_per_file and self._entries_in_file == self._entries_per_file:
+            self._close_files()
+            self._part += 1
+            self._entries_in_file = 0
+
+        with timer("writing") as t:
+            for name, table_rows in rows.items():
+                if table_rows:
+                    self._file(name).write(table_rows)
+                    self.row_counts[name] += len(table_rows)
+            t.items = sum(map(len, rows.values()))
+        self._entries_in_file += 1
+
+    def _file(self, name):
+        f = self._open.get(name)
+        if f is None:
+            filename = f"{name}-{self._part:05d}.{self._format}" if self._entries_per_file else f"{name}.{self._format}"
+            f = self._open[name] = FILE_TYPES[self._format](os.path.join(self._output_dir, filename), self._columns[name])
+            self.files[name].append(filename)
+        return f
+
+    def _add_failure(self, path, error):
+        logger.warning(f"Skipping {path}: {error}")
+        count("failed_entries")
+        self.failed[path] = error
+
+    def _close_files(self):
+        for f in self._open.values():
+            f.close()
+        if self._entries_per_file and self._open:
+            paths = self._write_scripts({name: [self.files[name][-1]] for name in self._open}, f"-{self._part:05d}")
+            logger.debug(f"Wrote {', '.join(paths)}")
+        self._open = {}
+
+    def close(self):
+        self._close_files()
+
+    def write_scripts(self):
+        """Write the scripts loading all the files into existing tables,
+        parents before children, and return their paths. The SQLite
+        script is only written for CSV, as `.import` does not decode
+        the escapes of the text format."""
+        return self._write_scripts(self.files)
+
+    def _write_scripts(self, files, suffix=""):
+        tables = [t for t in self._ordered if files.get(t.name)]
+        scripts = [(POSTGRESQL_SCRIPT.format(suffix), self._postgresql_script)]
+        if self._format == "csv":
+            scripts.append((SQLITE_SCRIPT.format(suffix), self._sqlite_script))
+
+        paths = []
+        for filename, script in scripts:
+            paths.append(os.path.join(self._output_dir, filename))
+            with open(paths[-1], "w") as f:
+                f.write(script(filename, tables, files))
+        return paths
+
+    def _postgresql_script(self, filename, tables, files):
+        options = "FORMAT csv, HEADER true" if self._format == "csv" else "FORMAT text"
+        lines = [f"-- psql -f {filename}, from this directory", "BEGIN;"]
+        for table in tables:
+            columns = ", ".join(f'"{c.name}"' for c in table.columns)
+            for name in files[table.name]:
+                lines.append(f"\\copy \"{table.name}\" ({columns}) FROM '{name}' WITH ({options})")
+        lines.append("COMMIT;")
+        return "\n".join(lines) + "\n"
+
+    def _sqlite_script(self, filename, tables, files):
+        # .import reads the empty fields of nulls as empty strings, so
+        # the files go through a temporary table whose rows are copied
+        # with NULLIF, leaving the rows already in the tables alone
+        lines = [f"-- sqlite3 DATABASE < {filename}, from this directory", "BEGIN;"]
+        for table in tables:
+            imported = f"import_{table.name}"
+            columns = ", ".join(f'"{c.name}"' for c in table.columns)
+            values = ", ".join(f"NULLIF(\"{c.name}\", '')" if c.nullable else f'"{c.name}"' for c in table.columns)
+            lines.append(f'CREATE TEMP TABLE "{imported}" ({columns});')
+            for name in files[table.name]:
+                lines.append(f'.import --csv --skip 1 "{name}" "{imported}"')
+            lines.append(f'INSERT INTO "{table.name}" ({columns}) SELECT {values} FROM "{imported}";')
+            lines.append(f'DROP TABLE "{imported}";')
+        lines.append("COMMIT;")
+        return "\n".join(lines) + "\n"
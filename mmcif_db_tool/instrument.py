@@ -0,0 +1,118 @@
+import sys
+import json
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class Phase:
+    """Wall time, calls and items processed by one phase of a run."""
+
+    def __init__(self):
+        self.wall_time = 0.0
+        self.calls = 0
+        self.items = 0
+
+    def to_dict(self):
+        return {
+            "wall_time": round(self.wall_time, 6),
+            "calls": self.calls,
+            "items": self.items,
+            "items_per_second": round(self.items / self.wall_time, 1) if self.wall_time and self.items else None,
+        }
+
+
+class _Timer:
+    def __init__(self, phase, items):
+        self._phase = phase
+        # may be set within the block, once the number is known
+        self.items = items
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._phase.wall_time += time.perf_counter() - self._start
+        self._phase.calls += 1
+        self._phase.items += self.items
+        return False
+
+
+class _NullTimer:
+    items = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instrumentation:
+    """Timers and counters around the phases of a run.
+
+    Until `enable()` is called, `timer()` returns a shared no-op
+    context manager and `count()` returns at once, so instrumented
+    code costs next to nothing in normal runs. Phases may nest, e.g.
+    item parsing happens within category reading.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}
+        self.counters = {}
+        self._start = None
+
+    def enable(self):
+        self.enabled = True
+        self._start = time.perf_counter()
+
+    def reset(self):
+        self.enabled = False
+        self.phases = {}
+        self.counters = {}
+        self._start = None
+
+    def timer(self, phase, items=0):
+        """Time a block as one call of `phase` processing `items` items."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.phases.setdefault(phase, Phase()), items)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        wall_time = time.perf_counter() - self._start if self._start is not None else 0.0
+        return {
+            "wall_time": round(wall_time, 6),
+            "peak_memory_bytes": peak_memory(),
+            "phases": {name: phase.to_dict() for name, phase in self.phases.items()},
+            "counters": dict(self.counters),
+        }
+
+    def save(self, fp):
+        json.dump(self.report(), fp, indent=1)
+        fp.write("\n")
+
+
+def peak_memory():
+    """Peak resident set size of this process in bytes, if known."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+instruments = Instrumentation()
+timer = instruments.timer
+count = instruments.count
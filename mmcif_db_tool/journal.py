@@ -0,0 +1,128 @@
+"""Checkpoint journal of the entry files loaded into a database.
+
+The journal is a local SQLite file recording, per entry file, the
+status of its load, a SHA-256 of its content and the rows committed
+from it. An interrupted load restarted with the same journal skips
+the files already loaded and reloads the ones it was in the middle
+of, and a later run over the whole archive only loads the files that
+are new or whose content changed.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry_file (
+    path TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    entry_id TEXT,
+    row_counts TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LoadJournal:
+    """Journal of the entry files loaded from, kept in the SQLite file
+    at `path`.
+
+    A file is `started` before any of its rows are written, and `done`
+    once they are committed, with the entry id and the row counts. The
+    id is kept when the file is started again or fails, so that the
+    rows loaded from an earlier version of the file can be replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute(SCHEMA)
+        # hashes computed by is_loaded, for the begin that follows
+        self._hashes = {}
+
+    def get(self, path):
+        """The record of the entry file at `path`, or None."""
+        return self._conn.execute("SELECT * FROM entry_file WHERE path = ?", (os.path.abspath(path),)).fetchone()
+
+    def is_loaded(self, path):
+        """Whether the entry file at `path` was loaded completely from
+        its current content. The content is only hashed when the size
+        or modification time of the file changed."""
+        record = self.get(path)
+        stat = os.stat(path)
+        if record is not None and record["status"] == DONE and (record["size"], record["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            return True
+
+        digest = file_hash(path)
+        if record is None or record["status"] != DONE or record["hash"] != digest:
+            self._hashes[path] = digest
+            return False
+
+        # touched but unchanged
+        with self._conn:
+            self._conn.execute(
+                "UPDATE entry_file SET size = ?, mtime_ns = ? WHERE path = ?",
+                (stat.st_size, stat.st_mtime_ns, os.path.abspath(path)),
+            )
+        return True
+
+    def begin(self, path):
+        """Record the start of the load of the entry file at `path`.
+
+        Return the ids of the entries previously loaded from the file,
+        whose rows are to be replaced, or None for a file never seen
+        before.
+        """
+        record = self.get(path)
+        digest = self._hashes.pop(path, None) or file_hash(path)
+        stat = os.stat(path)
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO entry_file (path, status, hash, size, mtime_ns, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET status = excluded.status, hash = excluded.hash, size = excluded.size, "
+                "mtime_ns = excluded.mtime_ns, row_counts = NULL, error = NULL, updated = excluded.updated",
+                (os.path.abspath(path), STARTED, digest, stat.st_size, stat.st_mtime_ns, time.time()),
+            )
+        if record is None:
+            return None
+        return [record["entry_id"]] if record["entry_id"] is not None else []
+
+    def done(self, path, entry_id, row_counts):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE entry_file SET status = ?, entry_id = ?, row_counts = ?, updated = ? WHERE path = ?",
+                (DONE, entry_id, json.dumps(row_counts), time.time(), os.path.abspath(path)),
+            )
+
+    def failed(self, path, error):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE entry_file SET status = ?, error = ?, updated = ? WHERE path = ?",
+                (FAILED, error, time.time(), os.path.abspath(path)),
+            )
+
+    def summary(self):
+        """The number of entry files by status."""
+        return dict(self._conn.execute("SELECT status, count(*) FROM entry_file GROUP BY status").fetchall())
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,645 @@
+import os
+import logging
+import datetime
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+
+import sqlalchemy as sa
+from gemmi import cif
+
+from mmcif_db_tool.instrument import count, timer
+from mmcif_db_tool.metadata import build_table, dump_tables, load_tables
+from mmcif_db_tool.mmcif_dict import CategoryGraph
+from mmcif_db_tool.reader import ENTRY_SUFFIXES, read_block
+
+logger = logging.getLogger(__name__)
+
+# errors of the rows themselves, which only fail the entries holding
+# them; any other database error, e.g. a missing table or a lost
+# connection, aborts the load
+DATA_ERRORS = (sa.exc.IntegrityError, sa.exc.DataError)
+
+def to_float(value):
+    # drop the standard uncertainty, e.g. "1.234(5)"
+    return float(value.split("(")[0])
+
+
+def to_datetime(value):
+    # dates are 'yyyy-mm-dd', optionally followed by ':hh:mm'
+    if len(value) > 10 and value[10] == ":":
+        value = f"{value[:10]}T{value[11:]}"
+    return datetime.datetime.fromisoformat(value)
+
+
+def to_date(value):
+    return datetime.date.fromisoformat(value[:10])
+
+
+def to_bool(value):
+    return value.lower() in ("y", "yes", "true", "1")
+
+
+CONVERTERS = {
+    "str": str,
+    "int": int,
+    "float": to_float,
+    "datetime.datetime": to_datetime,
+    "datetime.date": to_date,
+    "bool": to_bool,
+}
+
+
+def enum_converter(column):
+    """Converter of the enumerated `column`: values are matched
+    case-insensitively and give their spelling in the dictionary, or
+    their id in the lookup table."""
+    if column.lookup:
+        ids = {v.lower(): i for i, v in enumerate(column.enum_values, 1)}
+    else:
+        ids = {v.lower(): v for v in column.enum_values}
+
+    def convert(value):
+        try:
+            return ids[value.lower()]
+        except KeyError:
+            raise ValueError(f"'{value}' is not one of the enumerated values") from None
+    return convert
+
+
+def get_converter(column):
+    if column.enum_values:
+        return enum_converter(column)
+    return CONVERTERS[column.type]
+
+
+def convert_value(column, value, converter=None):
+    """Convert a raw mmCIF value to the Python type of `column`.
+
+    The null markers '?' and '.' are converted to None.
+    """
+    if cif.is_null(value):
+        return None
+    return (converter or get_converter(column))(cif.as_string(value))
+
+
+def typed_value(column, value, converter=None):
+    """Convert a value decoded from BinaryCIF, a string, int or float,
+    or None for nulls, to the Python type of `column`. Numbers are only
+    formatted and parsed again for columns of other types."""
+    if value is None:
+        return None
+    if isinstance(value, str) or column.enum_values:
+        return (converter or get_converter(column))(str(value))
+    if column.type == "float":
+        return float(value)
+    if column.type == "int" and value == int(value):
+        return int(value)
+    return (converter or get_converter(column))(str(value))
+
+
+def default_value(column):
+    if column.default is None:
+        return None
+    return CONVERTERS[column.type](column.default)
+
+
+def block_entry_id(block):
+    value = block.find_value("_entry.id")
+    if value is None or cif.is_null(value):
+        return block.name
+    return cif.as_string(value)
+
+
+def category_chunks(block, table, chunk_size=None):
+    """Yield the rows of the category of `table` in `block` in lists of
+    at most `chunk_size` rows, converting each list only when it is
+    requested. Without `chunk_size`, all the rows are yielded at once.
+
+    Each row is a dict keyed by column name. Items missing from the
+    block take the default value of the column, and the entry column
+    of the table, if any, takes the id of the entry.
+    """
+    category = block.find_mmcif_category(f"_{table.name}.")
+    if not category:
+        return
+
+    # BinaryCIF categories give typed values rather than raw strings
+    typed = getattr(category, "typed", False)
+    length = len(category)
+    prefix_length = len(table.name) + 2
+    positions = {tag[prefix_length:].lower(): i for i, tag in enumerate(category.tags)}
+    sources = []
+    for column in table.columns:
+        pos = positions.get(column.name.lower())
+        try:
+            if column.name == table.entry_column:
+                sources.append((block_entry_id(block), None, None))
+            elif pos is None:
+                sources.append((default_value(column), None, None))
+            else:
+                sources.append((None, category.column(pos), get_converter(column)))
+        except ValueError as e:
+            raise ValueError(f"Invalid value for _{table.name}.{column.name}: {e}") from e
+
+    names = [c.name for c in table.columns]
+    chunk_size = chunk_size or length
+    for start in range(0, length, chunk_size):
+        stop = min(start + chunk_size, length)
+        columns = []
+        for column, (constant, values, converter) in zip(table.columns, sources):
+            if values is None:
+                columns.append([constant] * (stop - start))
+                continue
+            try:
+                if typed:
+                    columns.append([typed_value(column, v, converter) for v in values.typed_values(start, stop)])
+                else:
+                    columns.append([convert_value(column, values[i], converter) for i in range(start, stop)])
+            except ValueError as e:
+                raise ValueError(f"Invalid value for _{table.name}.{column.name}: {e}") from e
+        yield [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def category_rows(block, table):
+    """Return the rows of the category of `table` in `block`, as
+    `category_chunks` does in a single chunk."""
+    return next(category_chunks(block, table), [])
+
+
+# rough sizes in memory of converted values, in bytes, used to fit
+# chunks of rows in a memory budget
+VALUE_SIZES = {
+    "SmallInteger": 28,
+    "Integer": 28,
+    "BigInteger": 32,
+    "Float": 24,
+    "DateTime": 48,
+    "Date": 32,
+    "Boolean": 0,
+}
+STR_SIZE = 49
+TEXT_WIDTH = 1024
+ROW_SIZE = 64
+SLOT_SIZE = 24
+
+
+def value_size(column):
+    """Estimated size of a converted value of `column`. Strings are
+    taken at the full width of their column, and unbounded text at
+    `TEXT_WIDTH` characters."""
+    name, _, args = column.subtype.partition("(")
+    if name == "String":
+        return STR_SIZE + int(args.rstrip(")"))
+    if name == "Text":
+        return STR_SIZE + TEXT_WIDTH
+    # native enumerations share the strings of their converter
+    return VALUE_SIZES.get(name, 0)
+
+
+def row_size(table):
+    """Estimated size of a converted row of `table`: a dict of its
+    column values."""
+    return ROW_SIZE + sum(SLOT_SIZE + value_size(c) for c in table.columns)
+
+
+def chunk_size(table, memory_budget):
+    """Number of rows of `table` converted at a time to stay within
+    `memory_budget` bytes."""
+    return max(1, memory_budget // row_size(table))
+
+
+def entry_rows(path, tables):
+    """Read the entry file at `path` and return its rows per table name."""
+    with timer("entry_reading", items=1):
+        block = read_block(path)
+    return block_rows(block, tables)
+
+
+def block_rows(block, tables):
+    """Return the rows of `block` per table name."""
+    with timer("row_conversion") as t:
+        rows = {table.name: category_rows(block, table) for table in tables}
+        t.items = sum(map(len, rows.values()))
+    return rows
+
+
+def iter_entry_files(paths):
+    """Yield the entry files in `paths`, walking directories recursively
+    for plain, gzip-compressed and BinaryCIF files."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(ENTRY_SUFFIXES):
+                    yield os.path.join(root, name)
+
+
+def bounded_map(executor, fn, items, max_pending):
+    """Yield the results of `fn` over `items` as they complete, with
+    at most `max_pending` calls submitted to `executor` at any time."""
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    for future in as_completed(pending):
+        yield future.result()
+
+
+# tables of the worker process, set once by the pool initializer
+_worker_tables = None
+
+
+def load_plan(tables):
+    """The `CategoryGraph` of the foreign keys between `tables`, giving
+    the waves in which their rows are written. Lookup tables are left
+    out, as they are filled when created."""
+    return CategoryGraph({t.name: [fk.parent_table for fk in t.foreign_keys] for t in tables if not t.lookup_values})
+
+
+def plan_text(plan):
+    """The waves of `plan`, one line each, with the tables of a cycle
+    in parentheses, and the foreign keys deferred to break cycles."""
+    lines = [
+        f"Wave {i}: " + ", ".join(g[0] if len(g) == 1 and (g[0], g[0]) not in plan.deferred else f"({' + '.join(g)})" for g in wave)
+        for i, wave in enumerate(plan.waves, 1)
+    ]
+    if plan.deferred:
+        lines.append("Deferred: " + ", ".join(f"{child} -> {parent}" for child, parent in sorted(plan.deferred)))
+    return "\n".join(lines)
+
+
+def _init_worker(schema):
+    # `schema` is the form of the tables given by dump_tables
+    global _worker_tables
+    _worker_tables = load_tables(schema)
+
+
+def _parse_entry(path):
+    try:
+        return path, entry_rows(path, _worker_tables), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+# loader of the worker process writing entries itself
+_worker_loader = None
+
+
+def _init_writer(url, schema, batch_size, memory_budget):
+    global _worker_loader
+    _worker_loader = EntryLoader(sa.create_engine(url), load_tables(schema), batch_size=batch_size, memory_budget=memory_budget)
+
+
+def _write_entry(item):
+    path, replace = item
+    try:
+        return path, _worker_loader.write_entry(path, replace), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+class EntryLoader:
+    """Insert mmCIF entries into the tables built by a `SchemaMap`.
+
+    Rows are buffered per table and written with one executemany
+    call per batch of `batch_size` rows. Entries that cannot be read
+    or converted are skipped and recorded in `failed`, and so are the
+    entries the database rejects: a batch that fails is written again
+    entry by entry, each under a savepoint, and the entries that still
+    fail leave no rows behind. Their rows in the tables written before
+    are deleted by entry column; tables without one are written
+    together, in one transaction per flush, so each entry is written
+    whole or not at all.
+
+    With a `memory_budget` in bytes or a `journal`, each entry is
+    written in a transaction of its own instead (see `write_entry`).
+    With a memory budget, each category is converted in chunks of rows
+    sized from the widths of its columns (see `chunk_size`), and each
+    chunk is written before the next one is converted. The parsed file
+    itself is not counted in the budget.
+
+    With a `LoadJournal`, the files it records as loaded from their
+    current content are skipped and counted in `skipped`, and the rows
+    of the files loaded before, partially or from other content, are
+    replaced. This needs an entry column in the tables.
+
+    `progress`, if given, is called after each file with its path and
+    one of "loaded", "skipped" and "failed".
+
+    Tables are written parent first, in the waves of `load_plan`: a
+    batch filling up flushes the pending rows of every table, wave by
+    wave, when the tables have foreign keys between them. The tables
+    of a wave do not depend on each other, and `table_workers`
+    connections write them at once, each in a transaction of its own;
+    tables in a cycle are written together, in one transaction.
+    """
+
+    def __init__(self, engine, tables, batch_size=1000, memory_budget=None, journal=None, progress=None, table_workers=1):
+        self._engine = engine
+        self._batch_size = batch_size
+        self._memory_budget = memory_budget
+        self._journal = journal
+        self._progress = progress
+        self._per_entry = bool(memory_budget or journal)
+        self._metadata = sa.MetaData()
+        self._sa_tables = {t.name: build_table(self._metadata, t) for t in tables}
+        self._plan = load_plan(tables)
+        # lookup tables are filled when created, not from the entries,
+        # and the others are written parents first
+        self._by_name = {t.name: t for t in tables}
+        self._tables = [self._by_name[name] for name in self._plan.order()]
+        self._ordered = any(self._plan.parents.values())
+        # without entry columns, rows written cannot be told apart by
+        # entry, so every flush writes all the tables at once
+        self._atomic = not all(t.entry_column for t in self._tables)
+        if table_workers > 1 and engine.dialect.name == "sqlite" and engine.url.database in (None, "", ":memory:"):
+            raise ValueError("Writing tables concurrently needs a database file, in-memory SQLite databases are not shared between connections")
+        self._table_workers = table_workers
+        if journal is not None and not all(t.entry_column for t in self._tables):
+            raise ValueError("Loading with a journal needs an entry column in the tables, to replace the rows of reloaded entries")
+        # lists of the (path, rows) of each entry, by table name
+        self._pending = {t.name: [] for t in self._tables}
+        self._pending_rows = {t.name: 0 for t in self._tables}
+        # names of the tables with rows of an entry not written yet,
+        # and the entry id and rows written per table of the entry
+        self._unwritten = {}
+        self._written = {}
+        self.row_counts = {t.name: 0 for t in self._tables}
+        self.failed = {}
+        self.skipped = 0
+
+    def create_tables(self):
+        self._metadata.create_all(self._engine)
+
+    def load_files(self, paths):
+        for path, replace in self._entries(paths):
+            logger.debug(f"Loading {path}")
+            try:
+                if self._per_entry:
+                    self._entry_written(path, *self.write_entry(path, replace))
+                    continue
+                rows = entry_rows(path, self._tables)
+            except Exception as e:
+                self._add_failure(path, f"{type(e).__name__}: {e}")
+                continue
+            self.add_rows(rows, path)
+        self.flush()
+
+    def load_files_parallel(self, paths, workers, max_pending=None):
+        """Parse and convert entries in a pool of `workers` processes.
+
+        The rows are written from this process. At most `max_pending`
+        entries (twice the number of workers by default) are in flight
+        at any time, so memory does not grow with the number of files.
+
+        With a memory budget or a journal, each worker writes its
+        entries into the database itself, with the budget applying to
+        every worker, and only the row counts come back. SQLite
+        serializes these writers: give the URL a `timeout` long enough
+        for the largest entry.
+        """
+        max_pending = max_pending or 2 * workers
+        if self._per_entry:
+            initializer, initargs, fn = _init_writer, (self._engine.url, dump_tables(self._tables), self._batch_size, self._memory_budget), _write_entry
+            items = self._entries(paths)
+        else:
+            initializer, initargs, fn = _init_worker, (dump_tables(self._tables),), _parse_entry
+            items = paths
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+            for path, result, error in bounded_map(executor, fn, items, max_pending):
+                if error is not None:
+                    self._add_failure(path, error)
+                    continue
+
+                logger.debug(f"Loading {path}")
+                if self._per_entry:
+                    self._entry_written(path, *result)
+                else:
+                    self.add_rows(result, path)
+        self.flush()
+
+    def _entries(self, paths):
+        """Yield the paths to load with the entry ids whose rows they
+        replace, skipping the files the journal has loaded already."""
+        for path in paths:
+            if self._journal is None:
+                yield path, None
+            elif self._journal.is_loaded(path):
+                logger.debug(f"Skipping {path}, loaded already")
+                count("skipped_entries")
+                self.skipped += 1
+                self._report(path, "skipped")
+            else:
+                yield path, self._journal.begin(path)
+
+    def write_entry(self, path, replace=None):
+        """Load the entry file at `path` in one transaction, a chunk of
+        rows at a time with a memory budget, and return its entry id and
+        the number of rows written per table name.
+
+        Unless `replace` is None, the rows of the entry are deleted
+        first, together with those of the entries with the ids in
+        `replace`.
+        """
+        with timer("entry_reading", items=1):
+            block = read_block(path)
+        entry_id = block_entry_id(block)
+
+        written = {}
+        with self._engine.begin() as conn:
+            if replace is not None:
+                self._delete_entries(conn, {entry_id, *replace})
+                count("replaced_entries")
+            for table in self._tables:
+                size = chunk_size(table, self._memory_budget) if self._memory_budget else None
+                chunks = category_chunks(block, table, size)
+                while True:
+                    with timer("row_conversion") as t:
+                        rows = next(chunks, [])
+                        t.items = len(rows)
+                    if not rows:
+                        break
+                    self._insert(conn, table.name, rows)
+                    written[table.name] = written.get(table.name, 0) + len(rows)
+                    count("chunks")
+        return entry_id, written
+
+    def _delete_entries(self, conn, entry_ids, names=None):
+        """Delete the rows of the entries with the ids `entry_ids` from
+        the tables `names`, or from every table."""
+        # children first, as the rows may be referenced
+        columns = {t.name: t.entry_column for t in self._tables if names is None or t.name in names}
+        for sa_table in reversed(self._metadata.sorted_tables):
+            if sa_table.name in columns:
+                conn.execute(sa_table.delete().where(sa_table.c[columns[sa_table.name]].in_(entry_ids)))
+
+    def _entry_written(self, path, entry_id, written):
+        for name, n in written.items():
+            self.row_counts[name] += n
+        if self._journal is not None:
+            self._journal.done(path, entry_id, written)
+        self._report(path, "loaded")
+
+    def _report(self, path, status):
+        if self._progress is not None:
+            self._progress(path, status)
+
+    def load_file(self, path):
+        self.add_rows(entry_rows(path, self._tables), path)
+
+    def add_rows(self, rows, path=None):
+        """Buffer the rows of the entry file at `path`, by table name.
+        The entry is reported as loaded once they are all written."""
+        names = [name for name, table_rows in rows.items() if table_rows]
+        if not names:
+            self._report(path, "loaded")
+            return
+
+        self._unwritten[path] = set(names)
+        if not self._atomic:
+            table = self._by_name[names[0]]
+            self._written[path] = (rows[table.name][0][table.entry_column], {})
+        full = []
+        for name in names:
+            self._pending[name].append((path, rows[name]))
+            self._pending_rows[name] += len(rows[name])
+            if self._pending_rows[name] >= self._batch_size:
+                full.append(name)
+        if full and (self._ordered or self._atomic):
+            # the parents of the full tables may have pending rows too
+            self.flush()
+        else:
+            for name in full:
+                self._flush_group([name])
+
+    def _add_failure(self, path, error):
+        logger.warning(f"Skipping {path}: {error}")
+        count("failed_entries")
+        self.failed[path] = error
+        if self._journal is not None:
+            self._journal.failed(path, error)
+        self._report(path, "failed")
+
+    def flush(self):
+        """Write the pending rows of every table, wave by wave, or all
+        together without entry columns."""
+        if self._atomic:
+            names = [t.name for t in self._tables if self._pending[t.name]]
+            if names:
+                self._flush_group(names)
+            return
+
+        for wave in self._plan.waves:
+            groups = [g for g in wave if any(self._pending[name] for name in g)]
+            if self._table_workers > 1 and len(groups) > 1:
+                # the workers only write; the loader's state is updated
+                # from their results, in this thread
+                batches = [(g, self._take_pending(g)) for g in groups]
+                with ThreadPoolExecutor(max_workers=self._table_workers) as executor:
+                    results = list(executor.map(lambda batch: self._write_group(*batch), batches))
+                # all the rows written first, so that an entry rejected
+                # by one group loses the rows another group wrote
+                self._record([w for written, _ in results for w in written], [f for _, failures in results for f in failures])
+            else:
+                for group in groups:
+                    self._flush_group(group)
+
+    def _flush_group(self, names):
+        self._record(*self._write_group(names, self._take_pending(names)))
+
+    def _take_pending(self, names):
+        pending = {name: self._pending[name] for name in names}
+        for name in names:
+            self._pending[name] = []
+            self._pending_rows[name] = 0
+        return pending
+
+    def _write_group(self, names, pending):
+        """Write the `pending` rows of the tables `names` in one
+        transaction, or entry by entry if the database rejects them.
+
+        Returns the (path, table name, row count) of the rows written
+        and the (path, error) of the entries rejected, and changes
+        nothing else, so that groups can be written from several
+        threads.
+        """
+        try:
+            with self._engine.begin() as conn:
+                for name in names:
+                    self._insert(conn, name, [row for _, rows in pending[name] for row in rows])
+        except DATA_ERRORS as e:
+            logger.info(f"Writing the batch of {', '.join(names)} entry by entry: {type(e).__name__}")
+            return self._write_entries(names, pending)
+
+        return [(path, name, len(rows)) for name in names for path, rows in pending[name]], []
+
+    def _write_entries(self, names, pending):
+        entries = {}
+        for name in names:
+            for path, rows in pending[name]:
+                entries.setdefault(path, {})[name] = rows
+
+        written = []
+        failures = []
+        with self._engine.begin() as conn:
+            for path, rows in entries.items():
+                savepoint = conn.begin_nested()
+                try:
+                    for name, table_rows in rows.items():
+                        self._insert(conn, name, table_rows)
+                    savepoint.commit()
+                except DATA_ERRORS as e:
+                    savepoint.rollback()
+                    failures.append((path, f"{type(e).__name__}: {e.orig}"))
+                    continue
+                written.extend((path, name, len(table_rows)) for name, table_rows in rows.items())
+        return written, failures
+
+    def _record(self, written, failures):
+        """Count the rows `written` by `_write_group`, report the
+        entries all written and drop the entries that failed."""
+        for path, name, n in written:
+            self.row_counts[name] += n
+            if path in self._written:
+                self._written[path][1][name] = n
+            unwritten = self._unwritten.get(path)
+            if unwritten is None:
+                continue
+            unwritten.discard(name)
+            if not unwritten:
+                del self._unwritten[path]
+                self._written.pop(path, None)
+                self._report(path, "loaded")
+        for path, error in failures:
+            self._drop_entry(path, error)
+
+    def _drop_entry(self, path, error):
+        """Remove the rows of the entry file at `path`, pending or
+        written, and record its failure."""
+        for name in self._unwritten.pop(path, ()):
+            kept = [(p, rows) for p, rows in self._pending[name] if p != path]
+            self._pending_rows[name] = sum(len(rows) for _, rows in kept)
+            self._pending[name] = kept
+        entry_id, written = self._written.pop(path, (None, {}))
+        if written:
+            with self._engine.begin() as conn:
+                self._delete_entries(conn, {entry_id}, written)
+            for name, n in written.items():
+                self.row_counts[name] -= n
+            count("deleted_entries")
+        self._add_failure(path, error)
+
+    def _insert(self, conn, name, rows):
+        with timer("writing", items=len(rows)):
+            for start in range(0, len(rows), self._batch_size):
+                conn.execute(self._sa_tables[name].insert(), rows[start:start + self._batch_size])
+                count("insert_batches")
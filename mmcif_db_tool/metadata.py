@@ -0,0 +1,133 @@
+"""Live SQLAlchemy schema objects built from the tables of a `SchemaMap`.
+
+The printers write the schema as source text; here the same tables
+become `sqlalchemy.Table` objects in a `MetaData`, and optionally
+declarative classes, without writing or importing any code. The
+tables themselves are plain slotted objects, so `dump_tables` gives
+them a compact pickled form that process-pool workers turn back into
+tables and metadata in a few milliseconds, instead of reading the
+dictionary and mapping it again.
+"""
+import zlib
+import pickle
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from mmcif_db_tool.schema_map import snakecase_to_camelcase, table_relationships
+
+# bump when the pickled form of the tables changes
+TABLES_FORMAT = 2
+
+SA_TYPES = {
+    "Integer": sa.Integer,
+    "SmallInteger": sa.SmallInteger,
+    "BigInteger": sa.BigInteger,
+    "Text": sa.Text,
+    "Float": sa.Float,
+    "DateTime": sa.DateTime,
+    "Date": sa.Date,
+    "Boolean": sa.Boolean,
+}
+
+
+def sa_type(subtype):
+    # subtypes are the type expressions written by the printers,
+    # e.g. "Integer" or "String(20)"
+    name, _, args = subtype.partition("(")
+    if name == "String":
+        return sa.String(int(args.rstrip(")")))
+    return SA_TYPES[name]()
+
+
+def column_type(column):
+    if column.enum_name:
+        return sa.Enum(*column.enum_values, name=column.enum_name)
+    return sa_type(column.subtype)
+
+
+def insert_lookup_values(target, connection, **kw):
+    values = target.info["lookup_values"]
+    connection.execute(target.insert(), [{"id": i, "value": v} for i, v in enumerate(values, 1)])
+
+
+def foreign_key_options(fk):
+    return {"deferrable": True, "initially": "DEFERRED"} if fk.deferred else {}
+
+
+def build_table(metadata, table):
+    """Add `table` to `metadata` as a `sqlalchemy.Table`, with the
+    constraints, indexes and partitioning the printers write for it.
+    Lookup tables are filled with their values when created."""
+    inline_fks = table.inline_foreign_keys()
+    columns = [
+        sa.Column(
+            c.name,
+            column_type(c),
+            *[sa.ForeignKey(fk.targets[0], **foreign_key_options(fk)) for fk in inline_fks.get(c.name, ())],
+            primary_key=c.index,
+            nullable=c.nullable,
+        )
+        for c in table.columns
+    ]
+    constraints = [sa.ForeignKeyConstraint(fk.columns, fk.targets, **foreign_key_options(fk)) for fk in table.composite_foreign_keys()]
+    indexes = [sa.Index(i.name, *i.columns) for i in table.indexes]
+    kwargs = {}
+    if table.partition_by:
+        kwargs["postgresql_partition_by"] = table.partition_by
+    if not table.lookup_values:
+        return sa.Table(table.name, metadata, *columns, *constraints, *indexes, **kwargs)
+
+    sa_table = sa.Table(table.name, metadata, *columns, *constraints, *indexes, info={"lookup_values": table.lookup_values}, **kwargs)
+    sa.event.listen(sa_table, "after_create", insert_lookup_values)
+    return sa_table
+
+
+def build_metadata(tables, metadata=None):
+    """A `MetaData` holding `tables`, added to `metadata` if given."""
+    metadata = sa.MetaData() if metadata is None else metadata
+    for table in tables:
+        build_table(metadata, table)
+    return metadata
+
+
+def declarative_classes(tables, base=None, lazy=None, default_lazy=None):
+    """Declarative classes mapped to `tables`, by class name.
+
+    The classes derive from `base`, or from a new `DeclarativeBase`
+    whose metadata holds the tables, and are named and related as in
+    the ORM source text, with `lazy` and `default_lazy` setting the
+    loading strategies of the relationships.
+    """
+    if base is None:
+        base = type("Base", (orm.DeclarativeBase,), {"metadata": sa.MetaData()})
+
+    relationships = table_relationships(tables, lazy, default_lazy)
+    classes = {}
+    for table in tables:
+        attrs = {"__table__": build_table(base.metadata, table)}
+        for r in relationships[table.name]:
+            attrs[r.name] = orm.relationship(
+                r.target,
+                back_populates=r.back_populates,
+                primaryjoin=r.join,
+                lazy=r.lazy or "select",
+                overlaps=",".join(r.overlaps) or None,
+                uselist=r.many,
+            )
+        class_name = snakecase_to_camelcase(table.name)
+        classes[class_name] = type(class_name, (base,), attrs)
+    return classes
+
+
+def dump_tables(tables):
+    """The compressed pickled form of `tables`, for `load_tables`."""
+    return zlib.compress(pickle.dumps((TABLES_FORMAT, tables), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_tables(data):
+    """The tables pickled by `dump_tables`."""
+    version, tables = pickle.loads(zlib.decompress(data))
+    if version != TABLES_FORMAT:
+        raise ValueError(f"Tables pickled in format {version}, expected {TABLES_FORMAT}")
+    return tables
@@ -0,0 +1,347 @@
+import json
+import sys
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
+from mmcif_db_tool.metadata import build_table
+from mmcif_db_tool.schema_map import string_list
+
+# integer and text types in increasing width
+INTEGER_WIDTHS = ["SmallInteger", "Integer", "BigInteger"]
+
+DIALECTS = ["postgresql", "mysql", "sqlite"]
+
+
+def type_name(subtype):
+    return subtype.partition("(")[0]
+
+
+def string_length(subtype):
+    return int(subtype[len("String("):-1])
+
+
+def widens(old, new):
+    """Whether the column type `new` holds every value of `old`."""
+    old_name, new_name = type_name(old), type_name(new)
+    if old_name in INTEGER_WIDTHS and new_name in INTEGER_WIDTHS:
+        return INTEGER_WIDTHS.index(new_name) >= INTEGER_WIDTHS.index(old_name)
+    if old_name == "String" and new_name == "String":
+        return string_length(new) >= string_length(old)
+    if old_name == "String" and new_name == "Text":
+        return True
+    if old_name in INTEGER_WIDTHS and new_name == "Float":
+        return True
+    return False
+
+
+class SchemaDiff:
+    """Differences between the tables generated from two versions of
+    a dictionary.
+
+    Tables and columns are matched by name. Columns whose type or
+    nullability changed are in `altered_columns`; enumerations whose
+    values changed in `altered_enums` (native) or `added_lookup_values`
+    (lookup tables, when values are only appended). Added columns are
+    always nullable, as the existing rows have no value for them.
+    Changes with no safe DDL, such as a new primary key, are described
+    in `notes`.
+    """
+
+    def __init__(self, old_tables, new_tables):
+        self.old_tables = old_tables
+        self.new_tables = new_tables
+        self.added_tables = []
+        self.dropped_tables = []
+        self.added_columns = []
+        self.dropped_columns = []
+        self.altered_columns = []
+        self.altered_enums = []
+        self.added_lookup_values = []
+        self.added_indexes = []
+        self.dropped_indexes = []
+        self.notes = []
+
+        old = {t.name: t for t in old_tables}
+        new = {t.name: t for t in new_tables}
+        self.added_tables = [t for t in new_tables if t.name not in old]
+        self.dropped_tables = [t for t in old_tables if t.name not in new]
+        for table in new_tables:
+            if table.name in old:
+                self._diff_table(old[table.name], table)
+
+    def __bool__(self):
+        return any([
+            self.added_tables, self.dropped_tables, self.added_columns, self.dropped_columns,
+            self.altered_columns, self.altered_enums, self.added_lookup_values,
+            self.added_indexes, self.dropped_indexes, self.notes,
+        ])
+
+    def _diff_table(self, old, new):
+        old_columns = {c.name: c for c in old.columns}
+        new_columns = {c.name: c for c in new.columns}
+        for column in new.columns:
+            previous = old_columns.get(column.name)
+            if previous is None:
+                self.added_columns.append((new, column))
+                if not column.nullable:
+                    self.notes.append(f"{new.name}.{column.name} is mandatory but added nullable: fill it in, then set it NOT NULL")
+            elif previous.enum_name and column.enum_name and previous.enum_values != column.enum_values:
+                self.altered_enums.append((new, previous, column))
+            elif previous.subtype != column.subtype or previous.nullable != column.nullable:
+                self.altered_columns.append((new, previous, column))
+        self.dropped_columns.extend((old, c) for c in old.columns if c.name not in new_columns)
+
+        if [c.name for c in old.columns if c.index] != [c.name for c in new.columns if c.index]:
+            self.notes.append(f"primary key of {new.name} changed, it is not migrated")
+
+        old_fks = sorted((fk.columns, fk.targets) for fk in old.foreign_keys)
+        new_fks = sorted((fk.columns, fk.targets) for fk in new.foreign_keys)
+        if old_fks != new_fks:
+            self.notes.append(f"foreign keys of {new.name} changed, they are not migrated")
+
+        old_indexes = {(i.name, tuple(i.columns)) for i in old.indexes}
+        new_indexes = {(i.name, tuple(i.columns)) for i in new.indexes}
+        self.added_indexes.extend((new, i) for i in new.indexes if (i.name, tuple(i.columns)) not in old_indexes)
+        self.dropped_indexes.extend((old, i) for i in old.indexes if (i.name, tuple(i.columns)) not in new_indexes)
+
+        if old.lookup_values != new.lookup_values:
+            count = len(old.lookup_values)
+            if new.lookup_values[:count] == old.lookup_values:
+                self.added_lookup_values.append((new, count, new.lookup_values[count:]))
+            else:
+                self.notes.append(f"values of {new.name} were removed or reordered, the ids stored in its referencing column change")
+
+
+def sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+class SqlMigrationPrinter:
+    def __init__(self, fp=sys.stdout, dialect="postgresql"):
+        """Print the SQL statements of a `SchemaDiff` for `dialect`,
+        one of DIALECTS."""
+        self._fp = fp
+        self._dialect_name = dialect
+        self._dialect = sa.create_mock_engine(f"{dialect}://", None).dialect
+        self._quote = self._dialect.identifier_preparer.quote
+
+    def print(self, diff):
+        new_metadata = sa.MetaData()
+        new_sa = {t.name: build_table(new_metadata, t) for t in diff.new_tables}
+        added = {t.name: t for t in diff.added_tables}
+
+        for note in diff.notes:
+            self._write(f"-- {note}", end="\n")
+        if diff.notes:
+            self._fp.write("\n")
+
+        enum_columns = [c for t in diff.added_tables for c in t.columns if c.enum_name]
+        enum_columns += [c for _, c in diff.added_columns if c.enum_name]
+        if self._dialect_name == "postgresql":
+            for column in enum_columns:
+                values = ", ".join(sql_literal(v) for v in column.enum_values)
+                self._write(f"CREATE TYPE {self._quote(column.enum_name)} AS ENUM ({values})")
+
+        for sa_table in new_metadata.sorted_tables:
+            if sa_table.name not in added:
+                continue
+            self._write(str(CreateTable(sa_table).compile(dialect=self._dialect)).strip())
+            for index in sa_table.indexes:
+                self._write(str(CreateIndex(index).compile(dialect=self._dialect)))
+            table = added[sa_table.name]
+            if table.lookup_values:
+                self._insert_lookup_values(table, 1, table.lookup_values)
+
+        for table, column in diff.added_columns:
+            sa_column = new_sa[table.name].c[column.name]
+            spec = CreateColumn(sa.Column(sa_column.name, sa_column.type)).compile(dialect=self._dialect)
+            self._write(f"ALTER TABLE {self._quote(table.name)} ADD COLUMN {spec}")
+
+        for table, old, new in diff.altered_columns:
+            self._alter_column(table, old, new, new_sa[table.name].c[new.name])
+
+        for table, old, new in diff.altered_enums:
+            self._alter_enum(table, old, new, new_sa[table.name].c[new.name])
+
+        for table, start, values in diff.added_lookup_values:
+            self._insert_lookup_values(table, start + 1, values)
+
+        for table, index in diff.added_indexes:
+            self._write(str(CreateIndex(self._sa_index(new_sa[table.name], index.name)).compile(dialect=self._dialect)))
+
+        for table, index in diff.dropped_indexes:
+            if self._dialect_name == "mysql":
+                self._write(f"DROP INDEX {self._quote(index.name)} ON {self._quote(table.name)}")
+            else:
+                self._write(f"DROP INDEX {self._quote(index.name)}")
+
+        for table, column in diff.dropped_columns:
+            self._write(f"ALTER TABLE {self._quote(table.name)} DROP COLUMN {self._quote(column.name)}")
+
+        old_metadata = sa.MetaData()
+        for table in diff.old_tables:
+            build_table(old_metadata, table)
+        dropped = {t.name for t in diff.dropped_tables}
+        for sa_table in reversed(old_metadata.sorted_tables):
+            if sa_table.name in dropped:
+                self._write(f"DROP TABLE {self._quote(sa_table.name)}")
+
+    def _sa_index(self, sa_table, name):
+        return next(i for i in sa_table.indexes if i.name == name)
+
+    def _alter_column(self, table, old, new, sa_column):
+        name = self._quote(table.name)
+        column = self._quote(new.name)
+        if not widens(old.subtype, new.subtype) and old.subtype != new.subtype:
+            self._write(f"-- {table.name}.{new.name} changes from {old.subtype} to {new.subtype}, which may not hold every value", end="\n")
+
+        if self._dialect_name == "mysql":
+            spec = CreateColumn(sa_column).compile(dialect=self._dialect)
+            self._write(f"ALTER TABLE {name} MODIFY COLUMN {spec}")
+        elif self._dialect_name == "postgresql":
+            if new.enum_name and not old.enum_name:
+                values = ", ".join(sql_literal(v) for v in new.enum_values)
+                self._write(f"CREATE TYPE {self._quote(new.enum_name)} AS ENUM ({values})")
+            if old.subtype != new.subtype:
+                new_type = sa_column.type.compile(dialect=self._dialect)
+                using = "" if widens(old.subtype, new.subtype) else f" USING {column}::{new_type}"
+                self._write(f"ALTER TABLE {name} ALTER COLUMN {column} TYPE {new_type}{using}")
+            if old.nullable != new.nullable:
+                action = "DROP NOT NULL" if new.nullable else "SET NOT NULL"
+                self._write(f"ALTER TABLE {name} ALTER COLUMN {column} {action}")
+        else:
+            # SQLite does not enforce declared lengths and cannot alter columns
+            self._write(f"-- {table.name}.{new.name} changes from {old.subtype} to {new.subtype}, nullable {new.nullable}: not altered in SQLite", end="\n")
+
+    def _alter_enum(self, table, old, new, sa_column):
+        added = [v for v in new.enum_values if v not in old.enum_values]
+        removed = [v for v in old.enum_values if v not in new.enum_values]
+        if self._dialect_name == "postgresql" and not removed:
+            for value in added:
+                self._write(f"ALTER TYPE {self._quote(new.enum_name)} ADD VALUE {sql_literal(value)}")
+        elif self._dialect_name == "postgresql":
+            self._write(f"-- values of {new.enum_name} were removed, the type is not altered", end="\n")
+        else:
+            self._alter_column(table, old, new, sa_column)
+
+    def _insert_lookup_values(self, table, start, values):
+        rows = ", ".join(f"({i}, {sql_literal(v)})" for i, v in enumerate(values, start))
+        self._write(f"INSERT INTO {self._quote(table.name)} (id, value) VALUES {rows}")
+
+    def _write(self, statement, end=";\n"):
+        self._fp.write(statement + end)
+
+
+def sa_column_text(column, foreign_keys=(), nullable=None):
+    params = [f'sa.ForeignKey("{fk.targets[0]}"{fk.options_text()})' for fk in foreign_keys]
+    if column.index and nullable is None:
+        params.append("primary_key=True")
+    params.append(f"nullable={column.nullable if nullable is None else nullable}")
+    return f'sa.Column("{column.name}", sa.{column.subtype}, {", ".join(params)})'
+
+
+class AlembicMigrationPrinter:
+    def __init__(self, fp=sys.stdout, message="Migrate the mmCIF schema", revision=None, down_revision=None):
+        """Print a `SchemaDiff` as an Alembic migration script, with
+        the downgrade reversing the upgrade."""
+        self._fp = fp
+        self._message = message
+        self._revision = revision or uuid.uuid4().hex[:12]
+        self._down_revision = down_revision
+
+    def print(self, diff):
+        self._fp.write(f'"""{self._message}\n\nRevision ID: {self._revision}\nRevises: {self._down_revision or ""}\n"""\n')
+        self._fp.write("from alembic import op\nimport sqlalchemy as sa\n\n\n")
+        self._fp.write(f'revision = "{self._revision}"\n')
+        down_revision = f'"{self._down_revision}"' if self._down_revision else "None"
+        self._fp.write(f"down_revision = {down_revision}\n")
+        self._fp.write("branch_labels = None\ndepends_on = None\n\n\n")
+
+        self._function("upgrade", self._upgrade(diff), [f"# {n}" for n in diff.notes])
+        self._fp.write("\n\n")
+        self._function("downgrade", self._downgrade(diff))
+
+    def _function(self, name, lines, comments=()):
+        self._fp.write(f"def {name}():\n")
+        for line in [*comments, *lines] or ["pass"]:
+            self._fp.write(f"    {line}\n")
+
+    def _create_table(self, table, lines):
+        inline_fks = table.inline_foreign_keys()
+        args = [sa_column_text(c, inline_fks.get(c.name, ())) for c in table.columns]
+        args.extend(f"sa.ForeignKeyConstraint({string_list(fk.columns)}, {string_list(fk.targets)}{fk.options_text()})" for fk in table.composite_foreign_keys())
+        target = f"{table.name} = " if table.lookup_values else ""
+        lines.append(f'{target}op.create_table("{table.name}",')
+        lines.extend(f"    {a}," for a in args)
+        lines.append(")")
+        for index in table.indexes:
+            lines.append(f'op.create_index("{index.name}", "{table.name}", {string_list(index.columns)})')
+        if table.lookup_values:
+            self._bulk_insert(table, 1, table.lookup_values, lines)
+
+    def _bulk_insert(self, table, start, values, lines):
+        rows = ", ".join(f'{{"id": {i}, "value": {json.dumps(v)}}}' for i, v in enumerate(values, start))
+        if start == 1:
+            lines.append(f"op.bulk_insert({table.name}, [{rows}])")
+        else:
+            lines.append(f'op.bulk_insert(sa.table("{table.name}", sa.column("id"), sa.column("value")), [{rows}])')
+
+    def _upgrade(self, diff):
+        lines = []
+        for table in _dependency_order(diff.added_tables, diff.new_tables):
+            self._create_table(table, lines)
+        for table, column in diff.added_columns:
+            lines.append(f'op.add_column("{table.name}", {sa_column_text(column, table.inline_foreign_keys().get(column.name, ()), nullable=True)})')
+        for table, old, new in diff.altered_columns + diff.altered_enums:
+            lines.append(self._alter_column(table, old, new))
+        for table, start, values in diff.added_lookup_values:
+            self._bulk_insert(table, start + 1, values, lines)
+        for table, index in diff.added_indexes:
+            lines.append(f'op.create_index("{index.name}", "{table.name}", {string_list(index.columns)})')
+        for table, index in diff.dropped_indexes:
+            lines.append(f'op.drop_index("{index.name}", table_name="{table.name}")')
+        for table, column in diff.dropped_columns:
+            lines.append(f'op.drop_column("{table.name}", "{column.name}")')
+        for table in reversed(_dependency_order(diff.dropped_tables, diff.old_tables)):
+            lines.append(f'op.drop_table("{table.name}")')
+        return lines
+
+    def _downgrade(self, diff):
+        lines = []
+        for table in _dependency_order(diff.dropped_tables, diff.old_tables):
+            self._create_table(table, lines)
+        for table, column in diff.dropped_columns:
+            lines.append(f'op.add_column("{table.name}", {sa_column_text(column, table.inline_foreign_keys().get(column.name, ()), nullable=True)})')
+        for table, index in diff.dropped_indexes:
+            lines.append(f'op.create_index("{index.name}", "{table.name}", {string_list(index.columns)})')
+        for table, index in diff.added_indexes:
+            lines.append(f'op.drop_index("{index.name}", table_name="{table.name}")')
+        for table, start, values in diff.added_lookup_values:
+            lines.append(f'op.execute("DELETE FROM {table.name} WHERE id > {start}")')
+        for table, old, new in diff.altered_columns + diff.altered_enums:
+            lines.append(self._alter_column(table, new, old))
+        for table, column in diff.added_columns:
+            lines.append(f'op.drop_column("{table.name}", "{column.name}")')
+        for table in reversed(_dependency_order(diff.added_tables, diff.new_tables)):
+            lines.append(f'op.drop_table("{table.name}")')
+        return lines
+
+    def _alter_column(self, table, old, new):
+        params = [f'"{table.name}"', f'"{new.name}"']
+        if old.subtype != new.subtype:
+            params.extend([f"type_=sa.{new.subtype}", f"existing_type=sa.{old.subtype}"])
+        if old.nullable != new.nullable:
+            params.append(f"nullable={new.nullable}")
+        params.append(f"existing_nullable={old.nullable}")
+        return f"op.alter_column({', '.join(params)})"
+
+
+def _dependency_order(tables, all_tables):
+    """`tables` with the parents of their foreign keys first."""
+    metadata = sa.MetaData()
+    for table in all_tables:
+        build_table(metadata, table)
+    by_name = {t.name: t for t in tables}
+    return [by_name[t.name] for t in metadata.sorted_tables if t.name in by_name]
@@ -1,7 +1,12 @@
+import sys
 import logging
 
-from gemmi import cif
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+
+from mmcif_db_tool.instrument import count, timer
+
+# gemmi is imported by the code that parses a dictionary, so that runs
+# served from the cache, and the CLI, start without loading it
 
 logger = logging.getLogger(__name__)
 
@@ -23,131 +28,420 @@ class ItemFilter:
             self.filtered_categories.add(cat)
 
 
-@dataclass
-class Item:
-    full_name: str
-    name: str
-    description: str
-    mandatory_code: bool
-    type_code: str
-    default_value: str
-    index: bool = field(default=False)
+class _Slotted:
+    """Base of the slotted models.
+
+    Equality, repr and pickling work on `field_names`, the arguments
+    of `__init__` in order. A description may be given as a callable,
+    called the first time the description is read, so descriptions
+    that are never printed are never parsed.
+    """
+    __slots__ = ()
+    field_names = ()
+
+    @property
+    def description(self):
+        description = self._description
+        if callable(description):
+            description = self._description = description()
+        return description
+
+    @description.setter
+    def description(self, value):
+        self._description = value
+
+    def _values(self):
+        return tuple(getattr(self, f) for f in self.field_names)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __repr__(self):
+        values = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.field_names)
+        return f"{type(self).__name__}({values})"
+
+    def __reduce__(self):
+        # resolves lazy descriptions, which may hold on to gemmi frames
+        return (type(self), self._values())
+
+
+class _LazyDescription:
+    """Description read from its frame when first asked for. Keeps the
+    frame index, and so the parsed document, alive until then."""
+
+    __slots__ = ("index", "frame", "tag", "convert")
+
+    def __init__(self, index, frame, tag, convert):
+        self.index = index
+        self.frame = frame
+        self.tag = tag
+        self.convert = convert
+
+    def __call__(self):
+        return self.convert(self.index.find_value(self.frame, self.tag))
+
+
+class Item(_Slotted):
+    __slots__ = ("full_name", "name", "_description", "mandatory_code", "type_code", "default_value", "index", "enumerations")
+    field_names = ("full_name", "name", "description", "mandatory_code", "type_code", "default_value", "index", "enumerations")
+
+    def __init__(self, full_name: str, name: str, description: str, mandatory_code: bool, type_code: str, default_value: str, index: bool = False, enumerations: list[str] = None):
+        self.full_name = full_name
+        self.name = name
+        self._description = description
+        self.mandatory_code = mandatory_code
+        self.type_code = type_code
+        self.default_value = default_value
+        self.index = index
+        self.enumerations = enumerations if enumerations is not None else []
 
     def __hash__(self) -> int:
         return hash(self.full_name)
 
+    def copy(self):
+        """A copy of the item that keeps its description lazy."""
+        return Item(self.full_name, self.name, self._description, self.mandatory_code, self.type_code, self.default_value, self.index, list(self.enumerations))
+
 
 @dataclass
-class Category:
-    id: str
-    description: str
-    key_names: list[str]
-    items: list[Item] = field(default_factory=list)
+class Link:
+    """Link from items of a child category to items of its parent.
+
+    `child_items` and `parent_items` are item names in matching order;
+    link groups spanning several items give composite links.
+    """
+    parent_category: str
+    child_items: list[str]
+    parent_items: list[str]
+
+
+class Category(_Slotted):
+    __slots__ = ("id", "_description", "key_names", "items", "links")
+    field_names = ("id", "description", "key_names", "items", "links")
+
+    def __init__(self, id: str, description: str, key_names: list[str], items: list[Item] = None, links: list[Link] = None):
+        self.id = id
+        self._description = description
+        self.key_names = key_names
+        self.items = items if items is not None else []
+        self.links = links if links is not None else []
 
     def add_item(self, item: Item, filter: ItemFilter = None):
         if self.id in filter.filtered_categories:
-            cat_item = f"{self.id}.{item.name}"
-            if filter.include_items and cat_item not in filter.include_items:
-                print(f"Skipping item {cat_item}")
-                return
-
-            if filter.exclude_items and cat_item in filter.exclude_items:
-                print(f"Skipping item {cat_item}")
+            with timer("filtering", items=1):
+                filtered = self._is_filtered(item, filter)
+            if filtered:
+                logger.debug(f"Skipping item {self.id}.{item.name}")
+                count("items_skipped")
                 return
 
         if item.name in self.key_names:
             item.index = True
         self.items.append(item)
 
-
-class DictReader:
-    def __init__(self, path: str) -> None:
-        self._doc = cif.read_file(path)
-
-    def get_categories(self, categories: list[str], filter: ItemFilter = None) -> list[Category]:
-        cat_objs = {}
-        search_set = set(categories)
-        filter = filter or ItemFilter()
-        block = self._doc.sole_block()
-        grouped_items = self._find_grouped_items(block, search_set)
-
-        for i in block:
-            # first iteration is to create the category objects
-            if i.frame is None:
+    def _is_filtered(self, item, filter):
+        cat_item = f"{self.id}.{item.name}"
+        if filter.include_items and cat_item not in filter.include_items:
+            return True
+
+        if filter.exclude_items and cat_item in filter.exclude_items:
+            return True
+        return False
+
+
+class CategoryGraph:
+    """Dependency graph of categories, from the links of each child
+    category to its parents.
+
+    `waves` orders the categories for loading: each wave only holds
+    children of categories in earlier waves, so the categories of a
+    wave can be loaded concurrently once the earlier waves are done.
+    Categories linked in a cycle, or a category linked to itself,
+    cannot be ordered: they form one group, loaded in one transaction
+    with the links inside the group, listed in `deferred`, checked at
+    commit only.
+    """
+
+    def __init__(self, parents: dict[str, list[str]]):
+        self._position = {name: i for i, name in enumerate(parents)}
+        # parents outside the graph do not order anything
+        self.parents = {name: sorted(set(p) & self._position.keys(), key=self._position.get) for name, p in parents.items()}
+        groups = self._groups()
+        self.deferred = {
+            (child, parent)
+            for group in groups if len(group) > 1 or group[0] in self.parents[group[0]]
+            for child in group for parent in self.parents[child] if parent in group
+        }
+        self.waves = self._waves(groups)
+
+    @classmethod
+    def from_categories(cls, categories: list[Category]) -> "CategoryGraph":
+        return cls({c.id: [l.parent_category for l in c.links] for c in categories})
+
+    def order(self) -> list[str]:
+        """The categories, wave after wave."""
+        return [name for wave in self.waves for group in wave for name in group]
+
+    def _groups(self):
+        """The strongly connected components, parents before children
+        (Tarjan's algorithm, without recursion)."""
+        index, low, stack, on_stack, groups = {}, {}, [], set(), []
+        for root in self.parents:
+            if root in index:
                 continue
-
-            frame = i.frame
-            if frame.name in search_set:
-                logger.debug(f"Found category {frame.name}")
-                cat_objs[frame.name] = self._parse_category(frame)
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.parents[root]))]
+            while work:
+                node, parents = work[-1]
+                for parent in parents:
+                    if parent not in index:
+                        index[parent] = low[parent] = len(index)
+                        stack.append(parent)
+                        on_stack.add(parent)
+                        work.append((parent, iter(self.parents[parent])))
+                        break
+                    if parent in on_stack:
+                        low[node] = min(low[node], index[parent])
+                else:
+                    work.pop()
+                    if work:
+                        low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                    if low[node] == index[node]:
+                        group = set()
+                        while node not in group:
+                            group.add(stack.pop())
+                        on_stack -= group
+                        groups.append(sorted(group, key=self._position.get))
+        return groups
+
+    def _waves(self, groups):
+        # each group goes one wave after its last parent
+        group_of = {name: i for i, group in enumerate(groups) for name in group}
+        levels = []
+        for i, group in enumerate(groups):
+            parents = {group_of[p] for name in group for p in self.parents[name]} - {i}
+            levels.append(1 + max((levels[p] for p in parents), default=-1))
+
+        waves = [[] for _ in range(max(levels, default=-1) + 1)]
+        for group, level in sorted(zip(groups, levels), key=lambda g: self._position[g[0][0]]):
+            waves[level].append(group)
+        return waves
+
+
+class FrameIndex:
+    """Index of the save frames in a dictionary block, built in one pass.
+
+    Category frames are keyed by category id, item frames are grouped
+    by the category they belong to (in block order) and the rows of
+    ``_item.name`` loops are keyed by the full item name. The
+    ``_item_linked`` pairs, usually defined in the frame of the parent
+    item, are collected by child category. Attribute
+    lookups on frames are memoized, since the same frame is queried
+    once for every row of its grouped loop.
+    """
+
+    def __init__(self, block):
+        self.category_frames = {}
+        self.item_frames = {}
+        self.grouped_items = {}
+        self.item_links = {}
+        self._values = {}
+
+        from gemmi import cif
 
         for i in block:
             if i.frame is None:
                 continue
 
             frame = i.frame
-            cat_name = self._cat_from_frame(frame.name)
-            if cat_name not in search_set:
+            cat_name = self.cat_from_frame(frame.name)
+            if frame.name == cat_name:
+                self.category_frames[cat_name] = frame
                 continue
 
-            if frame.name in grouped_items:
-                logger.debug(f"Found grouped item {frame.name}")
-                cat_objs[cat_name].add_item(grouped_items[frame.name], filter)
-                continue
+            self.item_frames.setdefault(cat_name, []).append(frame)
 
-            if frame.find_value("_item.name"):
-                logger.debug(f"Found item {frame.name}")
-                item = self._parse_item(frame)
-                cat_objs[cat_name].add_item(item, filter)
-                continue
+            # items defined in loops for categories that have a group
+            if frame.find_loop("_item.name"):
+                table = frame.find(["_item.name", "_item.category_id", "_item.mandatory_code"])
+                for row in table:
+                    self.grouped_items[cif.as_string(row[0])] = (row[0], row[1], row[2], frame)
 
-        return list(cat_objs.values())
+            for row in frame.find("_item_linked.", ["child_name", "parent_name"]):
+                child_name, parent_name = cif.as_string(row[0]), cif.as_string(row[1])
+                child_links = self.item_links.setdefault(self.cat_from_frame(child_name), [])
+                if (child_name, parent_name) not in child_links:
+                    child_links.append((child_name, parent_name))
 
-    def _cat_from_frame(self, frame_name):
+    @staticmethod
+    def cat_from_frame(frame_name):
         if frame_name is not None:
             return frame_name.lstrip("_").split('.')[0]
 
-    def _find_grouped_items(self, block, search_set):
-        # this is to find items defined in loops for
-        # categories that have a group
-        items = {}
-        for i in block:
-            if i.frame is None:
-                continue
+    def find_value(self, frame, tag):
+        key = (frame.name, tag)
+        if key not in self._values:
+            self._values[key] = frame.find_value(tag)
+        return self._values[key]
 
-            frame = i.frame
-            if not frame.find_loop("_item.name"):
+    def find_strings(self, frame, prefix, tag):
+        """All values of `tag`, looped or not, as strings."""
+        key = (frame.name, prefix + tag)
+        if key not in self._values:
+            from gemmi import cif
+            self._values[key] = [cif.as_string(row[0]) for row in frame.find(prefix, [tag])]
+        return self._values[key]
+
+
+class DictReader:
+    def __init__(self, path: str, cache=None) -> None:
+        """Read the dictionary at `path`.
+
+        If a `DictCache` is given, the extracted categories are loaded
+        from it when the dictionary was seen before, skipping gemmi
+        entirely. Otherwise the dictionary is parsed and all of its
+        categories are stored in the cache for the next run.
+        """
+        self._doc = None
+        self._index = None
+        self._cached = None
+
+        if cache is not None:
+            with timer("cache_load"):
+                key = cache.key(path)
+                self._cached = cache.load(key)
+            if self._cached is None:
+                self._read_file(path)
+                self._cached = self._get_indexed_categories(self.get_category_names(), ItemFilter())
+                with timer("cache_store"):
+                    cache.store(key, self._cached)
+        else:
+            self._read_file(path)
+
+    def _read_file(self, path):
+        from gemmi import cif
+
+        with timer("dictionary_read", items=1):
+            self._doc = cif.read_file(path)
+
+    def get_category_names(self) -> list[str]:
+        """Ids of all the categories of the dictionary, in block order."""
+        if self._cached is not None:
+            return [c.id for c in self._cached]
+        return list(self._get_index().category_frames)
+
+    def get_categories(self, categories: list[str], filter: ItemFilter = None) -> list[Category]:
+        filter = filter or ItemFilter()
+        with timer("get_categories") as t:
+            if self._cached is not None:
+                cat_objs = self._get_cached_categories(categories, filter)
+            else:
+                cat_objs = self._get_indexed_categories(categories, filter)
+            t.items = len(cat_objs)
+        return cat_objs
+
+    def get_category_graph(self, categories: list[str]) -> CategoryGraph:
+        """The `CategoryGraph` of the links between `categories`."""
+        return CategoryGraph.from_categories(self.get_categories(categories))
+
+    def _get_cached_categories(self, categories, filter):
+        cat_objs = []
+        search_set = set(categories)
+        for cached in self._cached:
+            if cached.id not in search_set:
                 continue
 
-            table = frame.find(["_item.name", "_item.category_id", "_item.mandatory_code"])
-            for row in table:
-                if row[1] in search_set:
-                    full_name = cif.as_string(row[0])
-                    name = self._strip_value(row[0]).split('.')[1]
-                    description = cif.as_string(frame.find_value('_item_description.description'))
-                    mandatory_code = row[2] == 'yes'
-                    type_code = self._strip_value(frame.find_value('_item_type.code'))
-                    default_value = self._strip_value(frame.find_value('_item_default.value'))
+            category = Category(cached.id, cached._description, list(cached.key_names), links=list(cached.links))
+            for item in cached.items:
+                category.add_item(item.copy(), filter)
+            cat_objs.append(category)
+
+        return cat_objs
+
+    def _get_indexed_categories(self, categories, filter):
+        cat_objs = []
+        search_set = set(categories)
+        index = self._get_index()
+
+        for cat_name, cat_frame in index.category_frames.items():
+            if cat_name not in search_set:
+                continue
 
-                    items[full_name] = Item(full_name, name, description, mandatory_code, type_code, default_value)
-        return items
+            logger.debug(f"Found category {cat_name}")
+            category = self._parse_category(cat_frame)
+            cat_objs.append(category)
+
+            with timer("item_parsing") as t:
+                for frame in index.item_frames.get(cat_name, []):
+                    grouped = index.grouped_items.get(frame.name)
+                    if grouped is not None and grouped[1] in search_set:
+                        logger.debug(f"Found grouped item {frame.name}")
+                        category.add_item(self._parse_grouped_item(*grouped), filter)
+                        continue
+
+                    if index.find_value(frame, "_item.name"):
+                        logger.debug(f"Found item {frame.name}")
+                        category.add_item(self._parse_item(frame), filter)
+                        continue
+                t.items = len(category.items)
+
+        return cat_objs
+
+    def _get_index(self):
+        if self._index is None:
+            with timer("frame_scan") as t:
+                self._index = FrameIndex(self._doc.sole_block())
+                t.items = len(self._index.category_frames) + sum(map(len, self._index.item_frames.values()))
+        return self._index
+
+    def _parse_grouped_item(self, item_name, category_id, mandatory, frame):
+        from gemmi import cif
+
+        index = self._get_index()
+        full_name = cif.as_string(item_name)
+        name = self._strip_value(item_name).split('.')[1]
+        description = self._lazy_description(frame, '_item_description.description', cif.as_string)
+        mandatory_code = mandatory == 'yes'
+        type_code = self._strip_value(index.find_value(frame, '_item_type.code'))
+        default_value = self._strip_value(index.find_value(frame, '_item_default.value'))
+        enumerations = list(index.find_strings(frame, '_item_enumeration.', 'value'))
+
+        return self._new_item(full_name, name, description, mandatory_code, type_code, default_value, enumerations)
 
     def _parse_item(self, frame):
+        index = self._get_index()
         full_name = frame.name
-        name = self._strip_value(frame.find_value('_item.name')).split('.')[1]
-        description = self._strip_value(frame.find_value('_item_description.description'))
-        mandatory_code = frame.find_value('_item.mandatory_code') == 'yes'
-        type_code = self._strip_value(frame.find_value('_item_type.code'))
-        default_value = self._strip_value(frame.find_value('_item_default.value'))
-
-        return Item(full_name, name, description, mandatory_code, type_code, default_value)
+        name = self._strip_value(index.find_value(frame, '_item.name')).split('.')[1]
+        description = self._lazy_description(frame, '_item_description.description', self._strip_value)
+        mandatory_code = index.find_value(frame, '_item.mandatory_code') == 'yes'
+        type_code = self._strip_value(index.find_value(frame, '_item_type.code'))
+        default_value = self._strip_value(index.find_value(frame, '_item_default.value'))
+        enumerations = list(index.find_strings(frame, '_item_enumeration.', 'value'))
+
+        return self._new_item(full_name, name, description, mandatory_code, type_code, default_value, enumerations)
+
+    def _new_item(self, full_name, name, description, mandatory_code, type_code, default_value, enumerations):
+        # names and type codes repeat across items and dictionary
+        # reads; the cache pickles interned strings once, so they stay
+        # shared once loaded from it
+        intern = sys.intern
+        return Item(
+            intern(full_name), intern(name), description, mandatory_code,
+            type_code and intern(type_code), default_value and intern(default_value),
+            enumerations=[intern(v) for v in enumerations],
+        )
 
     def _parse_category(self, frame):
+        index = self._get_index()
         id = frame.name
-        description = self._strip_value(frame.find_value('_category.description'))
+        description = self._lazy_description(frame, '_category.description', self._strip_value)
         key_names = []
-        if frame.find_value('_category_key.name'):
-            kn = frame.find_value('_category_key.name')
+        if index.find_value(frame, '_category_key.name'):
+            kn = index.find_value(frame, '_category_key.name')
             key_names.append(self._strip_value(kn).split('.')[1])
         else:
             # try to find in a loop
@@ -156,9 +450,42 @@ class DictReader:
                 for row in table:
                     key_names.append(self._strip_value(row).split('.')[1])
 
-        return Category(id, description, key_names)
+        return Category(sys.intern(id), description, [sys.intern(k) for k in key_names], links=self._parse_links(frame))
+
+    def _lazy_description(self, frame, tag, convert):
+        return _LazyDescription(self._get_index(), frame, tag, convert)
+
+    def _parse_links(self, frame):
+        # link groups of the category come first, then the _item_linked
+        # pairs that are not part of any group
+        from gemmi import cif
+
+        index = self._get_index()
+        groups = {}
+        table = frame.find("_pdbx_item_linked_group_list.", ["link_group_id", "child_name", "parent_name"])
+        for row in table:
+            child_name, parent_name = cif.as_string(row[1]), cif.as_string(row[2])
+            if index.cat_from_frame(child_name) != frame.name:
+                continue
+
+            key = (row[0], index.cat_from_frame(parent_name))
+            groups.setdefault(key, []).append((child_name, parent_name))
+
+        grouped = {pair for pairs in groups.values() for pair in pairs}
+        for pair in index.item_links.get(frame.name, []):
+            if pair not in grouped:
+                groups[pair] = [pair]
+
+        links = []
+        for pairs in groups.values():
+            parent_category = index.cat_from_frame(pairs[0][1])
+            child_items = [child.split('.')[1] for child, _ in pairs]
+            parent_items = [parent.split('.')[1] for _, parent in pairs]
+            links.append(Link(parent_category, child_items, parent_items))
+        return links
 
-    def _strip_value(self, value):
+    @staticmethod
+    def _strip_value(value):
         if value is None:
             return None
 
@@ -0,0 +1,244 @@
+"""Parquet datasets of mmCIF categories, with Arrow schemas built from
+the tables of a `SchemaMap`.
+
+Entries are converted column by column with `columnar`, buffered per
+table and written in row groups of `row_group_size` rows, so memory
+is bounded by one row group per table plus the entry being read.
+"""
+import os
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from mmcif_db_tool import loader
+from mmcif_db_tool.columnar import category_arrays
+from mmcif_db_tool.instrument import count, timer
+from mmcif_db_tool.loader import block_entry_id, bounded_map
+from mmcif_db_tool.metadata import dump_tables
+from mmcif_db_tool.reader import read_block
+
+logger = logging.getLogger(__name__)
+
+ARROW_TYPES = {
+    "SmallInteger": pa.int16(),
+    "Integer": pa.int32(),
+    "BigInteger": pa.int64(),
+    "Float": pa.float64(),
+    "Text": pa.string(),
+    "DateTime": pa.timestamp("s"),
+    "Date": pa.date32(),
+    "Boolean": pa.bool_(),
+}
+
+# item types of short, repeated identifiers, dictionary encoded in
+# Parquet as the enumerated items are
+CODE_TYPE_CODES = {"code", "ucode", "uchar1", "uchar5", "atcode", "asym_id"}
+
+PARTITIONS = ["chunk", "entry"]
+
+
+def arrow_type(column):
+    if column.enum_name:
+        return pa.dictionary(pa.int16(), pa.string())
+    if column.subtype.startswith("String("):
+        return pa.string()
+    return ARROW_TYPES[column.subtype]
+
+
+def arrow_schema(table):
+    """The Arrow schema of `table`. Columns of mandatory items are not
+    nullable."""
+    return pa.schema([pa.field(c.name, arrow_type(c), nullable=c.nullable) for c in table.columns])
+
+
+def dictionary_columns(table):
+    """Columns of enumerated and code-typed items."""
+    return [c.name for c in table.columns if c.enum_values or c.type_code in CODE_TYPE_CODES]
+
+
+def record_batch(schema, arrays):
+    return pa.record_batch(
+        [pa.array(arrays[f.name].values, type=f.type, mask=arrays[f.name].mask) for f in schema],
+        schema=schema,
+    )
+
+
+def entry_batches(path, tables, schemas):
+    """Read the entry file at `path` and return its id and its rows as
+    a record batch per table name.
+
+    Nulls in a column of a mandatory item raise a ValueError, failing
+    the entry, rather than the row group it would be written in.
+    """
+    with timer("entry_reading", items=1):
+        block = read_block(path)
+    with timer("row_conversion") as t:
+        batches = {}
+        for table in tables:
+            arrays = category_arrays(block, table)
+            if not arrays:
+                continue
+            for field in schemas[table.name]:
+                if not field.nullable and arrays[field.name].mask.any():
+                    raise ValueError(f"Null value for the mandatory _{table.name}.{field.name}")
+            batches[table.name] = record_batch(schemas[table.name], arrays)
+        t.items = sum(b.num_rows for b in batches.values())
+    return block_entry_id(block), batches
+
+
+def _parse_entry(path):
+    tables = loader._worker_tables
+    try:
+        schemas = {t.name: arrow_schema(t) for t in tables}
+        return path, entry_batches(path, tables, schemas), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+class _TableFile:
+    """A Parquet file of one table, written a row group at a time.
+
+    Only whole row groups are written as rows come in; the rows left
+    over wait for the next batches, and the last, shorter row group is
+    written on `close`.
+    """
+
+    def __init__(self, path, schema, dictionary_columns, row_group_size, compression):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._writer = pq.ParquetWriter(path, schema, use_dictionary=dictionary_columns or False, compression=compression)
+        self._schema = schema
+        self._row_group_size = row_group_size
+        self._batches = []
+        self._rows = 0
+
+    def write(self, batch):
+        self._batches.append(batch)
+        self._rows += batch.num_rows
+        if self._rows >= self._row_group_size:
+            self._write_row_groups(self._rows - self._rows % self._row_group_size)
+
+    def _write_row_groups(self, n):
+        """Write the first `n` buffered rows and keep the others."""
+        rows = pa.Table.from_batches(self._batches, schema=self._schema)
+        with timer("writing", items=n):
+            self._writer.write_table(rows.slice(0, n), row_group_size=self._row_group_size)
+            count("row_groups", -(-n // self._row_group_size))
+        self._batches = rows.slice(n).to_batches()
+        self._rows -= n
+
+    def close(self):
+        if self._rows:
+            self._write_row_groups(self._rows)
+        self._writer.close()
+
+
+class ParquetExporter:
+    """Write mmCIF entries to a Parquet dataset per table built by a
+    `SchemaMap`, in `output_dir/<table>/`.
+
+    With `partition_by="chunk"`, each file holds `entries_per_file`
+    entries (`part-00000.parquet`, ...). With `partition_by="entry"`,
+    each entry gets its own hive-style directory named after the entry
+    column (`entry_id=1ABC/part-00000.parquet`), and the entry column is
+    left out of the files. Enumerated and code-typed columns are
+    dictionary encoded.
+    """
+
+    def __init__(self, output_dir, tables, partition_by="chunk", entries_per_file=1000, row_group_size=64 * 1024, compression="zstd"):
+        if partition_by not in PARTITIONS:
+            raise ValueError(f"partition_by must be one of {', '.join(PARTITIONS)}, got '{partition_by}'")
+
+        self._output_dir = output_dir
+        self._partition_by = partition_by
+        self._entries_per_file = entries_per_file
+        self._row_group_size = row_group_size
+        self._compression = compression
+        # lookup tables are not part of the entries
+        self._tables = [t for t in tables if not t.lookup_values]
+        self._by_name = {t.name: t for t in self._tables}
+        self._schemas = {t.name: arrow_schema(t) for t in self._tables}
+        self._dictionary_columns = {t.name: dictionary_columns(t) for t in self._tables}
+        self._open = {}
+        self._entries_in_file = 0
+        self._part = 0
+        self.files = {t.name: [] for t in self._tables}
+        self.row_counts = {t.name: 0 for t in self._tables}
+        self.failed = {}
+
+    def export_files(self, paths):
+        for path in paths:
+            logger.debug(f"Exporting {path}")
+            try:
+                entry_id, batches = entry_batches(path, self._tables, self._schemas)
+            except Exception as e:
+                self._add_failure(path, f"{type(e).__name__}: {e}")
+                continue
+            self.add_batches(entry_id, batches)
+        self.close()
+
+    def export_files_parallel(self, paths, workers, max_pending=None):
+        """Parse and convert entries in a pool of `workers` processes,
+        with at most `max_pending` entries in flight, and write them
+        from this process."""
+        max_pending = max_pending or 2 * workers
+        with ProcessPoolExecutor(max_workers=workers, initializer=loader._init_worker, initargs=(dump_tables(self._tables),)) as executor:
+            for path, result, error in bounded_map(executor, _parse_entry, paths, max_pending):
+                if error is not None:
+                    self._add_failure(path, error)
+                    continue
+
+                logger.debug(f"Exporting {path}")
+                self.add_batches(*result)
+        self.close()
+
+    def add_batches(self, entry_id, batches):
+        """Write the record batches of one entry, by table name."""
+        if self._partition_by == "entry":
+            self._write_entry(entry_id, batches)
+            self._part += 1
+            return
+
+        if self._entries_in_file == self._entries_per_file:
+            self.close()
+            self._part += 1
+            self._entries_in_file = 0
+
+        for name, batch in batches.items():
+            self._file(name).write(batch)
+            self.row_counts[name] += batch.num_rows
+        self._entries_in_file += 1
+
+    def _write_entry(self, entry_id, batches):
+        for name, batch in batches.items():
+            table = self._by_name[name]
+            key = table.entry_column or "entry_id"
+            if table.entry_column:
+                batch = batch.drop_columns([table.entry_column])
+
+            filename = os.path.join(name, f"{key}={entry_id.replace(os.sep, '_')}", f"part-{self._part:05d}.parquet")
+            f = _TableFile(os.path.join(self._output_dir, filename), batch.schema, [c for c in self._dictionary_columns[name] if c in batch.schema.names], self._row_group_size, self._compression)
+            f.write(batch)
+            f.close()
+            self.files[name].append(filename)
+            self.row_counts[name] += batch.num_rows
+
+    def _file(self, name):
+        f = self._open.get(name)
+        if f is None:
+            filename = os.path.join(name, f"part-{self._part:05d}.parquet")
+            f = self._open[name] = _TableFile(os.path.join(self._output_dir, filename), self._schemas[name], self._dictionary_columns[name], self._row_group_size, self._compression)
+            self.files[name].append(filename)
+        return f
+
+    def _add_failure(self, path, error):
+        logger.warning(f"Skipping {path}: {error}")
+        count("failed_entries")
+        self.failed[path] = error
+
+    def close(self):
+        for f in self._open.values():
+            f.close()
+        self._open = {}
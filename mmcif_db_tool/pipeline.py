@@ -0,0 +1,262 @@
+"""Loading entries into SQLite through a staged asyncio pipeline.
+
+Entry files go through three stages joined by bounded queues, each
+with its own number of concurrent workers:
+
+- reading the files, in threads;
+- parsing and converting them into the parameters of the INSERT
+  statements, in a pool of processes;
+- writing the rows with aiosqlite, each entry under a savepoint and
+  several entries per commit.
+
+Files are thus read and parsed while earlier entries are written, and
+a stage that falls behind fills the queue in front of it, which stops
+the stages before it instead of letting them buffer without bound.
+The tables are those of a `SchemaMap`, so any set of categories can
+be loaded. Needs aiosqlite (`pip install mmcif_db_tool[pipeline]`).
+"""
+import os
+import asyncio
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+
+import aiosqlite
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+from mmcif_db_tool import loader
+from mmcif_db_tool.instrument import count, timer
+from mmcif_db_tool.metadata import build_metadata, dump_tables
+from mmcif_db_tool.reader import parse_block
+
+logger = logging.getLogger(__name__)
+
+# ends the input of a stage worker
+STOP = None
+
+
+class InsertStatement:
+    """The INSERT statement of a table for SQLite, with the conversion
+    of its rows into positional parameters, done as SQLAlchemy does."""
+    __slots__ = ("sql", "names", "processors")
+
+    def __init__(self, sa_table, dialect):
+        self.sql = str(sa_table.insert().compile(dialect=dialect))
+        self.names = [c.name for c in sa_table.columns]
+        self.processors = [c.type.dialect_impl(dialect).bind_processor(dialect) for c in sa_table.columns]
+
+    def params(self, rows):
+        pairs = list(zip(self.names, self.processors))
+        return [tuple(row[n] if p is None or row[n] is None else p(row[n]) for n, p in pairs) for row in rows]
+
+
+def insert_statements(tables):
+    """The `InsertStatement` of each of `tables`, by table name."""
+    metadata = build_metadata(tables)
+    dialect = sqlite.dialect()
+    return {t.name: InsertStatement(metadata.tables[t.name], dialect) for t in tables}
+
+
+def read_file(path):
+    with timer("entry_reading", items=1):
+        with open(path, "rb") as f:
+            return f.read()
+
+
+_worker_statements = None
+
+
+def _parse_data(path, data):
+    """Parse the content of an entry file into the parameters of the
+    inserts of its rows, by table name, in a worker process set up by
+    `loader._init_worker`."""
+    global _worker_statements
+    if _worker_statements is None:
+        _worker_statements = insert_statements(loader._worker_tables)
+    try:
+        with timer("entry_parsing", items=1):
+            block = parse_block(data)
+        rows = loader.block_rows(block, loader._worker_tables)
+        return {name: _worker_statements[name].params(r) for name, r in rows.items() if r}, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+class PipelineLoader:
+    """Insert mmCIF entries into the tables built by a `SchemaMap`, in
+    the SQLite database file at `path`.
+
+    `readers` threads read the files, `parsers` processes parse and
+    convert them, and `writers` connections write them. Each entry is
+    written under a savepoint of its own, and a writer commits once it
+    has written `batch_size` rows or has no entry waiting. At most
+    `queue_size` items (twice the number of parsers by default) wait
+    between two stages. SQLite lets one connection write at a time, so
+    more writers only help when the writes wait on something else than
+    the database; `timeout` is how long, in seconds, they wait for one
+    another.
+
+    Entries that cannot be read, converted or written are skipped and
+    recorded in `failed`, and `progress`, if given, is called after
+    each file with its path and "loaded" or "failed", as for
+    `EntryLoader`.
+    """
+
+    def __init__(self, path, tables, readers=4, parsers=None, writers=1, queue_size=None, batch_size=1000, timeout=60, progress=None):
+        self.path = path
+        self._readers = readers
+        self._parsers = parsers or os.cpu_count() or 1
+        self._writers = writers
+        self._queue_size = queue_size or 2 * self._parsers
+        self._batch_size = batch_size
+        self._timeout = timeout
+        self._progress = progress
+        self._metadata = build_metadata(tables)
+        # lookup tables are filled when created, not from the entries
+        self._tables = [t for t in tables if not t.lookup_values]
+        self._statements = insert_statements(self._tables)
+        # parents before their children, for the foreign keys
+        self._order = [t.name for t in self._metadata.sorted_tables if t.name in self._statements]
+        self.row_counts = {t.name: 0 for t in self._tables}
+        self.failed = {}
+
+    def create_tables(self):
+        engine = sa.create_engine(f"sqlite:///{self.path}")
+        self._metadata.create_all(engine)
+        engine.dispose()
+
+    def load_files(self, paths):
+        asyncio.run(self.load_files_async(paths))
+
+    async def load_files_async(self, paths):
+        paths_queue = asyncio.Queue(self._queue_size)
+        data_queue = asyncio.Queue(self._queue_size)
+        rows_queue = asyncio.Queue(self._queue_size)
+        with ProcessPoolExecutor(max_workers=self._parsers, initializer=loader._init_worker, initargs=(dump_tables(self._tables),)) as executor:
+            await _run_all([
+                self._feed(paths, paths_queue),
+                _stage(self._read, paths_queue, data_queue, self._readers, self._parsers),
+                _stage(lambda item: self._parse(executor, item), data_queue, rows_queue, self._parsers, self._writers),
+                *[self._write_stage(rows_queue) for _ in range(self._writers)],
+            ])
+
+    async def _feed(self, paths, queue):
+        for path in paths:
+            await queue.put(path)
+        for _ in range(self._readers):
+            await queue.put(STOP)
+
+    async def _read(self, path):
+        logger.debug(f"Reading {path}")
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, read_file, path)
+        except OSError as e:
+            self._add_failure(path, f"{type(e).__name__}: {e}")
+            return None
+        return path, data
+
+    async def _parse(self, executor, item):
+        path, data = item
+        params, error = await asyncio.get_running_loop().run_in_executor(executor, _parse_data, path, data)
+        if error is not None:
+            self._add_failure(path, error)
+            return None
+        return path, params
+
+    async def _write_stage(self, queue):
+        async with aiosqlite.connect(self.path, timeout=self._timeout) as conn:
+            # entries written since the last commit
+            pending = []
+            while True:
+                item = await queue.get()
+                if item is STOP:
+                    break
+                if await self._write_entry(conn, *item):
+                    pending.append(item)
+                if pending and (queue.empty() or sum(_row_count(p) for _, p in pending) >= self._batch_size):
+                    await self._commit(conn, pending)
+                    pending = []
+            if pending:
+                await self._commit(conn, pending)
+
+    async def _write_entry(self, conn, path, params):
+        """Insert the rows of an entry under a savepoint, rolled back
+        if any of them fails, and return whether they were inserted."""
+        logger.debug(f"Loading {path}")
+        if not conn.in_transaction:
+            await conn.execute("BEGIN")
+        await conn.execute("SAVEPOINT entry")
+        try:
+            with timer("writing", items=_row_count(params)):
+                for name in self._order:
+                    if name in params:
+                        await conn.executemany(self._statements[name].sql, params[name])
+                        count("insert_batches")
+        except aiosqlite.Error as e:
+            await conn.execute("ROLLBACK TO entry")
+            await conn.execute("RELEASE entry")
+            self._add_failure(path, f"{type(e).__name__}: {e}")
+            return False
+        await conn.execute("RELEASE entry")
+        return True
+
+    async def _commit(self, conn, entries):
+        try:
+            await conn.commit()
+        except aiosqlite.Error as e:
+            await conn.rollback()
+            for path, _ in entries:
+                self._add_failure(path, f"{type(e).__name__}: {e}")
+            return
+
+        count("commits")
+        for path, params in entries:
+            for name, table_params in params.items():
+                self.row_counts[name] += len(table_params)
+            self._report(path, "loaded")
+
+    def _add_failure(self, path, error):
+        logger.warning(f"Skipping {path}: {error}")
+        count("failed_entries")
+        self.failed[path] = error
+        self._report(path, "failed")
+
+    def _report(self, path, status):
+        if self._progress is not None:
+            self._progress(path, status)
+
+
+def _row_count(params):
+    return sum(map(len, params.values()))
+
+
+async def _stage(fn, inputs, outputs, workers, consumers):
+    """Run `workers` tasks passing the items of `inputs` through the
+    coroutine function `fn` into `outputs`, dropping None results, and
+    then stop the `consumers` of `outputs`."""
+    async def work():
+        while True:
+            item = await inputs.get()
+            if item is STOP:
+                return
+            result = await fn(item)
+            if result is not None:
+                await outputs.put(result)
+
+    await asyncio.gather(*(work() for _ in range(workers)))
+    for _ in range(consumers):
+        await outputs.put(STOP)
+
+
+async def _run_all(coroutines):
+    """Run `coroutines` together. If one fails, the others are
+    cancelled, so that none waits forever on a queue it shares with
+    the failed one, and its exception is raised."""
+    tasks = [asyncio.ensure_future(c) for c in coroutines]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        task.result()
@@ -0,0 +1,181 @@
+import json
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+
+from gemmi import cif
+
+from mmcif_db_tool.loader import bounded_map, to_float
+from mmcif_db_tool.reader import read_block
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FORMAT = 1
+
+
+class ItemStats:
+    """Values seen for one item across a corpus of entries."""
+
+    def __init__(self, rows=0, nulls=0, max_length=0, kind=None, min=None, max=None):
+        self.rows = rows
+        self.nulls = nulls
+        self.max_length = max_length
+        # "int", "float" or "str": the narrowest kind all values parse as
+        self.kind = kind
+        self.min = min
+        self.max = max
+
+    @property
+    def null_ratio(self):
+        return self.nulls / self.rows if self.rows else 0.0
+
+    def add(self, values):
+        for value in values:
+            self.rows += 1
+            if cif.is_null(value):
+                self.nulls += 1
+                continue
+
+            value = cif.as_string(value)
+            self.max_length = max(self.max_length, len(value))
+            self._add_number(value)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.max_length = max(self.max_length, other.max_length)
+        if other.kind is not None:
+            self._widen(other.kind, other.min, other.max)
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "nulls": self.nulls,
+            "null_ratio": round(self.null_ratio, 6),
+            "max_length": self.max_length,
+            "kind": self.kind,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["rows"], d["nulls"], d["max_length"], d["kind"], d["min"], d["max"])
+
+    def _add_number(self, value):
+        if self.kind in (None, "int"):
+            try:
+                number = int(value)
+                self._widen("int", number, number)
+                return
+            except ValueError:
+                pass
+
+        if self.kind in (None, "int", "float"):
+            try:
+                number = to_float(value)
+                self._widen("float", number, number)
+                return
+            except ValueError:
+                pass
+
+        self._widen("str", None, None)
+
+    def _widen(self, kind, min, max):
+        kinds = [None, "int", "float", "str"]
+        if kinds.index(kind) > kinds.index(self.kind):
+            self.kind = kind
+
+        if self.kind == "str":
+            self.min = self.max = None
+            return
+
+        self.min = min if self.min is None else (self.min if min is None else _min(self.min, min))
+        self.max = max if self.max is None else (self.max if max is None else _max(self.max, max))
+
+
+def _min(a, b):
+    return a if a <= b else b
+
+
+def _max(a, b):
+    return a if a >= b else b
+
+
+class CorpusProfile:
+    """Per-item statistics of a corpus of entry files.
+
+    Items are keyed by their full lower-cased name, e.g.
+    '_atom_site.cartn_x', since mmCIF tags are case-insensitive.
+    """
+
+    def __init__(self, items=None, files=0):
+        self.items = items or {}
+        self.files = files
+
+    def get(self, full_name):
+        return self.items.get(full_name.lower())
+
+    def add_block(self, block):
+        for prefix in block.get_mmcif_category_names():
+            category = block.find_mmcif_category(prefix)
+            for i, tag in enumerate(category.tags):
+                stats = self.items.setdefault(tag.lower(), ItemStats())
+                stats.add(category.column(i))
+        self.files += 1
+
+    def merge(self, other):
+        for name, stats in other.items.items():
+            self.items.setdefault(name, ItemStats()).merge(stats)
+        self.files += other.files
+
+    def save(self, path):
+        data = {
+            "format": PROFILE_FORMAT,
+            "files": self.files,
+            "items": {name: stats.to_dict() for name, stats in sorted(self.items.items())},
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+
+        if data.get("format") != PROFILE_FORMAT:
+            raise ValueError(f"Unsupported profile format in {path}: {data.get('format')}")
+        items = {name: ItemStats.from_dict(d) for name, d in data["items"].items()}
+        return cls(items, data["files"])
+
+
+def profile_entry(path):
+    try:
+        profile = CorpusProfile()
+        profile.add_block(read_block(path))
+        return path, profile, None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def profile_files(paths, workers=1, max_pending=None):
+    """Profile the entry files in `paths` with a pool of `workers`
+    processes. Returns the merged profile and the failed files."""
+    profile = CorpusProfile()
+    failed = {}
+
+    def collect(results):
+        for path, entry_profile, error in results:
+            if error is not None:
+                logger.warning(f"Skipping {path}: {error}")
+                failed[path] = error
+                continue
+            profile.merge(entry_profile)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            collect(bounded_map(executor, profile_entry, paths, max_pending or 2 * workers))
+    else:
+        collect(profile_entry(path) for path in paths)
+
+    return profile, failed
@@ -0,0 +1,57 @@
+"""Reading entry files, plain, gzip-compressed or BinaryCIF.
+
+The format is told from the first bytes of the file, not from its
+name: gzip streams start with a magic number, and BinaryCIF documents
+are MessagePack maps, which no text CIF starts with. BinaryCIF needs
+msgpack and NumPy (`pip install mmcif_db_tool[bcif]`).
+"""
+import gzip
+
+from gemmi import cif
+
+# names of the files found in directories
+ENTRY_SUFFIXES = (".cif", ".cif.gz", ".bcif", ".bcif.gz")
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_binary_cif(head):
+    # fixmap, map 16 or map 32
+    return bool(head) and (0x80 <= head[0] <= 0x8F or head[0] in (0xDE, 0xDF))
+
+
+def detect_format(path):
+    """'cif' or 'bcif', followed by '.gz' if the file is compressed."""
+    with open(path, "rb") as f:
+        head = f.read(2)
+    if head != GZIP_MAGIC:
+        return "bcif" if is_binary_cif(head) else "cif"
+
+    with gzip.open(path, "rb") as f:
+        head = f.read(1)
+    return "bcif.gz" if is_binary_cif(head) else "cif.gz"
+
+
+def parse_block(data):
+    """The sole data block of the entry file content `data`, in bytes,
+    in any of the formats of `read_block`."""
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    if not is_binary_cif(data[:1]):
+        return cif.read_string(data).sole_block()
+
+    from mmcif_db_tool.bcif import read_blocks
+    blocks = read_blocks(data)
+    if len(blocks) != 1:
+        raise RuntimeError(f"single data block expected, got {len(blocks)}")
+    return blocks[0]
+
+
+def read_block(path):
+    """The sole data block of the entry file at `path`: a `cif.Block`,
+    or a `bcif.BinaryBlock` for BinaryCIF."""
+    if detect_format(path) == "cif":
+        return cif.read_file(path).sole_block()
+
+    with open(path, "rb") as f:
+        return parse_block(f.read())
@@ -1,6 +1,11 @@
 import sys
+import json
+import hashlib
 import logging
 
+from mmcif_db_tool.instrument import timer
+from mmcif_db_tool.mmcif_dict import CategoryGraph
+
 logger = logging.getLogger(__name__)
 
 TYPE_MAP = {
@@ -53,7 +58,15 @@ ORM_IMPORTS = [
     "from typing import List", 
     "from typing import Optional", 
     "from sqlalchemy import ForeignKey", 
+    "from sqlalchemy import ForeignKeyConstraint", 
+    "from sqlalchemy import Index", 
+    "from sqlalchemy import BigInteger", 
+    "from sqlalchemy import SmallInteger", 
     "from sqlalchemy import String", 
+    "from sqlalchemy import Text", 
+    "from sqlalchemy import Enum", 
+    "from sqlalchemy import Table", 
+    "from sqlalchemy import event", 
     "from sqlalchemy.orm import DeclarativeBase", 
     "from sqlalchemy.orm import Mapped", 
     "from sqlalchemy.orm import mapped_column", 
@@ -61,9 +74,27 @@ ORM_IMPORTS = [
 ]
 
 CORE_IMPORTS = [
-    "from sqlalchemy import MetaData, Table, Column, Integer, String, Float, DateTime"
+    "from sqlalchemy import MetaData, Table, Column, Integer, String, Float, DateTime",
+    "from sqlalchemy import BigInteger, SmallInteger, Text",
+    "from sqlalchemy import ForeignKey, ForeignKeyConstraint, Index",
+    "from sqlalchemy import Enum, event",
 ]
 
+# types SQLAlchemy infers from the Mapped[] annotation of ORM columns
+ORM_DEFAULT_TYPES = {
+    "int": "Integer",
+    "float": "Float",
+    "datetime.datetime": "DateTime",
+    "datetime.date": "Date",
+    "bool": "Boolean",
+}
+
+# longest varchar emitted from a corpus profile, longer values get Text
+MAX_VARCHAR_LENGTH = 4000
+
+SMALLINT_RANGE = (-2 ** 15, 2 ** 15 - 1)
+INTEGER_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
 ORM_SETUP = ["class Base(DeclarativeBase):", "    pass"]
 
 CORE_SETUP = ["metadata_obj = MetaData()"]
@@ -74,20 +105,118 @@ def snakecase_to_camelcase(snake_str):
     return ''.join(x.title() for x in components)
 
 
+def identifier(name):
+    if len(name) > 63:
+        # keep within the identifier length limit of PostgreSQL
+        digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+        name = f"{name[:54]}_{digest}"
+    return name
+
+
+def index_name(table_name, columns):
+    return identifier(f"ix_{table_name}_{'_'.join(columns)}")
+
+
+def enum_text(values, name):
+    values_str = ", ".join(json.dumps(v) for v in values)
+    return f'Enum({values_str}, name="{name}")'
+
+
+# fills the lookup tables of enumerated items when they are created
+LOOKUP_SETUP = [
+    '@event.listens_for(Table, "after_create")',
+    "def insert_lookup_values(target, connection, **kw):",
+    '    values = target.info.get("lookup_values")',
+    "    if values:",
+    '        connection.execute(target.insert(), [{"id": i, "value": v} for i, v in enumerate(values, 1)])',
+]
+
+
+def string_list(values):
+    return "[" + ", ".join(f'"{v}"' for v in values) + "]"
+
+
 class Table:
+    __slots__ = ("name", "columns", "entry_column", "partition_by", "indexes", "foreign_keys", "references", "lookup_values")
+
+    def __init__(self, name, columns, entry_column=None, partition_by=None):
+        self.name = sys.intern(name)
+        self.columns = columns
+        self.entry_column = entry_column
+        self.partition_by = partition_by
+        self.indexes = []
+        self.foreign_keys = []
+        # links matching the key of the parent table, whether or not
+        # they are enforced as foreign keys
+        self.references = []
+        # for lookup tables, the values of the enumeration in id order
+        self.lookup_values = None
+
+    def inline_foreign_keys(self):
+        """Single-column foreign keys, by column name."""
+        inline = {}
+        for fk in self.foreign_keys:
+            if len(fk.columns) == 1:
+                inline.setdefault(fk.columns[0], []).append(fk)
+        return inline
+
+    def composite_foreign_keys(self):
+        return [fk for fk in self.foreign_keys if len(fk.columns) > 1]
+
+
+class Index:
+    __slots__ = ("name", "columns")
+
     def __init__(self, name, columns):
         self.name = name
         self.columns = columns
 
+    def text(self):
+        columns = ", ".join(f'"{c}"' for c in self.columns)
+        return f'Index("{self.name}", {columns})'
+
+
+class ForeignKey:
+    __slots__ = ("columns", "parent_table", "parent_columns", "deferred")
+
+    def __init__(self, columns, parent_table, parent_columns, deferred=False):
+        self.columns = columns
+        self.parent_table = parent_table
+        self.parent_columns = parent_columns
+        # checked at commit, for links in a cycle (see CategoryGraph)
+        self.deferred = deferred
+
+    @property
+    def targets(self):
+        return [f"{self.parent_table}.{c}" for c in self.parent_columns]
+
+    def options_text(self):
+        return ', deferrable=True, initially="DEFERRED"' if self.deferred else ""
+
+    def text(self):
+        if len(self.columns) == 1:
+            return f'ForeignKey("{self.targets[0]}"{self.options_text()})'
+        return f"ForeignKeyConstraint({string_list(self.columns)}, {string_list(self.targets)}{self.options_text()})"
+
 
 class Column:
-    def __init__(self, name, type, subtype = None, index=False, nullable=True, default=None):
-        self.name = name
-        self.type = type
-        self.subtype = subtype
+    __slots__ = ("name", "type", "subtype", "index", "nullable", "default", "type_code", "enum_values", "enum_name", "lookup")
+
+    def __init__(self, name, type, subtype = None, index=False, nullable=True, default=None, type_code=None):
+        # names and types repeat across tables, keep one copy of each
+        self.name = sys.intern(name)
+        self.type = sys.intern(type)
+        self.subtype = sys.intern(subtype) if subtype is not None else None
         self.index = index
         self.nullable = nullable
         self.default = default
+        # _item_type.code of the item, e.g. "code" or "float"
+        self.type_code = type_code
+        # values of enumerated items, stored as a native enum type
+        # named `enum_name` or as ids into the `lookup` table
+        self.enum_values = None
+        self.enum_name = None
+        self.lookup = None
 
     def __repr__(self):
         return f"Column({self.name}, {self.type}, {self.subtype}, {self.index}, {self.nullable}, {self.default})"
@@ -102,8 +231,8 @@ class SqlAlchemyCorePrinter:
     def add_table(self, table):
         self._tables.append(table)
     
-    def _column_text(self, column):
-        params = []
+    def _column_text(self, column, foreign_keys=()):
+        params = [fk.text() for fk in foreign_keys]
         if column.index:
             params.append("primary_key=True")
         if column.nullable:
@@ -119,8 +248,21 @@ class SqlAlchemyCorePrinter:
 
     def _table_text(self, table):
         columns = []
+        inline_fks = table.inline_foreign_keys()
         for column in table.columns:
-            columns.append(f"    {self._column_text(column)}")
+            columns.append(f"    {self._column_text(column, inline_fks.get(column.name, ()))}")
+
+        for fk in table.composite_foreign_keys():
+            columns.append(f"    {fk.text()}")
+
+        for index in table.indexes:
+            columns.append(f"    {index.text()}")
+
+        if table.partition_by:
+            columns.append(f'    postgresql_partition_by="{table.partition_by}"')
+
+        if table.lookup_values:
+            columns.append(f'    info={{"lookup_values": {string_list(table.lookup_values)}}}')
 
         return f'{table.name} = Table("{table.name}",\n    metadata_obj,\n' + ",\n".join(columns) + "\n)"
 
@@ -134,24 +276,42 @@ class SqlAlchemyCorePrinter:
             self._fp.write(i + "\n")
         self._fp.write("\n\n")
 
+        if any(t.lookup_values for t in self._tables):
+            for i in LOOKUP_SETUP:
+                self._fp.write(i + "\n")
+            self._fp.write("\n\n")
+
         for table in self._tables:
             self._fp.write(self._table_text(table) + "\n")
             self._fp.write("\n\n")
 
+LAZY_STRATEGIES = ["select", "selectin", "joined", "subquery", "immediate", "raise", "raise_on_sql", "noload"]
+
+
 class SqlAlchemyOrmPrinter:
-    def __init__(self, fp = sys.stdout, include_imports=False):
+    def __init__(self, fp = sys.stdout, include_imports=False, lazy=None, default_lazy=None):
+        """Print declarative ORM classes.
+
+        Links that match the key of a printed parent table become
+        `relationship()` pairs. `lazy` maps (from table, to table) to
+        the loading strategy of the attribute going from one to the
+        other, e.g. {("entity", "entity_poly"): "selectin"}; other
+        relationships use `default_lazy`, or SQLAlchemy's default.
+        """
         self._fp = fp
         self._include_imports = include_imports
+        self._lazy = lazy or {}
+        self._default_lazy = default_lazy
         self._tables = []
 
     def add_table(self, table):
         self._tables.append(table)
 
-    def _column_text(self, column):
-        params = []
+    def _column_text(self, column, foreign_keys=()):
+        params = [fk.text() for fk in foreign_keys]
         if column.index:
             params.append("primary_key=True")
-        if column.type == "str":
+        if ORM_DEFAULT_TYPES.get(column.type) != column.subtype:
             params.append(f"type_={column.subtype}")
         if column.default is not None:
             params.append(f'default="{column.default!r}"')
@@ -162,16 +322,48 @@ class SqlAlchemyOrmPrinter:
         else:
             return f'{column.name}: Mapped[{column.type}] = mapped_column({params_str})'
 
-    def _table_text(self, table):
+    def _table_text(self, table, relationships=()):
         class_name = snakecase_to_camelcase(table.name)
         class_template = f"""class {class_name}(Base):
-    __tablename__ = '{table.name}'\n\n"""
+    __tablename__ = '{table.name}'\n"""
+        class_template += self._table_args_text(table)
+        class_template += "\n"
         
+        inline_fks = table.inline_foreign_keys()
         for column in table.columns:
-            class_template += f"    {self._column_text(column)}\n"
+            class_template += f"    {self._column_text(column, inline_fks.get(column.name, ()))}\n"
+
+        if relationships:
+            class_template += "\n"
+            for relationship in relationships:
+                class_template += f"    {relationship}\n"
 
         return class_template
 
+    def _relationships(self):
+        """Relationship attribute texts, by table name."""
+        return {
+            name: [f"{r.name}: Mapped[{r.annotation()}] = relationship({r.params_text()})" for r in rels]
+            for name, rels in table_relationships(self._tables, self._lazy, self._default_lazy).items()
+        }
+
+    def _table_args_text(self, table):
+        args = [fk.text() for fk in table.composite_foreign_keys()]
+        args.extend(index.text() for index in table.indexes)
+        options = []
+        if table.partition_by:
+            options.append(f'"postgresql_partition_by": "{table.partition_by}"')
+        if table.lookup_values:
+            options.append(f'"info": {{"lookup_values": {string_list(table.lookup_values)}}}')
+        if options:
+            args.append(f"{{{', '.join(options)}}}")
+
+        if not args:
+            return ""
+        if len(args) == 1 and options:
+            return f"    __table_args__ = {args[0]}\n"
+        return "    __table_args__ = (\n" + "".join(f"        {a},\n" for a in args) + "    )\n"
+
     def print(self):
         if self._include_imports:
             for i in ORM_IMPORTS:
@@ -182,39 +374,311 @@ class SqlAlchemyOrmPrinter:
             self._fp.write(i + "\n")
         self._fp.write("\n\n")
 
+        if any(t.lookup_values for t in self._tables):
+            for i in LOOKUP_SETUP:
+                self._fp.write(i + "\n")
+            self._fp.write("\n\n")
+
+        relationships = self._relationships()
         for table in self._tables:
-            self._fp.write(self._table_text(table) + "\n\n")
+            self._fp.write(self._table_text(table, relationships[table.name]) + "\n\n")
+
+
+class Relationship:
+    """One side of a relationship() pair between the classes of a child
+    table and of the parent table its link references."""
+    __slots__ = ("name", "target", "back_populates", "join", "lazy", "overlaps", "many", "optional")
+
+    def __init__(self, name, target, back_populates, join, lazy=None, overlaps=(), many=False, optional=False):
+        self.name = name
+        # class name of the other side
+        self.target = target
+        self.back_populates = back_populates
+        # primaryjoin expression, in terms of the class names
+        self.join = join
+        self.lazy = lazy
+        self.overlaps = sorted(overlaps)
+        self.many = many
+        self.optional = optional
+
+    def annotation(self):
+        if self.many:
+            return f'List["{self.target}"]'
+        return f'Optional["{self.target}"]' if self.optional else f'"{self.target}"'
+
+    def params_text(self):
+        params = [f'back_populates="{self.back_populates}"', f'primaryjoin="{self.join}"']
+        if self.lazy:
+            params.append(f'lazy="{self.lazy}"')
+        if self.overlaps:
+            params.append(f'overlaps="{",".join(self.overlaps)}"')
+        return ", ".join(params)
+
+
+def table_relationships(tables, lazy=None, default_lazy=None):
+    """The relationships of the classes of `tables`, by table name.
+
+    Links that match the key of a parent table among `tables` become
+    `Relationship` pairs. `lazy` maps (from table, to table) to the
+    loading strategy of the attribute going from one to the other;
+    other relationships use `default_lazy`.
+    """
+    lazy = lazy or {}
+    by_name = {t.name: t for t in tables}
+    used_names = {t.name: {c.name for c in t.columns} for t in tables}
+    pairs = []
+    for table in tables:
+        for fk in table.references:
+            if fk.parent_table not in by_name or fk.parent_table == table.name:
+                continue
+
+            child_attr = _attr_name(used_names[table.name], fk.parent_table, table, fk)
+            parent_attr = _attr_name(used_names[fk.parent_table], table.name, table, fk)
+            pairs.append((table, fk, child_attr, parent_attr))
+
+    relationships = {name: [] for name in by_name}
+    for table, fk, child_attr, parent_attr in pairs:
+        parent = by_name[fk.parent_table]
+        child_class = snakecase_to_camelcase(table.name)
+        parent_class = snakecase_to_camelcase(parent.name)
+        conditions = [f"{parent_class}.{p} == foreign({child_class}.{c})" for c, p in zip(fk.columns, fk.parent_columns)]
+        join = conditions[0] if len(conditions) == 1 else f"and_({', '.join(conditions)})"
+
+        # relationships writing the same child columns overlap
+        overlaps = set()
+        for o_table, o_fk, o_child_attr, o_parent_attr in pairs:
+            if o_table is table and o_fk is not fk and set(o_fk.columns) & set(fk.columns):
+                overlaps.update([o_child_attr, o_parent_attr])
+
+        nullable = any(c.nullable for c in table.columns if c.name in fk.columns)
+        relationships[table.name].append(Relationship(
+            child_attr, parent_class, parent_attr, join, lazy.get((table.name, parent.name), default_lazy), overlaps, optional=nullable,
+        ))
+
+        # a link on the whole key of the child is one-to-one
+        key = [c.name for c in table.columns if c.index]
+        one_to_one = sorted(key) == sorted(fk.columns)
+        relationships[parent.name].append(Relationship(
+            parent_attr, child_class, child_attr, join, lazy.get((parent.name, table.name), default_lazy), overlaps, many=not one_to_one, optional=one_to_one,
+        ))
+    return relationships
+
+
+def _attr_name(used, name, child, fk):
+    if name in used:
+        columns = [c for c in fk.columns if c != child.entry_column]
+        name = f"{name}_by_{'_'.join(columns)}"
+    used.add(name)
+    return name
 
 
 class SchemaMap:
-    def __init__(self, printer, ignore_relationships=False):
+    def __init__(self, printer=None, ignore_relationships=False, entry_column=None, partition_by=None, foreign_keys=True, profile=None, enums=None):
+        """Map categories to tables.
+
+        Unless `ignore_relationships` is set, the links between
+        categories give indexes on the child columns and, if
+        `foreign_keys` is set, foreign key constraints to parent tables
+        whose primary key they match.
+
+        With a `CorpusProfile`, column types are sized from the values
+        seen in the corpus instead of the widths of TYPE_MAP.
+
+        `enums` sets how items with an enumeration are stored: None
+        keeps them as strings, 'native' uses an Enum type and 'lookup'
+        stores small integer ids into a generated lookup table.
+
+        If `entry_column` is set, a column with that name is added to
+        every table as the leading part of its primary key, so rows of
+        several entries can share a table. `partition_by` ('list' or
+        'hash') adds a PostgreSQL partitioning clause on that column.
+        """
+        if partition_by and not entry_column:
+            raise ValueError("partition_by requires an entry column")
+
         self._printer = printer
         self._ignore_relationships = ignore_relationships
+        self._entry_column = entry_column
+        self._partition_by = partition_by
+        self._foreign_keys = foreign_keys
+        self._profile = profile
+        self._enums = enums
         self._categories = []
 
     def add_categories(self, categories):
         for category in categories:
             self._categories.append(category)
 
-    def print_models(self):
+    def get_tables(self):
+        with timer("schema_mapping") as t:
+            tables = self._get_tables()
+            t.items = len(tables)
+        return tables
+
+    def build_metadata(self, metadata=None):
+        """The tables as live `sqlalchemy.Table` objects in a `MetaData`,
+        see `mmcif_db_tool.metadata`."""
+        from mmcif_db_tool.metadata import build_metadata
+
+        return build_metadata(self.get_tables(), metadata)
+
+    def _get_tables(self):
+        tables = []
+        category_tables = []
         for c in self._categories:
             columns = []
+            lookups = []
             for item in c.items:
-                itype, istype = self._type_map(item.type_code)
+                stats = self._profile.get(item.full_name) if self._profile else None
+                with timer("type_mapping", items=1):
+                    itype, istype = self._type_map(item.type_code, stats)
 
                 if not itype:
                     logger.warning(f"Unknown type for {item.name}: {item.type_code}")
                     continue
 
-                column = Column(item.name, itype, istype, index=item.index, nullable=not item.mandatory_code, default=item.default_value)
+                column = Column(item.name, itype, istype, index=item.index, nullable=not item.mandatory_code, default=item.default_value, type_code=item.type_code)
+                if self._enums and item.enumerations and itype == "str":
+                    lookup = self._add_enumeration(c.id, column, item.enumerations)
+                    if lookup is not None:
+                        lookups.append(lookup)
                 columns.append(column)
 
             table = Table(c.id, columns)
-            self._printer.add_table(table)
-        
-        self._printer.print()
+            for column in columns:
+                if column.lookup:
+                    table.foreign_keys.append(ForeignKey([column.name], column.lookup, ["id"]))
+            if self._entry_column:
+                self._add_entry_column(table)
+
+            # lookup tables go first, as parents of the category table
+            tables.extend(lookups)
+            tables.append(table)
+            category_tables.append((c, table))
+
+        if not self._ignore_relationships:
+            by_name = {t.name: t for t in tables}
+            for c, table in category_tables:
+                self._add_links(table, c.links, by_name)
+            self._defer_cycles(tables)
+        return tables
+
+    def _defer_cycles(self, tables):
+        """Defer the foreign keys linking tables in a cycle, which no
+        order of inserts can satisfy one statement at a time."""
+        graph = CategoryGraph({t.name: [fk.parent_table for fk in t.foreign_keys] for t in tables})
+        for table in tables:
+            for fk in table.foreign_keys:
+                fk.deferred = (table.name, fk.parent_table) in graph.deferred
+
+    def _add_enumeration(self, table_name, column, values):
+        """Store `column` as a native enum or as an id into a lookup
+        table, which is returned."""
+        column.enum_values = values
+        if self._enums == "native":
+            column.enum_name = identifier(f"{table_name}_{column.name}_enum")
+            column.subtype = enum_text(values, column.enum_name)
+            return None
+
+        ids = {v.lower(): str(i) for i, v in enumerate(values, 1)}
+        column.type, column.subtype = "int", "SmallInteger"
+        column.lookup = identifier(f"{table_name}_{column.name}_lookup")
+        if column.default is not None:
+            column.default = ids.get(column.default.lower())
+
+        lookup = Table(column.lookup, [
+            Column("id", "int", "SmallInteger", index=True, nullable=False),
+            Column("value", "str", f"String({max(len(v) for v in values)})", nullable=False),
+        ])
+        lookup.lookup_values = values
+        return lookup
+
+    def _add_links(self, table, links, tables):
+        names = {c.name for c in table.columns}
+        key = [c.name for c in table.columns if c.index]
+        for link in links:
+            if not set(link.child_items) <= names:
+                continue
+
+            # a link from the entry column itself, e.g. _struct.entry_id to
+            # _entry.id, is already scoped to the entry
+            if self._entry_column and self._entry_column not in link.child_items:
+                prefix = [self._entry_column]
+            else:
+                prefix = []
+            columns = prefix + link.child_items
+            # the primary key already indexes its leading columns
+            if key[:len(columns)] != columns and columns not in [i.columns for i in table.indexes]:
+                table.indexes.append(Index(index_name(table.name, columns), columns))
+
+            parent = tables.get(link.parent_category)
+            if parent is None:
+                continue
+
+            parent_columns = prefix + link.parent_items
+            parent_key = [c.name for c in parent.columns if c.index]
+            if sorted(parent_columns) != sorted(parent_key):
+                logger.debug(f"Not a key of {parent.name}: {parent_columns}")
+                continue
+
+            fk = ForeignKey(columns, parent.name, parent_columns)
+            table.references.append(fk)
+            if self._foreign_keys:
+                table.foreign_keys.append(fk)
+
+        # an index is redundant if its columns lead another index
+        indexes = table.indexes
+        table.indexes = [
+            i for i in indexes
+            if not any(o is not i and o.columns[:len(i.columns)] == i.columns for o in indexes)
+        ]
+
+    def _add_entry_column(self, table):
+        # an item with the same name, e.g. _struct.entry_id, becomes the
+        # entry column instead of being duplicated
+        existing = [c for c in table.columns if c.name == self._entry_column]
+        if existing:
+            column = existing[0]
+            table.columns.remove(column)
+            column.index = True
+            column.nullable = False
+        else:
+            itype, istype = self._type_map("code")
+            column = Column(self._entry_column, itype, istype, index=True, nullable=False, type_code="code")
+
+        table.columns.insert(0, column)
+        table.entry_column = self._entry_column
+        if self._partition_by:
+            table.partition_by = f"{self._partition_by.upper()} ({self._entry_column})"
+
+    def print_models(self):
+        tables = self.get_tables()
+        with timer("printing", items=len(tables)):
+            for table in tables:
+                self._printer.add_table(table)
+
+            self._printer.print()
     
-    def _type_map(self, itype_code):
+    def _type_map(self, itype_code, stats=None):
+        itype, istype = self._dictionary_type_map(itype_code)
+        if itype is None or stats is None or stats.rows == stats.nulls:
+            return itype, istype
+
+        if itype == "int" and stats.kind == "int":
+            if SMALLINT_RANGE[0] <= stats.min and stats.max <= SMALLINT_RANGE[1]:
+                return "int", "SmallInteger"
+            if stats.min < INTEGER_RANGE[0] or INTEGER_RANGE[1] < stats.max:
+                return "int", "BigInteger"
+            return "int", "Integer"
+
+        if itype == "str":
+            if stats.max_length > MAX_VARCHAR_LENGTH:
+                return "str", "Text"
+            return "str", f"String({max(stats.max_length, 1)})"
+
+        return itype, istype
+
+    def _dictionary_type_map(self, itype_code):
         if itype_code in TYPE_MAP:
             if TYPE_MAP[itype_code][0] == "varchar":
                 return "str", f"String({TYPE_MAP[itype_code][1]})"
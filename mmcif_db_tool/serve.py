@@ -0,0 +1,318 @@
+"""A schema service keeping a dictionary in memory.
+
+Requests are JSON objects naming what they ask for in `request`:
+
+- `categories`: the names of the categories of the dictionary.
+- `category`: the items and links of the category named `category`.
+- `tables`: the tables `SchemaMap` builds for `categories`.
+- `models`: the ORM or Core source text of `categories`, as written
+  by `process_categories`.
+
+`category`, `tables` and `models` take the item filter as lists of
+`include_items` or `exclude_items`, and `tables` and `models` the
+options of a `batch` target (`model`, `entry_column`, `partition_by`,
+`links`, `enums`, `lazy`, `default_lazy`). Responses are kept per
+request until the dictionary file changes, when it is read again.
+"""
+import os
+import json
+import logging
+import threading
+import socketserver
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from mmcif_db_tool.batch import Target, render_target, schema_map
+from mmcif_db_tool.instrument import count
+from mmcif_db_tool.mmcif_dict import DictReader, ItemFilter
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = ("categories", "category", "tables", "models")
+
+FILTER_OPTIONS = {"include_items", "exclude_items"}
+TABLE_OPTIONS = FILTER_OPTIONS | {"categories", "entry_column", "partition_by", "links", "enums"}
+MODEL_OPTIONS = TABLE_OPTIONS | {"model", "lazy", "default_lazy"}
+
+
+class RequestError(ValueError):
+    """A request that cannot be answered, reported to the client."""
+
+
+def item_dict(item):
+    return {
+        "name": item.name,
+        "full_name": item.full_name,
+        "description": item.description,
+        "type_code": item.type_code,
+        "mandatory": item.mandatory_code,
+        "default_value": item.default_value,
+        "index": item.index,
+        "enumerations": item.enumerations,
+    }
+
+
+def category_dict(category):
+    return {
+        "id": category.id,
+        "description": category.description,
+        "key_names": category.key_names,
+        "items": [item_dict(i) for i in category.items],
+        "links": [
+            {"parent_category": l.parent_category, "child_items": l.child_items, "parent_items": l.parent_items}
+            for l in category.links
+        ],
+    }
+
+
+def column_dict(column):
+    return {
+        "name": column.name,
+        "type": column.type,
+        "subtype": column.subtype,
+        "index": column.index,
+        "nullable": column.nullable,
+        "default": column.default,
+        "type_code": column.type_code,
+        "enum_values": column.enum_values,
+        "lookup": column.lookup,
+    }
+
+
+def table_dict(table):
+    return {
+        "name": table.name,
+        "columns": [column_dict(c) for c in table.columns],
+        "entry_column": table.entry_column,
+        "indexes": [{"name": i.name, "columns": i.columns} for i in table.indexes],
+        "foreign_keys": [
+            {"columns": fk.columns, "parent_table": fk.parent_table, "parent_columns": fk.parent_columns, "deferred": fk.deferred}
+            for fk in table.foreign_keys
+        ],
+        "lookup_values": table.lookup_values,
+    }
+
+
+class SchemaService:
+    """Answer schema requests from the dictionary at `path`, read once
+    and read again when its modification time changes.
+
+    Responses are kept as JSON text, keyed by the whole request, for
+    the `max_responses` most recent distinct requests. Requests are
+    answered concurrently; only the reload check and the responses
+    kept are shared between them.
+    """
+
+    def __init__(self, path, cache=None, max_responses=1024):
+        self.path = path
+        self._cache = cache
+        self._max_responses = max_responses
+        self._lock = threading.Lock()
+        self._reader = None
+        self._mtime = None
+        self._responses = OrderedDict()
+
+    def handle(self, request):
+        """Return the JSON text of the result of `request`, a dict."""
+        if not isinstance(request, dict):
+            raise RequestError("a request is a JSON object")
+        kind = request.get("request")
+        if kind not in REQUESTS:
+            raise RequestError(f"unknown request '{kind}', expected one of {', '.join(REQUESTS)}")
+        handler = getattr(self, f"_{kind}")
+
+        key = json.dumps(request, sort_keys=True)
+        with self._lock:
+            self._check_reload()
+            reader = self._reader
+            response = self._responses.get(key)
+            if response is not None:
+                self._responses.move_to_end(key)
+                count("memoized_responses")
+                return response
+
+        response = json.dumps(handler(reader, request))
+        with self._lock:
+            # not kept if the dictionary was reloaded in the meantime
+            if self._reader is reader:
+                self._responses[key] = response
+                if len(self._responses) > self._max_responses:
+                    self._responses.popitem(last=False)
+        return response
+
+    def _check_reload(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+
+        logger.info(f"{'Reading' if self._reader is None else 'Reloading'} {self.path}")
+        try:
+            reader = DictReader(path=self.path, cache=self._cache)
+        except Exception as e:
+            if self._reader is None:
+                raise
+            # e.g. caught halfway through a copy; try again on the next request
+            logger.warning(f"Keeping the dictionary read before, cannot read {self.path}: {e}")
+            return
+        # index the frames now rather than in concurrent requests
+        reader.get_category_names()
+        self._reader = reader
+        self._mtime = mtime
+        self._responses.clear()
+
+    def _categories(self, reader, request):
+        _check_options(request, set())
+        return reader.get_category_names()
+
+    def _category(self, reader, request):
+        _check_options(request, FILTER_OPTIONS | {"category"})
+        if not isinstance(request.get("category"), str):
+            raise RequestError("category must be a category name")
+        return category_dict(_get_categories(reader, [request["category"]], request)[0])
+
+    def _tables(self, reader, request):
+        _check_options(request, TABLE_OPTIONS)
+        target = _target(request)
+        sm = schema_map(target)
+        sm.add_categories(_get_categories(reader, target.categories, request))
+        return [table_dict(t) for t in sm.get_tables()]
+
+    def _models(self, reader, request):
+        _check_options(request, MODEL_OPTIONS)
+        target = _target(request)
+        return render_target(target, _get_categories(reader, target.categories, request))
+
+
+def _get_categories(reader, names, request):
+    """The categories of `reader` named `names`, filtered as `request`
+    asks."""
+    categories = reader.get_categories(names, filter=_item_filter(request))
+    found = {c.id for c in categories}
+    unknown = [n for n in names if n not in found]
+    if unknown:
+        raise RequestError(f"unknown {'category' if len(unknown) == 1 else 'categories'} {', '.join(repr(n) for n in unknown)}")
+    return categories
+
+
+def _check_options(request, allowed):
+    unknown = set(request) - allowed - {"request"}
+    if unknown:
+        raise RequestError(f"unknown options {', '.join(sorted(unknown))} for request '{request['request']}'")
+
+
+def _item_names(request, option):
+    names = request.get(option) or []
+    if not isinstance(names, list) or not all(isinstance(n, str) and n.count(".") == 1 and "" not in n.split(".") for n in names):
+        raise RequestError(f"{option} must be a list of category.item names")
+    return names
+
+
+def _item_filter(request):
+    include_items = _item_names(request, "include_items")
+    exclude_items = _item_names(request, "exclude_items")
+    if include_items and exclude_items:
+        raise RequestError("include_items and exclude_items are mutually exclusive")
+    return ItemFilter(include_items=include_items, exclude_items=exclude_items)
+
+
+def _target(request):
+    options = {k: v for k, v in request.items() if k not in FILTER_OPTIONS | {"request"}}
+    if not isinstance(options.get("categories"), list):
+        raise RequestError("categories must be a list of category names")
+    target = Target(output_file=None, **options)
+    try:
+        target.validate()
+    except ValueError as e:
+        raise RequestError(str(e)) from None
+    return target
+
+
+def answer(service, request):
+    """The status and JSON text of the response to `request`: the result,
+    or an object with the error."""
+    try:
+        return 200, service.handle(request)
+    except RequestError as e:
+        return 400, json.dumps({"error": str(e)})
+    except Exception as e:
+        logger.exception(f"Failed request {request}")
+        return 500, json.dumps({"error": f"{type(e).__name__}: {e}"})
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    """`POST /<request>` with the options as a JSON object, or
+    `GET /<request>?option=value`, with `categories` and the item
+    lists comma-separated."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        request = dict(parse_qsl(url.query))
+        for name in ["categories", *FILTER_OPTIONS]:
+            if name in request:
+                request[name] = request[name].split(",")
+        self._respond({**request, "request": url.path.strip("/")})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send(400, json.dumps({"error": f"invalid JSON: {e}"}))
+            return
+        if not isinstance(body, dict):
+            self._send(400, json.dumps({"error": "a request is a JSON object"}))
+            return
+        self._respond({**body, "request": urlsplit(self.path).path.strip("/")})
+
+    def _respond(self, request):
+        self._send(*answer(self.server.service, request))
+
+    def _send(self, status, text):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line, each answered by one line holding
+    `{"result": ...}` or `{"error": ...}`."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                status, text = 400, json.dumps({"error": f"invalid JSON: {e}"})
+            else:
+                status, text = answer(self.server.service, request)
+            response = f'{{"result": {text}}}' if status == 200 else text
+            self.wfile.write(response.encode() + b"\n")
+
+
+class HttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, port, host="127.0.0.1"):
+        self.service = service
+        super().__init__((host, port), _HttpHandler)
+
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, service, path):
+        self.service = service
+        super().__init__(path, _LineHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
@@ -0,0 +1,25 @@
+import pytest
+
+from tests.helpers import STRUCTURE, get_tables
+
+
+@pytest.fixture
+def tables():
+    """`get_tables`, e.g. `tables(["entity"], entry_column="entry_id")`."""
+    return get_tables
+
+
+@pytest.fixture
+def entity_tables():
+    return get_tables(["entity"], ignore_relationships=True)
+
+
+@pytest.fixture
+def structure_tables():
+    return get_tables(STRUCTURE, ignore_relationships=True)
+
+
+@pytest.fixture
+def entry_structure_tables():
+    """`structure_tables` keyed by an entry_id column."""
+    return get_tables(STRUCTURE, ignore_relationships=True, entry_column="entry_id")
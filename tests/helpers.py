@@ -0,0 +1,20 @@
+import os
+
+from mmcif_db_tool.mmcif_dict import DictReader
+from mmcif_db_tool.schema_map import SchemaMap
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+MINI_DIC = os.path.join(DATA_DIR, "mini_pdbx.dic")
+ENTRY = os.path.join(DATA_DIR, "1abc.cif")
+
+# the categories of a minimal structure
+STRUCTURE = ["audit", "entity", "atom_site"]
+
+
+def get_tables(categories, path=MINI_DIC, **schema_map_kwargs):
+    """Build the tables of `categories` of the dictionary at `path`,
+    mini_pdbx.dic by default, with a `SchemaMap` taking the other
+    keyword arguments."""
+    sm = SchemaMap(**schema_map_kwargs)
+    sm.add_categories(DictReader(path=path).get_categories(categories=categories))
+    return sm.get_tables()
@@ -0,0 +1,62 @@
+import json
+
+from click.testing import CliRunner
+from gemmi import cif
+
+from mmcif_db_tool import mmcif_dict
+from mmcif_db_tool.batch import read_manifest
+from mmcif_db_tool.cli import cli
+from tests.helpers import MINI_DIC
+
+
+def write_manifest(tmp_path, manifest):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(manifest))
+    return str(path)
+
+
+def test_batch_matches_process_categories(tmp_path, monkeypatch):
+    (tmp_path / "exclude.txt").write_text("entity.pdbx_number_of_molecules\n")
+    manifest = write_manifest(tmp_path, {
+        "defaults": {"model": "core", "links": "foreign-keys"},
+        "targets": [
+            {"output_file": "out/entity.py", "categories": ["entity", "entity_poly"], "exclude_items_file": "exclude.txt"},
+            {"output_file": "out/atoms.py", "categories": ["atom_site", "entity"], "model": "orm", "entry_column": "entry_id"},
+        ],
+    })
+
+    reads = []
+    read_file = cif.read_file
+    monkeypatch.setattr(cif, "read_file", lambda path: reads.append(path) or read_file(path))
+    indexes = []
+    frame_index = mmcif_dict.FrameIndex
+    monkeypatch.setattr(mmcif_dict, "FrameIndex", lambda block: indexes.append(block) or frame_index(block))
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ["batch", MINI_DIC, manifest, "--no-cache", "--workers", "2"])
+    assert result.exit_code == 0, result.output
+    assert len(reads) == 1
+    assert len(indexes) == 1
+
+    single = [
+        (["--categories", "entity,entity_poly", "--exclude-items-file", str(tmp_path / "exclude.txt"), "--model", "core", "--links", "foreign-keys"], "entity.py"),
+        (["--categories", "atom_site,entity", "--entry-column", "entry_id", "--links", "foreign-keys"], "atoms.py"),
+    ]
+    for args, name in single:
+        expected = tmp_path / f"expected_{name}"
+        result = runner.invoke(cli, ["process_categories", MINI_DIC, "--no-cache", "--output-file", str(expected), *args])
+        assert result.exit_code == 0, result.output
+        assert (tmp_path / "out" / name).read_text() == expected.read_text()
+
+
+def test_manifest_errors(tmp_path):
+    manifest = write_manifest(tmp_path, {"targets": [{"output_file": "a.py", "categories": ["entity"], "model": "views"}]})
+    result = CliRunner().invoke(cli, ["batch", MINI_DIC, manifest, "--no-cache"])
+    assert result.exit_code == 2
+    assert "Target 0" in result.output and "model must be one of" in result.output
+
+    toml = tmp_path / "manifest.toml"
+    toml.write_text('[defaults]\nlinks = "indexes"\n\n[[targets]]\noutput_file = "a.py"\ncategories_file = "cats.txt"\n')
+    target = read_manifest(str(toml))[0]
+    assert target.links == "indexes"
+    assert target.categories_file == str(tmp_path / "cats.txt")
@@ -0,0 +1,53 @@
+from sqlalchemy import create_engine, text
+
+from benchmarks import synthetic
+from benchmarks.run import compare
+from mmcif_db_tool.loader import EntryLoader
+from mmcif_db_tool.mmcif_dict import DictReader
+from mmcif_db_tool.schema_map import SchemaMap
+
+
+def test_synthetic_dictionary(tmp_path):
+    path = str(tmp_path / "synthetic.dic")
+    synthetic.write_dictionary(path, categories=7, items=6)
+    reader = DictReader(path)
+
+    names = reader.get_category_names()
+    assert names == [synthetic.category_name(i) for i in range(7)]
+
+    categories = reader.get_categories(names)
+    assert all(len(c.items) == 6 for c in categories)
+    assert categories[0].links == []
+    assert [(l.parent_category, l.child_items) for l in categories[5].links] == [(synthetic.category_name(2), ["parent_id"])]
+    kind = [i for i in categories[3].items if i.name == "kind"][0]
+    assert kind.enumerations == synthetic.ENUMERATION
+
+
+def test_synthetic_entry_loads(tmp_path):
+    path = str(tmp_path / "synthetic.dic")
+    synthetic.write_dictionary(path, categories=3, items=12)
+    categories = DictReader(path).get_categories([synthetic.category_name(i) for i in range(3)])
+    entry = str(tmp_path / "syn.cif")
+    synthetic.write_entry(entry, categories, rows=25)
+
+    sm = SchemaMap(foreign_keys=True, enums="lookup")
+    sm.add_categories(categories)
+    engine = create_engine("sqlite://")
+    loader = EntryLoader(engine, sm.get_tables())
+    loader.create_tables()
+    loader.load_files([entry])
+
+    assert loader.failed == {}
+    assert set(loader.row_counts.values()) == {25}
+    with engine.connect() as conn:
+        orphans = conn.execute(text(
+            "SELECT count(*) FROM synth_cat_00002 c LEFT JOIN synth_cat_00000 p ON c.parent_id = p.id WHERE p.id IS NULL"
+        )).scalar()
+    assert orphans == 0
+
+
+def test_compare():
+    baseline = {"results": {"a": {"median": 1.0}, "b": {"median": 1.0}}}
+    current = {"results": {"a": {"median": 1.1}, "b": {"median": 1.5}, "c": {"median": 9.0}}}
+
+    assert compare(baseline, current, threshold=0.2) == [("b", 1.5)]
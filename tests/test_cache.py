@@ -0,0 +1,66 @@
+import os
+import shutil
+import pytest
+
+from gemmi import cif
+from mmcif_db_tool.cache import DictCache
+from mmcif_db_tool.mmcif_dict import DictReader, ItemFilter
+from tests.helpers import MINI_DIC
+
+
+def test_warm_run_skips_parsing(tmp_path, monkeypatch):
+    cache = DictCache(str(tmp_path))
+    cold = DictReader(path=MINI_DIC, cache=cache).get_categories(categories=["chem_comp_angle", "audit"])
+    assert len(os.listdir(tmp_path)) == 1
+
+    def fail(path):
+        raise AssertionError("dictionary parsed on a warm run")
+
+    monkeypatch.setattr(cif, "read_file", fail)
+    warm = DictReader(path=MINI_DIC, cache=cache).get_categories(categories=["chem_comp_angle", "audit"])
+
+    assert warm == cold
+    assert [c.id for c in warm] == ["audit", "chem_comp_angle"]
+    assert warm[1].items[3].full_name == "_chem_comp_angle.comp_id"
+    assert warm[1].items[3].type_code == "ucode"
+    assert warm[1].items[3].index == True
+
+
+def test_cached_filter(tmp_path):
+    cache = DictCache(str(tmp_path))
+    DictReader(path=MINI_DIC, cache=cache)
+    filter = ItemFilter(exclude_items={"pdbx_initial_refinement_model.id"})
+    categories = DictReader(path=MINI_DIC, cache=cache).get_categories(categories=["pdbx_initial_refinement_model"], filter=filter)
+
+    assert len(categories[0].items) == 5
+    assert categories[0].items[0].name == "entity_id_list"
+
+
+def test_key_follows_content(tmp_path):
+    cache = DictCache(str(tmp_path / "cache"))
+    copy = tmp_path / "copy.dic"
+    shutil.copy(MINI_DIC, copy)
+    assert cache.key(str(copy)) == cache.key(MINI_DIC)
+
+    with open(copy, "a") as f:
+        f.write("\n")
+    assert cache.key(str(copy)) != cache.key(MINI_DIC)
+
+
+def test_clear(tmp_path):
+    cache = DictCache(str(tmp_path))
+    DictReader(path=MINI_DIC, cache=cache)
+    cache.clear()
+
+    assert os.listdir(tmp_path) == []
+    assert cache.load(cache.key(MINI_DIC)) is None
+
+
+def test_cached_descriptions_are_lazy(tmp_path):
+    cache = DictCache(str(tmp_path))
+    cold = DictReader(path=MINI_DIC, cache=cache).get_categories(categories=["entity"])
+    warm = DictReader(path=MINI_DIC, cache=cache).get_categories(categories=["entity"])
+
+    assert callable(warm[0]._description)
+    assert warm[0].description == cold[0].description
+    assert [i.description for i in warm[0].items] == [i.description for i in cold[0].items]
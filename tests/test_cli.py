@@ -0,0 +1,43 @@
+import os
+import sys
+import subprocess
+
+# cumulative import time of the CLI module, in microseconds; without
+# gemmi and SQLAlchemy it stays well below this on any machine
+STARTUP_BUDGET_US = 300_000
+
+HEAVY_MODULES = ("gemmi", "sqlalchemy")
+
+
+def import_times(*args):
+    """Run the CLI with -X importtime and return the cumulative import
+    time by module name."""
+    code = "import sys; from mmcif_db_tool.cli import cli; cli(sys.argv[1:])"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(__file__)),
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return result, times
+
+
+def test_help_skips_heavy_imports():
+    result, times = import_times("--help")
+
+    assert result.returncode == 0
+    assert "process_categories" in result.stdout
+    assert [m for m in times if m.split(".")[0] in HEAVY_MODULES] == []
+    assert times["mmcif_db_tool.cli"] < STARTUP_BUDGET_US
+
+
+def test_usage_error_skips_heavy_imports():
+    result, times = import_times("load", "missing.dic", "--db-url", "sqlite://", __file__)
+
+    assert result.returncode == 2
+    assert "Either provide a list of categories" in result.stderr
+    assert [m for m in times if m.split(".")[0] in HEAVY_MODULES] == []
@@ -0,0 +1,76 @@
+import datetime
+
+import pytest
+from gemmi import cif
+
+np = pytest.importorskip("numpy")
+
+from mmcif_db_tool.columnar import array_rows, category_arrays, convert_column, has_quotes
+from mmcif_db_tool.loader import category_rows
+from mmcif_db_tool.schema_map import Column
+from tests.helpers import ENTRY
+
+CATEGORIES = ["audit", "entity", "entity_poly", "chem_comp", "atom_site"]
+
+
+@pytest.mark.parametrize("enums", [None, "native", "lookup"])
+def test_same_rows_as_loader(tables, enums):
+    block = cif.read_file(ENTRY).sole_block()
+    for table in tables(CATEGORIES, ignore_relationships=True, entry_column="entry_id", enums=enums):
+        if table.lookup_values:
+            continue
+        assert array_rows(category_arrays(block, table)) == category_rows(block, table)
+
+
+def test_typed_arrays_and_masks(tables):
+    block = cif.read_file(ENTRY).sole_block()
+    by_name = {t.name: t for t in tables(CATEGORIES, ignore_relationships=True, enums="lookup")}
+
+    atoms = category_arrays(block, by_name["atom_site"])
+    assert atoms["Cartn_x"].values.dtype == np.float64
+    assert atoms["occupancy"].mask.tolist() == [False] * 4 + [True, False]
+    assert atoms["group_PDB"].values.tolist() == [1, 1, 1, 1, 2, 2]
+
+    entities = category_arrays(block, by_name["entity"])
+    assert entities["pdbx_number_of_molecules"].mask.tolist() == [False, False, True]
+    assert entities["pdbx_number_of_molecules"].to_list() == [2, 1, None]
+
+    audit = category_arrays(block, by_name["audit"])
+    assert audit["creation_date"].to_list() == [datetime.datetime(2021, 3, 4)]
+    assert audit["update_record"].to_list() == ["Initial release of the\ntest entry."]
+    assert audit["creation_method"].to_list() == [None]
+
+    assert category_arrays(cif.read_string("data_X\n_entry.id X\n").sole_block(), by_name["atom_site"]) is None
+
+
+def test_convert_column():
+    column = Column("value", "float", "Float")
+    result = convert_column(column, ["1.5(2)", "?", "'2.25'", "-3"])
+    assert result.to_list() == [1.5, None, 2.25, -3.0]
+
+    column = Column("count", "int", "SmallInteger")
+    assert convert_column(column, ["1", "."]).values.dtype == np.int16
+    with pytest.raises(ValueError):
+        convert_column(column, ["40000"])
+    with pytest.raises(ValueError):
+        convert_column(column, ["1.5"])
+
+
+def test_only_leading_quotes_need_unquoting():
+    assert not has_quotes(["O5'", "C4'", "N1"])
+    assert has_quotes(["O5'", "'O5'''", "N1"])
+    assert has_quotes(["N1", ";text\n;"])
+
+
+def test_integer_overflow(entity_tables):
+    table, = entity_tables
+    block = cif.read_string("data_X\nloop_\n_entity.id\n_entity.pdbx_number_of_molecules\n1 99999999999999999999\n").sole_block()
+    with pytest.raises(ValueError, match="_entity.pdbx_number_of_molecules: values out of the range of Integer"):
+        category_arrays(block, table)
+
+
+def test_invalid_enumeration(tables):
+    table = next(t for t in tables(CATEGORIES, ignore_relationships=True, enums="native") if t.name == "atom_site")
+    block = cif.read_string("data_X\nloop_\n_atom_site.id\n_atom_site.group_PDB\n1 atom\n2 ANISOU\n").sole_block()
+    with pytest.raises(ValueError, match="_atom_site.group_PDB: 'ANISOU' is not one of the enumerated values"):
+        category_arrays(block, table)
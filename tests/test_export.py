@@ -0,0 +1,106 @@
+import os
+import csv
+import shutil
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import create_engine, text
+
+from mmcif_db_tool.cli import cli
+from mmcif_db_tool.export import DelimitedExporter
+from mmcif_db_tool.loader import EntryLoader
+from tests.helpers import ENTRY, MINI_DIC, STRUCTURE
+
+
+def read_csv(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_csv_files(tmp_path, tables):
+    exporter = DelimitedExporter(str(tmp_path), tables(STRUCTURE, entry_column="entry_id"))
+    exporter.export_files([ENTRY])
+
+    assert exporter.row_counts == {"audit": 1, "entity": 3, "atom_site": 6}
+    entity = read_csv(tmp_path / "entity.csv")
+    assert entity[0] == ["entry_id", "id", "type", "pdbx_number_of_molecules"]
+    assert entity[3] == ["1ABC", "3", "water", ""]
+    audit = read_csv(tmp_path / "audit.csv")
+    assert audit[1] == ["1ABC", "2021-03-04 00:00:00.000000", "", "1", "Initial release of the\ntest entry."]
+
+
+def test_tsv_files(tmp_path, tables):
+    exporter = DelimitedExporter(str(tmp_path), tables(STRUCTURE, entry_column="entry_id"), format="tsv")
+    exporter.export_files([ENTRY])
+
+    assert (tmp_path / "audit.tsv").read_text() == "1ABC\t2021-03-04 00:00:00\t\\N\t1\tInitial release of the\\ntest entry.\n"
+    assert exporter.write_scripts() == [str(tmp_path / "load_postgresql.sql")]
+    assert "FROM 'audit.tsv' WITH (FORMAT text)" in (tmp_path / "load_postgresql.sql").read_text()
+
+
+def test_entries_per_file(tmp_path, tables):
+    other = tmp_path / "2xyz.cif"
+    other.write_text("data_2XYZ\nloop_\n_entity.id\n_entity.type\n1 polymer\n2 water\n")
+    output_dir = tmp_path / "out"
+    exporter = DelimitedExporter(str(output_dir), tables(STRUCTURE, entry_column="entry_id"), entries_per_file=1)
+    exporter.export_files([ENTRY, str(other), ENTRY])
+
+    assert exporter.files["entity"] == ["entity-00000.csv", "entity-00001.csv", "entity-00002.csv"]
+    assert exporter.files["atom_site"] == ["atom_site-00000.csv", "atom_site-00002.csv"]
+    assert len(read_csv(output_dir / "entity-00001.csv")) == 3
+    # each part has its scripts once finished
+    part = (output_dir / "load_sqlite-00001.sql").read_text()
+    assert '"entity-00001.csv"' in part and "atom_site" not in part and "00000" not in part
+    assert (output_dir / "load_postgresql-00002.sql").exists() and not (output_dir / "load_sqlite.sql").exists()
+
+
+def test_scripts_order_parents_first(tmp_path, tables):
+    exporter = DelimitedExporter(str(tmp_path), tables(STRUCTURE, entry_column="entry_id", enums="lookup"))
+    exporter.export_files([ENTRY])
+    exporter.write_scripts()
+
+    copies = [line for line in (tmp_path / "load_postgresql.sql").read_text().splitlines() if line.startswith("\\copy")]
+    assert [line.split('"')[1] for line in copies] == ["audit", "entity", "atom_site"]
+    sqlite_script = (tmp_path / "load_sqlite.sql").read_text()
+    assert '.import --csv --skip 1 "entity.csv" "import_entity"' in sqlite_script
+    assert 'SELECT "entry_id", "id", NULLIF("type", \'\'), ' in sqlite_script
+
+
+@pytest.mark.skipif(shutil.which("sqlite3") is None, reason="needs the sqlite3 shell")
+def test_sqlite_script_matches_load(tmp_path, tables):
+    entry_tables = tables(STRUCTURE, entry_column="entry_id", enums="lookup")
+    loaded = create_engine(f"sqlite:///{tmp_path / 'loaded.db'}")
+    loader = EntryLoader(loaded, entry_tables)
+    loader.create_tables()
+    loader.load_files([ENTRY])
+
+    imported = create_engine(f"sqlite:///{tmp_path / 'imported.db'}")
+    EntryLoader(imported, entry_tables).create_tables()
+    old_row = ("0OLD", None, "", "1", "")
+    with imported.begin() as conn:
+        conn.execute(text("INSERT INTO audit VALUES (:a, :b, :c, :d, :e)"), dict(zip("abcde", old_row)))
+    exporter = DelimitedExporter(str(tmp_path / "out"), entry_tables)
+    exporter.export_files([ENTRY])
+    exporter.write_scripts()
+    with open(tmp_path / "out" / "load_sqlite.sql") as script:
+        subprocess.run(["sqlite3", str(tmp_path / "imported.db")], stdin=script, cwd=tmp_path / "out", check=True)
+
+    for name in STRUCTURE:
+        query = text(f'SELECT * FROM "{name}" WHERE entry_id != \'0OLD\' ORDER BY 1, 2')
+        with loaded.connect() as a, imported.connect() as b:
+            assert a.execute(query).fetchall() == b.execute(query).fetchall()
+    # the rows already in the tables keep their empty strings
+    with imported.connect() as conn:
+        assert tuple(conn.execute(text("SELECT * FROM audit WHERE entry_id = '0OLD'")).one()) == old_row
+
+
+def test_cli_export(tmp_path):
+    result = CliRunner().invoke(cli, [
+        "export", MINI_DIC, ENTRY, "--categories", "entity", "--no-cache",
+        "--output-dir", str(tmp_path), "--entry-column", "entry_id",
+    ])
+
+    assert result.exit_code == 0, result.output
+    assert sorted(os.listdir(tmp_path)) == ["entity.csv", "load_postgresql.sql", "load_sqlite.sql"]
+    assert "entity: 3 rows" in result.output
@@ -0,0 +1,56 @@
+import os
+import json
+
+from click.testing import CliRunner
+
+from mmcif_db_tool.cli import cli
+from mmcif_db_tool.instrument import Instrumentation
+from tests.helpers import MINI_DIC
+
+
+def test_disabled_timers_record_nothing():
+    instruments = Instrumentation()
+    with instruments.timer("parsing", items=3):
+        pass
+    instruments.count("skipped")
+
+    assert instruments.phases == {}
+    assert instruments.counters == {}
+
+
+def test_timers_and_counters():
+    instruments = Instrumentation()
+    instruments.enable()
+    for _ in range(2):
+        with instruments.timer("parsing", items=3):
+            pass
+    with instruments.timer("scan") as t:
+        t.items = 10
+    instruments.count("skipped", 4)
+
+    report = instruments.report()
+    assert report["phases"]["parsing"]["calls"] == 2
+    assert report["phases"]["parsing"]["items"] == 6
+    assert report["phases"]["scan"]["items"] == 10
+    assert report["counters"] == {"skipped": 4}
+    assert report["wall_time"] >= report["phases"]["parsing"]["wall_time"]
+
+
+def test_profile_report(tmp_path):
+    items_file = tmp_path / "exclude.txt"
+    items_file.write_text("entity.pdbx_number_of_molecules\n")
+    report_file = tmp_path / "report.json"
+    result = CliRunner().invoke(cli, [
+        "process_categories", MINI_DIC, "--categories", "entity,atom_site", "--no-cache",
+        "--exclude-items-file", str(items_file), "--output-file", str(tmp_path / "models.py"),
+        "--profile-output", str(report_file), "--cprofile", str(tmp_path / "run.prof"),
+    ])
+    assert result.exit_code == 0, result.output
+
+    with open(report_file) as f:
+        report = json.load(f)
+    for phase in ["dictionary_read", "frame_scan", "item_parsing", "filtering", "type_mapping", "printing"]:
+        assert report["phases"][phase]["calls"] > 0
+    assert report["phases"]["printing"]["items"] == 2
+    assert report["counters"] == {"items_skipped": 1}
+    assert os.path.getsize(tmp_path / "run.prof") > 0
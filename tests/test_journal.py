@@ -0,0 +1,114 @@
+import os
+import pytest
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine, text
+
+from mmcif_db_tool.cli import cli
+from mmcif_db_tool.journal import DONE, FAILED, STARTED, LoadJournal
+from mmcif_db_tool.loader import EntryLoader
+from tests.helpers import ENTRY, MINI_DIC
+
+CATEGORIES = ["entity", "atom_site"]
+
+
+@pytest.fixture
+def entry_tables(tables):
+    return tables(CATEGORIES, ignore_relationships=True, entry_column="entry_id")
+
+
+def write_entry(path, entry_id, types):
+    rows = "".join(f"{i} {t}\n" for i, t in enumerate(types, 1))
+    path.write_text(f"data_{entry_id}\nloop_\n_entity.id\n_entity.type\n{rows}")
+    return str(path)
+
+
+def entity_rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT entry_id, id, type FROM entity ORDER BY entry_id, id")).fetchall()
+
+
+def load(engine, tables, journal, paths, **kwargs):
+    loader = EntryLoader(engine, tables, journal=journal, **kwargs)
+    loader.load_files(paths)
+    return loader
+
+
+def test_skip_loaded_and_reload_changed(tmp_path, entry_tables):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}")
+    EntryLoader(engine, entry_tables).create_tables()
+    journal = LoadJournal(str(tmp_path / "journal.db"))
+    entry = write_entry(tmp_path / "2xyz.cif", "2XYZ", ["polymer", "water"])
+
+    first = load(engine, entry_tables, journal, [ENTRY, entry])
+    assert first.row_counts == {"entity": 5, "atom_site": 6}
+    assert journal.summary() == {DONE: 2}
+    assert journal.get(ENTRY)["entry_id"] == "1ABC"
+
+    # touched only
+    os.utime(entry, ns=(0, 0))
+    second = load(engine, entry_tables, journal, [ENTRY, entry])
+    assert second.skipped == 2 and second.row_counts == {"entity": 0, "atom_site": 0}
+
+    # changed, with a new entry id
+    write_entry(tmp_path / "2xyz.cif", "2XYY", ["water"])
+    third = load(engine, entry_tables, journal, [ENTRY, entry])
+    assert third.skipped == 1 and third.row_counts == {"entity": 1, "atom_site": 0}
+    assert [r for r in entity_rows(engine) if r[0] != "1ABC"] == [("2XYY", "1", "water")]
+    assert journal.get(entry)["row_counts"] == '{"entity": 1}'
+
+
+def test_retry_partial_and_failed(tmp_path, entry_tables):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}")
+    journal = LoadJournal(str(tmp_path / "journal.db"))
+    # a run that died after committing the rows of the entry, before
+    # recording them
+    loader = EntryLoader(engine, entry_tables)
+    loader.create_tables()
+    journal.begin(ENTRY)
+    loader.load_files([ENTRY])
+    bad_path = tmp_path / "bad.cif"
+    bad_path.write_text("data_BAD\n_entity.id 1\n_entity.pdbx_number_of_molecules many\n")
+    bad = str(bad_path)
+    assert journal.get(ENTRY)["status"] == STARTED
+
+    loaded = load(engine, entry_tables, journal, [ENTRY, bad], memory_budget=1024)
+    assert loaded.row_counts == {"entity": 3, "atom_site": 6}
+    assert journal.get(bad)["status"] == FAILED
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM atom_site")).scalar() == 6
+
+    write_entry(bad_path, "BAD", ["polymer"])
+    retried = load(engine, entry_tables, journal, [ENTRY, bad])
+    assert retried.skipped == 1 and not retried.failed
+    assert journal.summary() == {DONE: 2}
+    assert ("BAD", "1", "polymer") in entity_rows(engine)
+
+
+def test_journal_needs_entry_column(tmp_path, tables):
+    journal = LoadJournal(str(tmp_path / "journal.db"))
+    with pytest.raises(ValueError, match="entry column"):
+        EntryLoader(create_engine("sqlite://"), tables(CATEGORIES, ignore_relationships=True), journal=journal)
+
+
+def test_cli_load_with_journal(tmp_path):
+    args = [
+        "load", MINI_DIC, ENTRY, "--categories", "entity", "--no-cache", "--entry-column", "entry_id",
+        "--db-url", f"sqlite:///{tmp_path / 'pdb.db'}", "--journal", str(tmp_path / "journal.db"),
+    ]
+    first = CliRunner().invoke(cli, args + ["--create-tables", "--progress-every", "1"])
+    assert first.exit_code == 0, first.output
+    assert "1 entry files: 1 loaded" in first.output
+
+    second = CliRunner().invoke(cli, args)
+    assert second.exit_code == 0, second.output
+    assert "Skipped 1 entry files loaded already" in second.output
+    assert "entity: 0 rows" in second.output
+
+
+def test_cli_journal_needs_entry_column(tmp_path):
+    result = CliRunner().invoke(cli, [
+        "load", MINI_DIC, ENTRY, "--categories", "entity", "--db-url", "sqlite://", "--journal", str(tmp_path / "journal.db"),
+    ])
+    assert result.exit_code == 2
+    assert "--journal requires --entry-column" in result.output
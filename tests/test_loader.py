@@ -0,0 +1,277 @@
+import pytest
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from mmcif_db_tool.cli import cli
+from mmcif_db_tool.loader import EntryLoader, chunk_size, load_plan, plan_text, row_size
+from mmcif_db_tool.mmcif_dict import Category, Item, Link
+from mmcif_db_tool.schema_map import SchemaMap
+from tests.helpers import ENTRY, MINI_DIC
+
+
+def test_load_entry(structure_tables):
+    engine = create_engine("sqlite://")
+    loader = EntryLoader(engine, structure_tables, batch_size=4)
+    loader.create_tables()
+    loader.load_files([ENTRY])
+
+    assert loader.row_counts == {"atom_site": 6, "audit": 1, "entity": 3}
+    with engine.connect() as conn:
+        atoms = conn.execute(text("SELECT id, group_PDB, Cartn_x, occupancy FROM atom_site ORDER BY id")).fetchall()
+        entities = conn.execute(text("SELECT id, type, pdbx_number_of_molecules FROM entity ORDER BY id")).fetchall()
+        audit = conn.execute(text("SELECT creation_method, update_record FROM audit")).fetchone()
+
+    assert len(atoms) == 6
+    assert atoms[0] == ("1", "ATOM", 11.104, 1.0)
+    assert atoms[4] == ("5", "HETATM", 2.001, None)
+    assert entities[1] == ("2", "non-polymer", 1)
+    assert entities[2] == ("3", "water", None)
+    assert audit == (None, "Initial release of the\ntest entry.")
+
+
+def test_missing_items_take_default(tmp_path, entity_tables):
+    entry = tmp_path / "2xyz.cif"
+    entry.write_text("data_2XYZ\nloop_\n_entity.id\n_entity.type\n1 polymer\n2 water\n")
+    engine = create_engine("sqlite://")
+    loader = EntryLoader(engine, entity_tables)
+    loader.create_tables()
+    loader.load_files([str(entry)])
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, type, pdbx_number_of_molecules FROM entity ORDER BY id")).fetchall()
+    assert rows == [("1", "polymer", 1), ("2", "water", 1)]
+
+
+def test_invalid_value(tmp_path, tables):
+    entry = tmp_path / "bad.cif"
+    entry.write_text("data_BAD\n_audit.revision_id 1\n_audit.creation_date yesterday\n")
+    loader = EntryLoader(create_engine("sqlite://"), tables(["audit"], ignore_relationships=True))
+    loader.create_tables()
+    loader.load_files([str(entry), ENTRY])
+
+    assert list(loader.failed) == [str(entry)]
+    assert "_audit.creation_date" in loader.failed[str(entry)]
+    assert loader.row_counts == {"audit": 1}
+
+
+def test_load_parallel(tmp_path, tables):
+    bad = tmp_path / "bad.cif"
+    bad.write_text("data_BAD\nloop_\n_entity.id\n_entity.type\n1\n")
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}")
+    loader = EntryLoader(engine, tables(["entity", "atom_site"], ignore_relationships=True), batch_size=2)
+    loader.create_tables()
+    loader.load_files_parallel([ENTRY, str(bad)], workers=2, max_pending=1)
+
+    assert list(loader.failed) == [str(bad)]
+    assert loader.row_counts == {"entity": 3, "atom_site": 6}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM atom_site")).scalar() == 6
+
+
+def test_load_entries_sharing_tables(tmp_path, tables):
+    other = tmp_path / "2xyz.cif"
+    with open(ENTRY) as f:
+        other.write_text(f.read().replace("1ABC", "2XYZ"))
+
+    engine = create_engine("sqlite://")
+    loader = EntryLoader(engine, tables(["entity"], ignore_relationships=True, entry_column="entry_id"))
+    loader.create_tables()
+    loader.load_files([ENTRY, str(other)])
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT entry_id, id FROM entity ORDER BY entry_id, id")).fetchall()
+    assert rows == [("1ABC", "1"), ("1ABC", "2"), ("1ABC", "3"), ("2XYZ", "1"), ("2XYZ", "2"), ("2XYZ", "3")]
+
+
+@pytest.mark.parametrize("enums, expected", [("native", "non-polymer"), ("lookup", 2)])
+def test_load_enums(enums, expected, tables):
+    engine = create_engine("sqlite://")
+    loader = EntryLoader(engine, tables(["entity"], ignore_relationships=True, enums=enums))
+    loader.create_tables()
+    loader.load_files([ENTRY])
+
+    assert loader.row_counts == {"entity": 3}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT type FROM entity WHERE id = '2'")).scalar() == expected
+        if enums == "lookup":
+            assert conn.execute(text("SELECT count(*) FROM entity_type_lookup")).scalar() == 5
+
+
+def test_invalid_enum_value(tmp_path, tables):
+    entry = tmp_path / "bad.cif"
+    entry.write_text("data_BAD\n_entity.id 1\n_entity.type protein\n")
+    loader = EntryLoader(create_engine("sqlite://"), tables(["entity"], ignore_relationships=True, enums="lookup"))
+    loader.create_tables()
+    loader.load_files([str(entry)])
+
+    assert "_entity.type" in loader.failed[str(entry)]
+
+
+def test_chunk_size(tables):
+    atom_site = {t.name: t for t in tables(["atom_site"], ignore_relationships=True)}["atom_site"]
+
+    assert row_size(atom_site) > 24 * len(atom_site.columns)
+    assert chunk_size(atom_site, 10 * row_size(atom_site)) == 10
+    assert chunk_size(atom_site, 1) == 1
+
+
+def test_stream_with_memory_budget(tmp_path, entry_structure_tables):
+    atom_site = {t.name: t for t in entry_structure_tables}["atom_site"]
+    bad = tmp_path / "bad.cif"
+    with open(ENTRY) as f:
+        # an invalid coordinate in the last of the atoms
+        bad.write_text(f.read().replace("1ABC", "2BAD").replace("7.512", "x.512"))
+
+    engine = create_engine("sqlite://")
+    loader = EntryLoader(engine, entry_structure_tables, batch_size=1, memory_budget=2 * row_size(atom_site))
+    loader.create_tables()
+    loader.load_files([ENTRY, str(bad)])
+
+    assert loader.row_counts == {"atom_site": 6, "audit": 1, "entity": 3}
+    assert "_atom_site.Cartn_x" in loader.failed[str(bad)]
+    with engine.connect() as conn:
+        # the chunks of the failed entry were rolled back
+        assert conn.execute(text("SELECT count(*) FROM atom_site")).scalar() == 6
+        assert conn.execute(text("SELECT count(*) FROM entity")).scalar() == 3
+
+
+def test_stream_parallel(tmp_path, tables):
+    other = tmp_path / "2xyz.cif"
+    other.write_text("data_2XYZ\nloop_\n_entity.id\n_entity.type\n1 polymer\n2 water\n")
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}?timeout=30")
+    loader = EntryLoader(engine, tables(["entity", "atom_site"], ignore_relationships=True, entry_column="entry_id"), memory_budget=1024)
+    loader.create_tables()
+    loader.load_files_parallel([ENTRY, str(other)], workers=2)
+
+    assert loader.row_counts == {"entity": 5, "atom_site": 6}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM entity")).scalar() == 5
+
+
+def enforce_foreign_keys(engine):
+    event.listen(engine, "connect", lambda conn, record: conn.execute("PRAGMA foreign_keys = ON"))
+    return engine
+
+
+def test_load_in_waves(tmp_path, tables):
+    entry_tables = tables(["atom_site", "struct_asym", "entity"], entry_column="entry_id")
+    assert plan_text(load_plan(entry_tables)) == "Wave 1: entity\nWave 2: struct_asym\nWave 3: atom_site"
+
+    engine = enforce_foreign_keys(create_engine(f"sqlite:///{tmp_path / 'pdb.db'}?timeout=30"))
+    loader = EntryLoader(engine, entry_tables, batch_size=2, table_workers=2)
+    loader.create_tables()
+    loader.load_files([ENTRY])
+
+    assert not loader.failed
+    assert loader.row_counts == {"entity": 3, "struct_asym": 4, "atom_site": 6}
+
+
+def test_load_cycle_with_deferred_keys(tmp_path):
+    def category(name, other):
+        items = [Item(f"_{name}.id", "id", "", True, "code", None, index=True), Item(f"_{name}.{other}_id", f"{other}_id", "", True, "code", None)]
+        return Category(name, "", ["id"], items, [Link(other, [f"{other}_id"], ["id"])])
+
+    sm = SchemaMap()
+    sm.add_categories([category("first", "second"), category("second", "first")])
+    tables = sm.get_tables()
+    assert all(fk.deferred for t in tables for fk in t.foreign_keys)
+    assert plan_text(load_plan(tables)) == "Wave 1: (first + second)\nDeferred: first -> second, second -> first"
+
+    entry = tmp_path / "cycle.cif"
+    entry.write_text("data_CYCLE\n_first.id 1\n_first.second_id 2\n_second.id 2\n_second.first_id 1\n")
+    engine = enforce_foreign_keys(create_engine(f"sqlite:///{tmp_path / 'pdb.db'}"))
+    loader = EntryLoader(engine, tables)
+    loader.create_tables()
+    loader.load_files([str(entry)])
+
+    assert not loader.failed
+    assert loader.row_counts == {"first": 1, "second": 1}
+
+
+def test_table_workers_need_database_file(entity_tables):
+    with pytest.raises(ValueError, match="database file"):
+        EntryLoader(create_engine("sqlite://"), entity_tables, table_workers=2)
+
+
+def test_cli_plan():
+    result = CliRunner().invoke(cli, [
+        "load", MINI_DIC, "--categories", "atom_site,entity,struct_asym,chem_comp", "--no-cache", "--links", "foreign-keys", "--plan",
+    ])
+    assert result.exit_code == 0, result.output
+    assert result.output == "Wave 1: chem_comp, entity\nWave 2: struct_asym\nWave 3: atom_site\n"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rejected_entry_is_skipped(tmp_path, workers, tables):
+    bad = tmp_path / "2bad.cif"
+    with open(ENTRY) as f:
+        # NULL in the mandatory _chem_comp.type, which only the database checks
+        bad.write_text(f.read().replace("1ABC", "2BAD").replace('GLY "peptide linking"', "GLY ?"))
+    statuses = []
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}")
+    loader = EntryLoader(engine, tables(["entry", "entity", "chem_comp"], ignore_relationships=True, entry_column="entry_id"), progress=lambda path, status: statuses.append((path, status)))
+    loader.create_tables()
+    if workers > 1:
+        loader.load_files_parallel([ENTRY, str(bad)], workers)
+    else:
+        loader.load_files([ENTRY, str(bad)])
+
+    assert list(loader.failed) == [str(bad)]
+    assert "NOT NULL constraint failed: chem_comp.type" in loader.failed[str(bad)]
+    assert sorted(statuses) == sorted([(ENTRY, "loaded"), (str(bad), "failed")])
+    assert loader.row_counts == {"entry": 1, "entity": 3, "chem_comp": 4}
+    with engine.connect() as conn:
+        for name in loader.row_counts:
+            assert conn.execute(text(f"SELECT DISTINCT entry_id FROM {name}")).scalars().all() == ["1ABC"]
+
+
+def test_rejected_entry_without_entry_column(tmp_path, tables):
+    bad = tmp_path / "2bad.cif"
+    with open(ENTRY) as f:
+        bad.write_text(f.read().replace("1ABC", "2BAD").replace('GLY "peptide linking"', "GLY ?"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}")
+    loader = EntryLoader(engine, tables(["entity", "chem_comp"], ignore_relationships=True), batch_size=3)
+    loader.create_tables()
+    loader.load_files([str(bad), ENTRY])
+
+    # the entry is written whole or not at all
+    assert list(loader.failed) == [str(bad)]
+    assert loader.row_counts == {"entity": 3, "chem_comp": 4}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM entity")).scalar() == 3
+
+
+def test_database_errors_abort_the_load(tmp_path, entity_tables):
+    # the tables were never created
+    loader = EntryLoader(create_engine(f"sqlite:///{tmp_path / 'pdb.db'}"), entity_tables)
+    with pytest.raises(OperationalError, match="no such table"):
+        loader.load_files([ENTRY])
+    assert not loader.failed
+
+
+def test_table_workers_share_entries(tmp_path, tables):
+    paths = []
+    with open(ENTRY) as f:
+        content = f.read()
+    for i in range(6):
+        path = tmp_path / f"{i}abc.cif"
+        path.write_text(content.replace("1ABC", f"{i}ABC"))
+        paths.append(str(path))
+    bad = tmp_path / "bad.cif"
+    bad.write_text(content.replace("1ABC", "2BAD").replace('GLY "peptide linking"', "GLY ?"))
+    statuses = []
+    # no links: every table is in the one wave, each with rows of every entry
+    entry_tables = tables(["entity", "chem_comp", "struct_asym", "atom_site"], ignore_relationships=True, entry_column="entry_id")
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}?timeout=30")
+    loader = EntryLoader(engine, entry_tables, batch_size=5, table_workers=2, progress=lambda path, status: statuses.append((path, status)))
+    assert len(loader._plan.waves) == 1
+    loader.create_tables()
+    loader.load_files(paths[:3] + [str(bad)] + paths[3:])
+
+    assert sorted(statuses) == sorted([(p, "loaded") for p in paths] + [(str(bad), "failed")])
+    assert list(loader.failed) == [str(bad)]
+    assert loader.row_counts == {"entity": 18, "chem_comp": 24, "struct_asym": 24, "atom_site": 36}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM atom_site WHERE entry_id = '2BAD'")).scalar() == 0
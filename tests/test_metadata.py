@@ -0,0 +1,86 @@
+import io
+import zlib
+import pickle
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, select
+from sqlalchemy.orm import Session
+
+from mmcif_db_tool.metadata import build_metadata, declarative_classes, dump_tables, load_tables
+from mmcif_db_tool.mmcif_dict import DictReader
+from mmcif_db_tool.schema_map import SchemaMap, SqlAlchemyCorePrinter
+from tests.helpers import MINI_DIC
+
+
+def get_schema_map(categories, printer=None, **kwargs):
+    sm = SchemaMap(printer=printer, **kwargs)
+    sm.add_categories(DictReader(path=MINI_DIC).get_categories(categories=categories))
+    return sm
+
+
+def test_metadata_matches_core_text():
+    categories = ["entity", "entity_poly", "struct_asym", "atom_site"]
+    output = io.StringIO()
+    get_schema_map(categories, SqlAlchemyCorePrinter(fp=output, include_imports=True), entry_column="entry_id", enums="native").print_models()
+    models = {}
+    exec(output.getvalue(), models)
+
+    metadata = get_schema_map(categories, entry_column="entry_id", enums="native").build_metadata()
+
+    printed = models["metadata_obj"]
+    assert list(metadata.tables) == list(printed.tables)
+    for name, table in metadata.tables.items():
+        other = printed.tables[name]
+        assert [(c.name, repr(c.type), c.primary_key) for c in table.columns] == [
+            (c.name, repr(c.type), c.primary_key) for c in other.columns
+        ]
+        assert {fk.target_fullname for fk in table.foreign_keys} == {fk.target_fullname for fk in other.foreign_keys}
+        assert {i.name for i in table.indexes} == {i.name for i in other.indexes}
+
+    # mandatory items are NOT NULL, which the Core text leaves out
+    assert not metadata.tables["struct_asym"].c.entity_id.nullable
+
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    assert set(inspect(engine).get_table_names()) == set(metadata.tables)
+
+
+def test_partition_by():
+    metadata = get_schema_map(["entity"], entry_column="entry_id", partition_by="list").build_metadata()
+
+    assert metadata.tables["entity"].dialect_options["postgresql"]["partition_by"] == "LIST (entry_id)"
+
+
+def test_declarative_classes():
+    tables = get_schema_map(["entity", "entity_poly", "struct_asym"], entry_column="entry_id", foreign_keys=False).get_tables()
+    classes = declarative_classes(tables, default_lazy="selectin")
+    Entity, EntityPoly, StructAsym = classes["Entity"], classes["EntityPoly"], classes["StructAsym"]
+
+    engine = create_engine("sqlite://")
+    Entity.metadata.create_all(engine)
+    with Session(engine) as session:
+        for entry_id in ["1ABC", "2XYZ"]:
+            session.add(Entity(entry_id=entry_id, id="1"))
+            session.add(EntityPoly(entry_id=entry_id, entity_id="1"))
+            session.add_all([StructAsym(entry_id=entry_id, id=i, entity_id="1") for i in "AB"])
+        session.commit()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    with Session(engine) as session:
+        entities = session.scalars(select(Entity)).all()
+        assert [len(e.struct_asym) for e in entities] == [2, 2]
+        assert all(e.entity_poly.entity is e for e in entities)
+    assert len(statements) == 3
+
+
+def test_dump_and_load_tables():
+    tables = get_schema_map(["entity", "atom_site"], entry_column="entry_id", enums="lookup").get_tables()
+
+    loaded = load_tables(dump_tables(tables))
+    assert [t.name for t in loaded] == [t.name for t in tables]
+    assert [c.subtype for c in loaded[-1].columns] == [c.subtype for c in tables[-1].columns]
+    assert list(build_metadata(loaded).tables) == [t.name for t in tables]
+
+    with pytest.raises(ValueError, match="format"):
+        load_tables(zlib.compress(pickle.dumps((0, tables))))
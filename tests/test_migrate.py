@@ -0,0 +1,187 @@
+import io
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine, inspect, text
+
+from mmcif_db_tool.cli import cli
+from mmcif_db_tool.loader import EntryLoader
+from mmcif_db_tool.migrate import AlembicMigrationPrinter, SchemaDiff, SqlMigrationPrinter, widens
+from tests.helpers import ENTRY, MINI_DIC
+
+EXTRA_ITEM = """save__audit.extra
+    _item_description.description
+;              An item added by the new version.
+;
+    _item.name                  "_audit.extra"
+    _item.category_id             audit
+    _item.mandatory_code          no
+    _item_type.code               int
+     save_
+
+save_chem_comp
+"""
+
+
+def write_new_version(tmp_path):
+    """mini_pdbx.dic with a new audit item, audit.revision_id made
+    optional text, and a new group_PDB value."""
+    with open(MINI_DIC) as f:
+        content = f.read()
+
+    content = content.replace("save_chem_comp\n", EXTRA_ITEM, 1)
+    content = content.replace(
+        "    _item.mandatory_code          yes\n    _item_type.code               line",
+        "    _item.mandatory_code          no\n    _item_type.code               text",
+    )
+    content = content.replace(
+        '         HETATM   "coordinate records for non-standard residues"',
+        '         HETATM   "coordinate records for non-standard residues"\n         ANISOU   "anisotropic records"',
+    )
+    path = tmp_path / "new.dic"
+    path.write_text(content)
+    return str(path)
+
+
+def test_widens():
+    assert widens("SmallInteger", "Integer")
+    assert widens("String(20)", "String(128)")
+    assert widens("String(128)", "Text")
+    assert not widens("Integer", "SmallInteger")
+    assert not widens("Text", "String(128)")
+    assert not widens("Float", "Integer")
+
+
+def test_schema_diff(tmp_path, tables):
+    new_dic = write_new_version(tmp_path)
+    categories = ["audit", "atom_site", "entity"]
+    diff = SchemaDiff(tables(categories, enums="lookup"), tables(categories + ["entity_poly"], path=new_dic, enums="lookup"))
+
+    assert [t.name for t in diff.added_tables] == ["entity_poly_type_lookup", "entity_poly"]
+    assert [(t.name, c.name) for t, c in diff.added_columns] == [("audit", "extra")]
+    assert [(t.name, old.subtype, new.subtype, new.nullable) for t, old, new in diff.altered_columns] == [
+        ("audit", "String(128)", "String(255)", True),
+    ]
+    assert [(t.name, start, values) for t, start, values in diff.added_lookup_values] == [
+        ("atom_site_group_PDB_lookup", 2, ["ANISOU"]),
+    ]
+    assert not diff.dropped_tables and not diff.dropped_columns
+
+    same = SchemaDiff(tables(categories), tables(categories))
+    assert not same
+
+
+def test_sql_migration_applies(tmp_path, tables):
+    new_dic = write_new_version(tmp_path)
+    old_tables = tables(["audit", "atom_site"], enums="lookup")
+    new_tables = tables(["audit", "atom_site", "entity"], path=new_dic, enums="lookup")
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}")
+    EntryLoader(engine, old_tables).create_tables()
+
+    output = io.StringIO()
+    SqlMigrationPrinter(fp=output, dialect="sqlite").print(SchemaDiff(old_tables, new_tables))
+    assert "-- audit.revision_id changes from String(128) to String(255)" in output.getvalue()
+
+    with engine.begin() as conn:
+        conn.connection.executescript(output.getvalue())
+
+    inspector = inspect(engine)
+    assert "entity" in inspector.get_table_names()
+    assert "extra" in [c["name"] for c in inspector.get_columns("audit")]
+    with engine.connect() as conn:
+        values = conn.execute(text('SELECT value FROM "atom_site_group_PDB_lookup" ORDER BY id')).scalars().all()
+    assert values == ["ATOM", "HETATM", "ANISOU"]
+
+
+def test_postgresql_statements(tmp_path, tables):
+    new_dic = write_new_version(tmp_path)
+    output = io.StringIO()
+    diff = SchemaDiff(tables(["audit", "atom_site"], enums="native"), tables(["audit"], path=new_dic, enums="native"))
+    SqlMigrationPrinter(fp=output, dialect="postgresql").print(diff)
+    statements = output.getvalue().splitlines()
+
+    assert statements == [
+        "ALTER TABLE audit ADD COLUMN extra INTEGER;",
+        "ALTER TABLE audit ALTER COLUMN revision_id TYPE VARCHAR(255);",
+        "ALTER TABLE audit ALTER COLUMN revision_id DROP NOT NULL;",
+        "DROP TABLE atom_site;",
+    ]
+
+    output = io.StringIO()
+    diff = SchemaDiff(tables(["atom_site"], enums="native"), tables(["atom_site"], path=new_dic, enums="native"))
+    SqlMigrationPrinter(fp=output, dialect="postgresql").print(diff)
+    assert output.getvalue() == "ALTER TYPE \"atom_site_group_PDB_enum\" ADD VALUE 'ANISOU';\n"
+
+
+def test_alembic_script(tmp_path, tables):
+    new_dic = write_new_version(tmp_path)
+    output = io.StringIO()
+    diff = SchemaDiff(tables(["audit"]), tables(["audit", "entity"], path=new_dic))
+    AlembicMigrationPrinter(fp=output, revision="abc123", down_revision="000000").print(diff)
+    script = output.getvalue()
+
+    compile(script, "migration.py", "exec")
+    assert 'revision = "abc123"' in script
+    assert 'down_revision = "000000"' in script
+    upgrade, downgrade = script.split("def downgrade():")
+    assert 'op.create_table("entity",' in upgrade
+    assert 'op.add_column("audit", sa.Column("extra", sa.Integer, nullable=True))' in upgrade
+    assert 'op.alter_column("audit", "revision_id", type_=sa.String(255), existing_type=sa.String(128), nullable=True, existing_nullable=False)' in upgrade
+    assert 'op.drop_column("audit", "extra")' in downgrade
+    assert 'op.drop_table("entity")' in downgrade
+
+
+def test_mandatory_column_added_nullable(tmp_path, tables):
+    with open(MINI_DIC) as f:
+        content = f.read().replace("save_chem_comp\n", EXTRA_ITEM.replace("mandatory_code          no", "mandatory_code          yes"), 1)
+    new_dic = tmp_path / "new.dic"
+    new_dic.write_text(content)
+    old_tables = tables(["audit"])
+    new_tables = tables(["audit"], path=str(new_dic))
+    engine = create_engine(f"sqlite:///{tmp_path / 'pdb.db'}")
+    loader = EntryLoader(engine, old_tables)
+    loader.create_tables()
+    loader.load_files([ENTRY])
+
+    diff = SchemaDiff(old_tables, new_tables)
+    assert diff.notes == ["audit.extra is mandatory but added nullable: fill it in, then set it NOT NULL"]
+    output = io.StringIO()
+    SqlMigrationPrinter(fp=output, dialect="sqlite").print(diff)
+    with engine.begin() as conn:
+        conn.connection.executescript(output.getvalue())
+    assert [c["nullable"] for c in inspect(engine).get_columns("audit") if c["name"] == "extra"] == [True]
+
+    output = io.StringIO()
+    AlembicMigrationPrinter(fp=output).print(diff)
+    assert 'op.add_column("audit", sa.Column("extra", sa.Integer, nullable=True))' in output.getvalue()
+
+
+def test_alembic_lookup_values_are_escaped(tmp_path, tables):
+    with open(MINI_DIC) as f:
+        content = f.read().replace(
+            '         HETATM   "coordinate records for non-standard residues"',
+            '         HETATM   "coordinate records for non-standard residues"\n         \'say "ATOM"\'   "a quoted value"',
+        )
+    new_dic = tmp_path / "new.dic"
+    new_dic.write_text(content)
+    output = io.StringIO()
+    diff = SchemaDiff(tables(["atom_site"], enums="lookup"), tables(["atom_site"], path=str(new_dic), enums="lookup"))
+    AlembicMigrationPrinter(fp=output).print(diff)
+
+    compile(output.getvalue(), "migration.py", "exec")
+    assert '[{"id": 3, "value": "say \\"ATOM\\""}]' in output.getvalue()
+
+
+def test_cli_diff(tmp_path):
+    new_dic = write_new_version(tmp_path)
+    output_file = tmp_path / "migration.sql"
+    result = CliRunner().invoke(cli, [
+        "diff", MINI_DIC, new_dic, "--categories", "audit", "--no-cache",
+        "--dialect", "mysql", "--output-file", str(output_file),
+    ])
+
+    assert result.exit_code == 0, result.output
+    assert output_file.read_text().splitlines() == [
+        "ALTER TABLE audit ADD COLUMN extra INTEGER;",
+        "ALTER TABLE audit MODIFY COLUMN revision_id VARCHAR(255);",
+    ]
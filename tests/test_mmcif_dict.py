@@ -1,10 +1,12 @@
+import pickle
 import pytest
 
-from mmcif_db_tool.mmcif_dict import DictReader, ItemFilter
+from mmcif_db_tool.mmcif_dict import CategoryGraph, DictReader, ItemFilter
+from tests.helpers import MINI_DIC
 
 
 def test_category():
-    cr = DictReader(path="./mmcif_pdbx_v50.dic")
+    cr = DictReader(path=MINI_DIC)
     categories = cr.get_categories(categories=["pdbx_initial_refinement_model"])
 
     assert len(categories) == 1
@@ -22,7 +24,7 @@ def test_category():
 
 
 def test_multiple_categories():
-    cr = DictReader(path="./mmcif_pdbx_v50.dic")
+    cr = DictReader(path=MINI_DIC)
     categories = cr.get_categories(categories=["pdbx_initial_refinement_model", "audit"])
 
     assert len(categories) == 2
@@ -47,7 +49,7 @@ def test_multiple_categories():
 def test_chem_comp_cats():
     # some chem_comp* categories don't contain the _item.category_id
     # value, so they are not parsed correctly
-    cr = DictReader(path="./mmcif_pdbx_v50.dic")
+    cr = DictReader(path=MINI_DIC)
     categories = cr.get_categories(categories=["chem_comp_angle"])
 
     assert len(categories) == 1
@@ -62,7 +64,7 @@ def test_chem_comp_cats():
 
 
 def test_grouped_items():
-    cr = DictReader(path="./mmcif_pdbx_v50.dic")
+    cr = DictReader(path=MINI_DIC)
     categories = cr.get_categories(categories=["chem_comp_angle"])
 
     assert categories[0].items[3].name == "comp_id"
@@ -71,7 +73,7 @@ def test_grouped_items():
 
 
 def test_last_category():
-    cr = DictReader(path="./mmcif_pdbx_v50.dic")
+    cr = DictReader(path=MINI_DIC)
     categories = cr.get_categories(categories=["diffrn_detector_element"])
 
     assert len(categories) == 1
@@ -83,7 +85,7 @@ def test_last_category():
 
 
 def test_filter_included():
-    cr = DictReader(path="./mmcif_pdbx_v50.dic")
+    cr = DictReader(path=MINI_DIC)
     filter = ItemFilter(include_items={"pdbx_initial_refinement_model.id"})
     categories = cr.get_categories(categories=["pdbx_initial_refinement_model"], filter=filter)
 
@@ -93,7 +95,7 @@ def test_filter_included():
 
 
 def test_filter_exclude():
-    cr = DictReader(path="./mmcif_pdbx_v50.dic")
+    cr = DictReader(path=MINI_DIC)
     filter = ItemFilter(exclude_items={"pdbx_initial_refinement_model.id"})
     categories = cr.get_categories(categories=["pdbx_initial_refinement_model"], filter=filter)
 
@@ -104,3 +106,82 @@ def test_filter_exclude():
     assert categories[0].items[2].name == "source_name"
     assert categories[0].items[3].name == "accession_code"
     assert categories[0].items[4].name == "details"
+
+
+def test_frame_index_single_scan():
+    cr = DictReader(path=MINI_DIC)
+    all_ids = list(cr._get_index().category_frames)
+    categories = cr.get_categories(categories=all_ids)
+
+    assert [c.id for c in categories] == all_ids
+    for category in categories:
+        single = cr.get_categories(categories=[category.id])
+        assert single == [category]
+
+
+def test_links():
+    cr = DictReader(path=MINI_DIC)
+    categories = cr.get_categories(categories=["atom_site", "chem_comp_angle", "entity"])
+
+    atom_site_links = [(l.parent_category, l.child_items, l.parent_items) for l in categories[0].links]
+    assert atom_site_links == [
+        ("struct_asym", ["label_asym_id"], ["id"]),
+        ("chem_comp", ["label_comp_id"], ["id"]),
+        ("entity", ["label_entity_id"], ["id"]),
+        ("chem_comp_atom", ["label_comp_id", "label_atom_id"], ["comp_id", "atom_id"]),
+    ]
+
+    # pairs from _item_linked that are not part of a link group
+    angle_links = [(l.parent_category, l.child_items) for l in categories[1].links]
+    assert ("chem_comp_atom", ["atom_id_2"]) in angle_links
+    assert ("chem_comp_atom", ["atom_id_3"]) in angle_links
+    assert ("chem_comp_atom", ["atom_id_1"]) not in angle_links
+
+    assert categories[2].links == []
+
+
+def test_enumerations():
+    cr = DictReader(path=MINI_DIC)
+    entity = cr.get_categories(categories=["entity"])[0]
+
+    items = {i.name: i for i in entity.items}
+    assert items["type"].enumerations == ["polymer", "non-polymer", "macrolide", "water", "branched"]
+    assert items["id"].enumerations == []
+
+
+def test_lazy_descriptions():
+    cr = DictReader(path=MINI_DIC)
+    entity = cr.get_categories(categories=["entity"])[0]
+    item = entity.items[0]
+
+    assert callable(item._description)
+    assert not hasattr(item, "__dict__")
+    assert "The value of _entity.id must uniquely identify" in item.description
+    assert item._description == item.description
+
+    # pickling resolves the descriptions still pending
+    copy = pickle.loads(pickle.dumps(entity))
+    assert copy == entity
+    assert copy.items[1].description == entity.items[1].description
+
+
+def test_category_graph():
+    graph = DictReader(path=MINI_DIC).get_category_graph(["atom_site", "entity", "struct_asym", "entity_poly", "chem_comp"])
+
+    assert graph.waves == [[["chem_comp"], ["entity"]], [["entity_poly"], ["struct_asym"]], [["atom_site"]]]
+    assert graph.order() == ["chem_comp", "entity", "entity_poly", "struct_asym", "atom_site"]
+    assert graph.deferred == set()
+
+
+def test_category_graph_cycles():
+    graph = CategoryGraph({
+        "child": ["a", "outside"],
+        "a": ["b", "root"],
+        "b": ["a"],
+        "root": [],
+        "tree": ["tree", "root"],
+    })
+
+    # categories in a cycle form one group, after the parents of any of them
+    assert graph.waves == [[["root"]], [["a", "b"], ["tree"]], [["child"]]]
+    assert graph.deferred == {("a", "b"), ("b", "a"), ("tree", "tree")}
@@ -0,0 +1,107 @@
+import datetime
+
+import pytest
+from click.testing import CliRunner
+
+pa = pytest.importorskip("pyarrow")
+pytest.importorskip("numpy")
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from mmcif_db_tool.cli import cli
+from mmcif_db_tool.parquet import ParquetExporter, arrow_schema, dictionary_columns
+from tests.helpers import ENTRY, MINI_DIC, STRUCTURE
+
+
+def write_entry(tmp_path, entry_id):
+    path = tmp_path / f"{entry_id}.cif"
+    path.write_text(f"data_{entry_id}\nloop_\n_entity.id\n_entity.type\n1 polymer\n2 water\n")
+    return str(path)
+
+
+def test_arrow_schema(tables):
+    by_name = {t.name: t for t in tables(STRUCTURE, ignore_relationships=True, enums="native")}
+    schema = arrow_schema(by_name["atom_site"])
+
+    assert schema.field("id").type == pa.string() and not schema.field("id").nullable
+    assert schema.field("Cartn_x").type == pa.float64() and schema.field("Cartn_x").nullable
+    assert schema.field("group_PDB").type == pa.dictionary(pa.int16(), pa.string())
+    assert arrow_schema(by_name["audit"]).field("creation_date").type == pa.timestamp("s")
+    assert arrow_schema(by_name["entity"]).field("pdbx_number_of_molecules").type == pa.int32()
+    assert "group_PDB" in dictionary_columns(by_name["atom_site"])
+    assert "Cartn_x" not in dictionary_columns(by_name["atom_site"])
+
+
+def test_chunks_and_row_groups(tmp_path, entry_structure_tables):
+    entries = [ENTRY, write_entry(tmp_path, "2XYZ"), write_entry(tmp_path, "3XYZ")]
+    output_dir = tmp_path / "out"
+    exporter = ParquetExporter(str(output_dir), entry_structure_tables, entries_per_file=2, row_group_size=4)
+    exporter.export_files(entries)
+
+    assert exporter.files["entity"] == ["entity/part-00000.parquet", "entity/part-00001.parquet"]
+    assert exporter.row_counts == {"audit": 1, "entity": 7, "atom_site": 6}
+    assert pq.ParquetFile(output_dir / "atom_site" / "part-00000.parquet").metadata.num_row_groups == 2
+
+    entity = ds.dataset(output_dir / "entity").to_table().to_pydict()
+    assert entity["entry_id"] == ["1ABC"] * 3 + ["2XYZ"] * 2 + ["3XYZ"] * 2
+    assert entity["pdbx_number_of_molecules"][:3] == [2, 1, None]
+    audit = ds.dataset(output_dir / "audit").to_table().to_pylist()
+    assert audit[0]["creation_date"] == datetime.datetime(2021, 3, 4)
+    assert audit[0]["creation_method"] is None
+
+    encodings = pq.ParquetFile(output_dir / "atom_site" / "part-00000.parquet").metadata.row_group(0).column(1).encodings
+    assert "RLE_DICTIONARY" in encodings
+
+
+def test_whole_row_groups(tmp_path, entry_structure_tables):
+    output_dir = tmp_path / "out"
+    exporter = ParquetExporter(str(output_dir), entry_structure_tables, row_group_size=4)
+    exporter.export_files([ENTRY] * 5)
+
+    metadata = pq.ParquetFile(output_dir / "entity" / "part-00000.parquet").metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [4, 4, 4, 3]
+
+
+def test_partition_by_entry(tmp_path, entry_structure_tables):
+    entries = [ENTRY, write_entry(tmp_path, "2XYZ")]
+    output_dir = tmp_path / "out"
+    exporter = ParquetExporter(str(output_dir), entry_structure_tables, partition_by="entry")
+    exporter.export_files(entries)
+
+    assert exporter.files["entity"] == ["entity/entry_id=1ABC/part-00000.parquet", "entity/entry_id=2XYZ/part-00001.parquet"]
+    entity = ds.dataset(output_dir / "entity", partitioning="hive").to_table()
+    assert "entry_id" not in pq.read_schema(output_dir / exporter.files["entity"][0]).names
+    assert sorted(entity.column("entry_id").to_pylist()) == ["1ABC"] * 3 + ["2XYZ"] * 2
+
+
+def test_cli_parquet(tmp_path):
+    bad = tmp_path / "bad.cif"
+    bad.write_text("data_BAD\n_audit.revision_id 1\n_audit.creation_date yesterday\n")
+    result = CliRunner().invoke(cli, [
+        "parquet", MINI_DIC, ENTRY, str(bad), "--categories", "audit,entity", "--no-cache",
+        "--output-dir", str(tmp_path / "out"), "--enums", "lookup",
+    ])
+
+    assert result.exit_code == 1
+    assert "entity: 3 rows" in result.output
+    assert f"Failed {bad}" in result.output
+    assert ds.dataset(tmp_path / "out" / "entity").to_table().num_rows == 3
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_null_in_mandatory_item_fails_entry(tmp_path, workers, tables):
+    bad = tmp_path / "2bad.cif"
+    with open(ENTRY) as f:
+        bad.write_text(f.read().replace("1ABC", "2BAD").replace('GLY "peptide linking"', "GLY ?"))
+    output_dir = tmp_path / "out"
+    exporter = ParquetExporter(str(output_dir), tables(["entity", "chem_comp"], ignore_relationships=True, entry_column="entry_id"))
+    if workers > 1:
+        exporter.export_files_parallel([ENTRY, str(bad)], workers)
+    else:
+        exporter.export_files([ENTRY, str(bad)])
+
+    assert list(exporter.failed) == [str(bad)]
+    assert "_chem_comp.type" in exporter.failed[str(bad)]
+    assert exporter.row_counts == {"entity": 3, "chem_comp": 4}
+    assert ds.dataset(output_dir / "chem_comp").to_table().column("entry_id").to_pylist() == ["1ABC"] * 4
@@ -0,0 +1,86 @@
+import pytest
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine, text
+
+pytest.importorskip("aiosqlite")
+
+from mmcif_db_tool.cli import cli
+from mmcif_db_tool.loader import EntryLoader
+from mmcif_db_tool.pipeline import PipelineLoader
+from tests.helpers import ENTRY, MINI_DIC
+
+CATEGORIES = ["audit", "entity", "entity_poly", "struct_asym", "atom_site"]
+
+
+def write_entries(tmp_path, n):
+    content = open(ENTRY).read()
+    paths = []
+    for i in range(n):
+        path = tmp_path / f"{i}abc.cif"
+        path.write_text(content.replace("1ABC", f"{i}ABC"))
+        paths.append(str(path))
+    return paths
+
+
+def table_rows(url, tables):
+    with create_engine(url).connect() as conn:
+        return {t.name: conn.execute(text(f"SELECT * FROM {t.name} ORDER BY 1, 2")).fetchall() for t in tables}
+
+
+def test_same_rows_as_entry_loader(tmp_path, tables):
+    entry_tables = tables(CATEGORIES, entry_column="entry_id", enums="lookup")
+    paths = write_entries(tmp_path, 5)
+
+    expected = EntryLoader(create_engine(f"sqlite:///{tmp_path / 'expected.db'}"), entry_tables)
+    expected.create_tables()
+    expected.load_files(paths)
+
+    pipeline = PipelineLoader(str(tmp_path / "pipeline.db"), entry_tables, readers=2, parsers=2, writers=2, queue_size=1)
+    pipeline.create_tables()
+    pipeline.load_files(paths)
+
+    assert pipeline.row_counts == expected.row_counts
+    assert pipeline.row_counts["atom_site"] == 30
+    assert table_rows(f"sqlite:///{tmp_path / 'pipeline.db'}", entry_tables) == table_rows(f"sqlite:///{tmp_path / 'expected.db'}", entry_tables)
+
+
+def test_failures_are_skipped(tmp_path, tables):
+    bad = tmp_path / "bad.cif"
+    bad.write_text("data_BAD\n_audit.revision_id 1\n_audit.creation_date yesterday\n")
+    statuses = []
+    pipeline = PipelineLoader(str(tmp_path / "pdb.db"), tables(CATEGORIES, entry_column="entry_id"), parsers=1, progress=lambda path, status: statuses.append(status))
+    pipeline.create_tables()
+    # the same entry twice breaks its primary keys
+    pipeline.load_files([str(bad), ENTRY, ENTRY, str(tmp_path / "missing.cif")])
+
+    assert sorted(pipeline.failed) == sorted([str(bad), ENTRY, str(tmp_path / "missing.cif")])
+    assert "IntegrityError" in pipeline.failed[ENTRY]
+    assert sorted(statuses) == ["failed", "failed", "failed", "loaded"]
+    assert pipeline.row_counts["atom_site"] == 6
+
+
+def test_cli_load_pipeline(tmp_path):
+    args = [
+        "load", MINI_DIC, ENTRY, "--categories", "entity,atom_site", "--no-cache", "--entry-column", "entry_id",
+        "--db-url", f"sqlite:///{tmp_path / 'pdb.db'}", "--create-tables", "--pipeline", "--workers", "2", "--readers", "2",
+    ]
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert "atom_site: 6 rows" in result.output
+
+
+def test_cli_pipeline_needs_sqlite():
+    result = CliRunner().invoke(cli, [
+        "load", MINI_DIC, ENTRY, "--categories", "entity", "--db-url", "postgresql://localhost/pdb", "--pipeline",
+    ])
+    assert result.exit_code == 2
+    assert "--pipeline writes to a SQLite database file" in result.output
+
+
+def test_cli_pipeline_rejects_table_workers(tmp_path):
+    result = CliRunner().invoke(cli, [
+        "load", MINI_DIC, ENTRY, "--categories", "entity", "--db-url", f"sqlite:///{tmp_path / 'pdb.db'}", "--pipeline", "--table-workers", "2",
+    ])
+    assert result.exit_code == 2
+    assert "--pipeline cannot be combined with --memory-budget, --journal or --table-workers" in result.output
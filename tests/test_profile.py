@@ -0,0 +1,71 @@
+import io
+import pytest
+
+from mmcif_db_tool.mmcif_dict import DictReader
+from mmcif_db_tool.profile import CorpusProfile, ItemStats, profile_files
+from mmcif_db_tool.schema_map import SchemaMap, SqlAlchemyCorePrinter, SqlAlchemyOrmPrinter
+from tests.helpers import ENTRY, MINI_DIC
+
+
+def test_item_stats():
+    stats = ItemStats()
+    stats.add(["1", "?", "-20", "."])
+    assert (stats.rows, stats.nulls, stats.kind, stats.min, stats.max) == (4, 2, "int", -20, 1)
+    assert stats.null_ratio == 0.5
+
+    stats.add(["2.5(3)"])
+    assert (stats.kind, stats.min, stats.max) == ("float", -20, 2.5)
+
+    stats.add(["'long text value'"])
+    assert (stats.kind, stats.min, stats.max, stats.max_length) == ("str", None, None, 15)
+
+
+def test_profile_files(tmp_path):
+    other = tmp_path / "2xyz.cif"
+    other.write_text("data_2XYZ\nloop_\n_entity.id\n_entity.pdbx_number_of_molecules\n1 70000\n2 ?\n")
+    bad = tmp_path / "bad.cif"
+    bad.write_text("data_BAD\nloop_\n_entity.id\n_entity.type\n1\n")
+
+    profile, failed = profile_files([ENTRY, str(other), str(bad)], workers=2)
+    assert list(failed) == [str(bad)]
+    assert profile.files == 2
+
+    molecules = profile.get("_entity.pdbx_number_of_molecules")
+    assert (molecules.rows, molecules.nulls, molecules.min, molecules.max) == (5, 2, 1, 70000)
+    assert profile.get("_ATOM_SITE.Cartn_x").kind == "float"
+
+    path = tmp_path / "profile.json"
+    profile.save(str(path))
+    loaded = CorpusProfile.load(str(path))
+    assert loaded.files == 2
+    assert loaded.get("_entity.pdbx_number_of_molecules").to_dict() == molecules.to_dict()
+
+
+def test_sized_columns():
+    profile = CorpusProfile({
+        "_entity.id": ItemStats(rows=10, max_length=3, kind="int", min=1, max=100),
+        "_entity.type": ItemStats(rows=10, max_length=11, kind="str"),
+        "_entity.pdbx_number_of_molecules": ItemStats(rows=10, max_length=10, kind="int", min=1, max=2 ** 32),
+        "_entity_poly.pdbx_seq_one_letter_code": ItemStats(rows=10, max_length=5000, kind="str"),
+        "_entity_poly.type": ItemStats(rows=10, nulls=10),
+    })
+    categories = DictReader(path=MINI_DIC).get_categories(categories=["entity", "entity_poly"])
+
+    output = io.StringIO()
+    sm = SchemaMap(printer=SqlAlchemyCorePrinter(fp=output), ignore_relationships=True, profile=profile)
+    sm.add_categories(categories)
+    sm.print_models()
+    content = output.getvalue()
+
+    assert 'Column("id", String(3), primary_key=True)' in content
+    assert 'Column("type", String(11), nullable=True)' in content
+    assert 'Column("pdbx_number_of_molecules", BigInteger, nullable=True' in content
+    assert 'Column("pdbx_seq_one_letter_code", Text, nullable=True)' in content
+    # no values seen, the dictionary width is kept
+    assert 'Column("type", String(128), nullable=True)' in content
+
+    output = io.StringIO()
+    sm = SchemaMap(printer=SqlAlchemyOrmPrinter(fp=output), ignore_relationships=True, profile=profile)
+    sm.add_categories(categories)
+    sm.print_models()
+    assert "pdbx_number_of_molecules: Mapped[Optional[int]] = mapped_column(type_=BigInteger" in output.getvalue()
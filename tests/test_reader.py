@@ -0,0 +1,162 @@
+import gzip
+
+import pytest
+from gemmi import cif
+from sqlalchemy import create_engine, text
+
+np = pytest.importorskip("numpy")
+msgpack = pytest.importorskip("msgpack")
+
+from mmcif_db_tool.bcif import decode
+from mmcif_db_tool.columnar import category_arrays
+from mmcif_db_tool.loader import EntryLoader, iter_entry_files
+from mmcif_db_tool.reader import detect_format, read_block
+from tests.helpers import ENTRY, STRUCTURE
+
+
+def pack(values):
+    """Integer packing of `values` into signed bytes."""
+    packed = []
+    for v in values:
+        while v >= 127:
+            packed.append(127)
+            v -= 127
+        while v <= -128:
+            packed.append(-128)
+            v += 128
+        packed.append(v)
+    return packed
+
+
+def encode_integers(values):
+    deltas = [0] + [b - a for a, b in zip(values, values[1:])]
+    data = np.array(pack(deltas), dtype="<i1").tobytes()
+    return data, [
+        {"kind": "Delta", "origin": values[0] if values else 0, "srcType": 3},
+        {"kind": "IntegerPacking", "byteCount": 1, "isUnsigned": False, "srcSize": len(values)},
+        {"kind": "ByteArray", "type": 1},
+    ]
+
+
+def encode_column(raw):
+    nulls = [cif.is_null(v) for v in raw]
+    values = ["" if n else cif.as_string(v) for v, n in zip(raw, nulls)]
+    present = [v for v, n in zip(values, nulls) if not n]
+    try:
+        data, encoding = encode_integers([int(v) if v else 0 for v in values])
+        assert present
+    except (ValueError, AssertionError):
+        try:
+            data, encoding = encode_integers([round(float(v) * 1000) if v else 0 for v in values])
+            encoding = [{"kind": "FixedPoint", "factor": 1000, "srcType": 33}] + encoding
+            assert present
+        except (ValueError, AssertionError):
+            strings = sorted(set(values))
+            offsets = [0]
+            for s in strings:
+                offsets.append(offsets[-1] + len(s))
+            data, data_encoding = encode_integers([strings.index(v) for v in values])
+            offset_data, offset_encoding = encode_integers(offsets)
+            encoding = [{
+                "kind": "StringArray", "dataEncoding": data_encoding, "stringData": "".join(strings),
+                "offsetEncoding": offset_encoding, "offsets": offset_data,
+            }]
+
+    column = {"data": {"data": data, "encoding": encoding}, "mask": None}
+    if any(nulls):
+        markers = [2 if v == "?" else 1 if n else 0 for v, n in zip(raw, nulls)]
+        runs = []
+        for m in markers:
+            if runs and runs[-2] == m:
+                runs[-1] += 1
+            else:
+                runs += [m, 1]
+        column["mask"] = {
+            "data": np.array(runs, dtype="<i4").tobytes(),
+            "encoding": [{"kind": "RunLength", "srcType": 4, "srcSize": len(markers)}, {"kind": "ByteArray", "type": 3}],
+        }
+    return column
+
+
+def write_bcif(path, source=ENTRY, compress=False):
+    block = cif.read_file(source).sole_block()
+    categories = []
+    for prefix in block.get_mmcif_category_names():
+        category = block.find_mmcif_category(prefix)
+        categories.append({
+            "name": prefix[:-1],
+            "rowCount": len(category),
+            "columns": [{"name": tag[len(prefix):], **encode_column(list(category.column(i)))} for i, tag in enumerate(category.tags)],
+        })
+    data = msgpack.packb({"version": "0.3.0", "encoder": "test", "dataBlocks": [{"header": block.name, "categories": categories}]})
+    with open(path, "wb") as f:
+        f.write(gzip.compress(data) if compress else data)
+    return str(path)
+
+
+def test_decode():
+    data, encoding = encode_integers([0, 300, -500, 7, 7, 7])
+    assert decode(data, encoding).tolist() == [0, 300, -500, 7, 7, 7]
+
+    runs = np.array([5, 3, 1, 2], dtype="<i4").tobytes()
+    assert decode(runs, [{"kind": "RunLength", "srcType": 3, "srcSize": 5}, {"kind": "ByteArray", "type": 3}]).tolist() == [5, 5, 5, 1, 1]
+
+    packed = np.array([255, 45, 3], dtype="<u1").tobytes()
+    assert decode(packed, [{"kind": "IntegerPacking", "byteCount": 1, "isUnsigned": True, "srcSize": 2}, {"kind": "ByteArray", "type": 4}]).tolist() == [300, 3]
+
+    steps = np.array([0, 5, 10], dtype="<i4").tobytes()
+    quantized = decode(steps, [{"kind": "IntervalQuantization", "min": 1.0, "max": 2.0, "numSteps": 11, "srcType": 33}, {"kind": "ByteArray", "type": 3}])
+    assert np.allclose(quantized, [1.0, 1.5, 2.0])
+
+    with pytest.raises(ValueError, match="Unsupported BinaryCIF encoding 'Zstd'"):
+        decode(b"", [{"kind": "Zstd"}])
+
+
+def test_detect_format(tmp_path):
+    compressed = tmp_path / "1abc.cif.gz"
+    with open(ENTRY, "rb") as f:
+        compressed.write_bytes(gzip.compress(f.read()))
+    # the format is told from the content, not the name
+    binary = write_bcif(tmp_path / "1abc.cif")
+
+    assert detect_format(ENTRY) == "cif"
+    assert detect_format(str(compressed)) == "cif.gz"
+    assert detect_format(binary) == "bcif"
+    assert detect_format(write_bcif(tmp_path / "1abc.bcif.gz", compress=True)) == "bcif.gz"
+    assert read_block(str(compressed)).find_value("_entry.id") == "1ABC"
+
+    block = read_block(binary)
+    assert block.name == "1ABC" and block.find_value("_entry.id") == "1ABC"
+    assert list(block.find_mmcif_category("_audit.").column(2)) == ["?"]
+    assert block.find_mmcif_category("_chem_comp.").column(1)[0] == "'L-peptide linking'"
+
+
+def test_load_binary_cif(tmp_path, tables):
+    binary = write_bcif(tmp_path / "1abc.bcif.gz", compress=True)
+    assert list(iter_entry_files([str(tmp_path)])) == [binary]
+
+    rows = {}
+    for name, path in [("text", ENTRY), ("binary", binary)]:
+        engine = create_engine("sqlite://")
+        loader = EntryLoader(engine, tables(STRUCTURE, ignore_relationships=True, entry_column="entry_id", enums="lookup"), memory_budget=1024 if name == "binary" else None)
+        loader.create_tables()
+        loader.load_files([path])
+        assert not loader.failed
+        with engine.connect() as conn:
+            rows[name] = {c: conn.execute(text(f"SELECT * FROM {c} ORDER BY 1, 2")).fetchall() for c in STRUCTURE}
+
+    assert rows["binary"] == rows["text"]
+    assert rows["binary"]["atom_site"][3][-2:] == (-4.25, 0.5)
+
+
+def test_binary_category_arrays(tmp_path, tables):
+    text_block = cif.read_file(ENTRY).sole_block()
+    binary_block = read_block(write_bcif(tmp_path / "1abc.bcif"))
+
+    for table in tables(STRUCTURE, ignore_relationships=True, entry_column="entry_id", enums="lookup"):
+        if table.lookup_values:
+            continue
+        expected = category_arrays(text_block, table)
+        arrays = category_arrays(binary_block, table)
+        assert {k: a.to_list() for k, a in arrays.items()} == {k: a.to_list() for k, a in expected.items()}
+        assert arrays.keys() == expected.keys()
@@ -1,8 +1,13 @@
+import io
 import pytest
 import tempfile
 
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
 from mmcif_db_tool.schema_map import SchemaMap, SqlAlchemyOrmPrinter, SqlAlchemyCorePrinter
-from mmcif_db_tool.mmcif_dict import DictReader
+from mmcif_db_tool.mmcif_dict import Category, DictReader, Item, Link
+from tests.helpers import MINI_DIC
 
 
 def test_orm_model():
@@ -42,3 +47,167 @@ def test_core_model():
         assert 'Column("atom_id_3", String(6), primary_key=True' in content
         assert 'Column("comp_id", String(10), primary_key=True' in content
         assert 'Column("value_angle", Float),' in content
+
+
+def print_mini(printer, categories, **kwargs):
+    output = io.StringIO()
+    mp = printer(fp=output, include_imports=False)
+    kwargs.setdefault("ignore_relationships", True)
+    sm = SchemaMap(printer=mp, **kwargs)
+    sm.add_categories(DictReader(path=MINI_DIC).get_categories(categories=categories))
+    sm.print_models()
+    return output.getvalue()
+
+
+def test_entry_column_core():
+    content = print_mini(SqlAlchemyCorePrinter, ["entity"], entry_column="entry_id", partition_by="list")
+
+    assert 'metadata_obj,\n    Column("entry_id", String(20), primary_key=True),\n    Column("id", String(20), primary_key=True)' in content
+    assert 'postgresql_partition_by="LIST (entry_id)"\n)' in content
+
+
+def test_entry_column_orm():
+    content = print_mini(SqlAlchemyOrmPrinter, ["entity"], entry_column="entry_id", partition_by="hash")
+
+    assert '__table_args__ = {"postgresql_partition_by": "HASH (entry_id)"}' in content
+    assert "\n\n    entry_id: Mapped[str] = mapped_column(primary_key=True, type_=String(20))\n    id: Mapped[str]" in content
+
+
+def test_entry_column_without_partitioning():
+    content = print_mini(SqlAlchemyOrmPrinter, ["entity"], entry_column="entry_id")
+
+    assert "__table_args__" not in content
+    assert "entry_id: Mapped[str] = mapped_column(primary_key=True" in content
+
+
+def test_foreign_keys_core():
+    content = print_mini(SqlAlchemyCorePrinter, ["atom_site", "chem_comp", "chem_comp_atom", "entity", "struct_asym"], ignore_relationships=False)
+
+    assert 'Column("label_entity_id", String(20), ForeignKey("entity.id")),' in content
+    assert 'ForeignKeyConstraint(["label_comp_id", "label_atom_id"], ["chem_comp_atom.comp_id", "chem_comp_atom.atom_id"]),' in content
+    assert 'Index("ix_atom_site_label_entity_id", "label_entity_id")' in content
+    assert 'Index("ix_atom_site_label_comp_id_label_atom_id", "label_comp_id", "label_atom_id")' in content
+    # led by the composite index
+    assert '"ix_atom_site_label_comp_id"' not in content
+
+
+def test_foreign_keys_orm_entry_column():
+    content = print_mini(SqlAlchemyOrmPrinter, ["entity", "entity_poly"], ignore_relationships=False, entry_column="entry_id")
+
+    assert 'ForeignKeyConstraint(["entry_id", "entity_id"], ["entity.entry_id", "entity.id"]),' in content
+    # entity_id is the primary key of entity_poly, so it needs no index
+    assert "Index(" not in content
+
+
+def test_indexes_without_foreign_keys():
+    content = print_mini(SqlAlchemyOrmPrinter, ["atom_site", "entity"], ignore_relationships=False, foreign_keys=False)
+
+    assert "ForeignKey" not in content
+    assert 'Index("ix_atom_site_label_entity_id", "label_entity_id"),' in content
+
+
+def test_foreign_keys_need_parent_key():
+    # chem_comp_atom is keyed by (comp_id, atom_id)
+    content = print_mini(SqlAlchemyCorePrinter, ["chem_comp_angle", "chem_comp_atom"], ignore_relationships=False)
+
+    assert '["chem_comp_atom.atom_id"]' not in content
+    assert 'Index("ix_chem_comp_angle_atom_id_2", "atom_id_2")' in content
+
+
+def test_links_from_entry_column():
+    # _struct.entry_id -> _entry.id is already scoped to the entry
+    entry = Category("entry", "", ["id"], [Item("_entry.id", "id", "", True, "code", None, index=True)], [])
+    struct = Category("struct", "", ["entry_id"], [
+        Item("_struct.entry_id", "entry_id", "", True, "code", None, index=True),
+        Item("_struct.title", "title", "", False, "text", None),
+    ], [Link("entry", ["entry_id"], ["id"])])
+    sm = SchemaMap(entry_column="entry_id")
+    sm.add_categories([entry, struct])
+    tables = {t.name: t for t in sm.get_tables()}
+
+    assert [c.name for c in tables["struct"].columns] == ["entry_id", "title"]
+    assert tables["struct"].indexes == []
+    assert all(len(set(fk.columns)) == len(fk.columns) for fk in tables["struct"].foreign_keys)
+
+    sm.build_metadata().create_all(create_engine("sqlite://"))
+
+
+def test_relationships():
+    content = print_mini(
+        SqlAlchemyOrmPrinter,
+        ["entity", "entity_poly", "struct_asym"],
+        ignore_relationships=False,
+    )
+
+    assert 'entity_poly: Mapped[Optional["EntityPoly"]] = relationship(back_populates="entity", primaryjoin="Entity.id == foreign(EntityPoly.entity_id)")' in content
+    assert 'struct_asym: Mapped[List["StructAsym"]] = relationship(back_populates="entity", primaryjoin="Entity.id == foreign(StructAsym.entity_id)")' in content
+    assert 'entity: Mapped["Entity"] = relationship(back_populates="struct_asym", primaryjoin="Entity.id == foreign(StructAsym.entity_id)")' in content
+
+
+def test_relationships_lazy_per_pair():
+    output = io.StringIO()
+    mp = SqlAlchemyOrmPrinter(fp=output, lazy={("entity", "entity_poly"): "selectin"}, default_lazy="raise")
+    sm = SchemaMap(printer=mp, entry_column="entry_id")
+    sm.add_categories(DictReader(path=MINI_DIC).get_categories(categories=["entity", "entity_poly"]))
+    sm.print_models()
+    content = output.getvalue()
+
+    assert 'entity_poly: Mapped[Optional["EntityPoly"]] = relationship(back_populates="entity", primaryjoin="and_(Entity.entry_id == foreign(EntityPoly.entry_id), Entity.id == foreign(EntityPoly.entity_id))", lazy="selectin")' in content
+    assert 'entity: Mapped["Entity"] = relationship(back_populates="entity_poly", primaryjoin="and_(Entity.entry_id == foreign(EntityPoly.entry_id), Entity.id == foreign(EntityPoly.entity_id))", lazy="raise")' in content
+
+
+def test_relationships_fixed_queries():
+    output = io.StringIO()
+    mp = SqlAlchemyOrmPrinter(fp=output, include_imports=True, default_lazy="selectin")
+    sm = SchemaMap(printer=mp, entry_column="entry_id", foreign_keys=False)
+    sm.add_categories(DictReader(path=MINI_DIC).get_categories(categories=["entity", "entity_poly", "struct_asym"]))
+    sm.print_models()
+
+    models = {}
+    exec(output.getvalue(), models)
+    Entity, EntityPoly, StructAsym = models["Entity"], models["EntityPoly"], models["StructAsym"]
+
+    engine = create_engine("sqlite://")
+    models["Base"].metadata.create_all(engine)
+    with Session(engine) as session:
+        for entry_id in ["1ABC", "2XYZ", "3DEF"]:
+            session.add(Entity(entry_id=entry_id, id="1"))
+            session.add(EntityPoly(entry_id=entry_id, entity_id="1"))
+            session.add_all([StructAsym(entry_id=entry_id, id=i, entity_id="1") for i in "AB"])
+        session.commit()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    with Session(engine) as session:
+        entities = session.scalars(select(Entity)).all()
+        assert [len(e.struct_asym) for e in entities] == [2, 2, 2]
+        assert all(e.entity_poly.entity is e for e in entities)
+
+    assert len(statements) == 3
+
+
+def test_enums_native_core():
+    content = print_mini(SqlAlchemyCorePrinter, ["entity"], enums="native")
+
+    assert 'Column("type", Enum("polymer", "non-polymer", "macrolide", "water", "branched", name="entity_type_enum"), nullable=True)' in content
+    assert 'Column("id", String(20), primary_key=True)' in content
+
+
+def test_enums_lookup_orm():
+    output = io.StringIO()
+    mp = SqlAlchemyOrmPrinter(fp=output, include_imports=True)
+    sm = SchemaMap(printer=mp, enums="lookup", ignore_relationships=True)
+    sm.add_categories(DictReader(path=MINI_DIC).get_categories(categories=["entity"]))
+    sm.print_models()
+    content = output.getvalue()
+
+    assert "__tablename__ = 'entity_type_lookup'" in content
+    assert 'type: Mapped[Optional[int]] = mapped_column(ForeignKey("entity_type_lookup.id"), type_=SmallInteger)' in content
+
+    models = {}
+    exec(content, models)
+    engine = create_engine("sqlite://")
+    models["Base"].metadata.create_all(engine)
+    with Session(engine) as session:
+        lookup = session.execute(select(models["EntityTypeLookup"].value).order_by(models["EntityTypeLookup"].id)).scalars().all()
+    assert lookup == ["polymer", "non-polymer", "macrolide", "water", "branched"]
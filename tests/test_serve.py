@@ -0,0 +1,139 @@
+import os
+import json
+import shutil
+import socket
+import threading
+import urllib.request
+import urllib.error
+
+import pytest
+
+from mmcif_db_tool.serve import HttpServer, RequestError, SchemaService, UnixServer
+from tests.helpers import MINI_DIC
+
+
+@pytest.fixture
+def service():
+    return SchemaService(MINI_DIC)
+
+
+def serving(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def test_requests(service):
+    assert "atom_site" in json.loads(service.handle({"request": "categories"}))
+
+    entity = json.loads(service.handle({"request": "category", "category": "entity", "exclude_items": ["entity.pdbx_number_of_molecules"]}))
+    assert [i["name"] for i in entity["items"]] == ["id", "type"]
+    assert entity["key_names"] == ["id"]
+
+    tables = json.loads(service.handle({"request": "tables", "categories": ["entity"], "entry_column": "entry_id", "enums": "lookup"}))
+    assert [t["name"] for t in tables] == ["entity_type_lookup", "entity"]
+    assert [c["name"] for c in tables[1]["columns"]][:2] == ["entry_id", "id"]
+
+    source = json.loads(service.handle({"request": "models", "categories": ["entity"], "model": "core"}))
+    assert 'entity = Table("entity",\n    metadata_obj' in source
+    assert "class Entity" in json.loads(service.handle({"request": "models", "categories": ["entity"]}))
+
+
+def test_responses_are_memoized(service):
+    request = {"request": "models", "categories": ["entity", "audit"], "model": "orm"}
+    first = service.handle(request)
+    assert service.handle(dict(request)) is first
+    assert service.handle({**request, "categories": ["audit", "entity"]}) is not first
+    assert service.handle({**request, "exclude_items": ["audit.update_record"]}) is not first
+
+
+@pytest.mark.parametrize("request_, error", [
+    ({"request": "drop"}, "unknown request 'drop'"),
+    ({"request": "category", "category": "nope"}, "unknown category 'nope'"),
+    ({"request": "category", "category": ["entity"]}, "category must be a category name"),
+    ({"request": "category", "category": "entity", "include_items": "entity.id"}, "include_items must be a list of category.item names"),
+    ({"request": "tables", "categories": ["entity"], "exclude_items": ["type"]}, "exclude_items must be a list of category.item names"),
+    ({"request": "tables", "categories": ["entity", "nope", "gone"]}, "unknown categories 'nope', 'gone'"),
+    ({"request": "models", "categories": ["nope"]}, "unknown category 'nope'"),
+    ({"request": "tables", "categories": "entity"}, "categories must be a list"),
+    ({"request": "models", "categories": ["entity"], "model": "raw"}, "model must be one of"),
+    ({"request": "tables", "categories": ["entity"], "model": "orm"}, "unknown options model"),
+])
+def test_bad_requests(service, request_, error):
+    with pytest.raises(RequestError, match=error):
+        service.handle(request_)
+
+
+def test_requests_run_concurrently(service):
+    started, release = threading.Event(), threading.Event()
+    tables = service._tables
+
+    def slow_tables(reader, request):
+        started.set()
+        release.wait(5)
+        return tables(reader, request)
+
+    service._tables = slow_tables
+    slow = threading.Thread(target=service.handle, args=({"request": "tables", "categories": ["entity"]},))
+    slow.start()
+    assert started.wait(5)
+    try:
+        # answered while the slow request is still being computed
+        assert "entity" in json.loads(service.handle({"request": "categories"}))
+        assert slow.is_alive()
+    finally:
+        release.set()
+        slow.join()
+
+
+def test_hot_reload(tmp_path):
+    path = tmp_path / "mini.dic"
+    shutil.copy(MINI_DIC, path)
+    service = SchemaService(str(path))
+    before = service.handle({"request": "category", "category": "entity"})
+    assert service.handle({"request": "category", "category": "entity"}) is before
+
+    path.write_text(path.read_text().replace('"_entity.type"', '"_entity.kind"'))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    items = [i["name"] for i in json.loads(service.handle({"request": "category", "category": "entity"}))["items"]]
+    assert "kind" in items and "type" not in items
+
+
+def test_http(service):
+    server = serving(HttpServer(service, 0))
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{url}/tables?categories=entity,audit&links=indexes") as response:
+            assert sorted(t["name"] for t in json.load(response)) == ["audit", "entity"]
+
+        body = json.dumps({"categories": ["entity"], "model": "core"}).encode()
+        with urllib.request.urlopen(urllib.request.Request(f"{url}/models", data=body)) as response:
+            assert '"entity"' in json.load(response)
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"{url}/category?category=nope")
+        assert e.value.code == 400
+        assert json.load(e.value) == {"error": "unknown category 'nope'"}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_unix_socket(service, tmp_path):
+    path = str(tmp_path / "serve.sock")
+    server = serving(UnixServer(service, path))
+    try:
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(path)
+            f = client.makefile("rwb")
+            f.write(b'{"request": "categories"}\n{"request": "category"}\nnot json\n')
+            f.flush()
+            assert "entity" in json.loads(f.readline())["result"]
+            assert json.loads(f.readline()) == {"error": "category must be a category name"}
+            assert "invalid JSON" in json.loads(f.readline())["error"]
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not os.path.exists(path)